@@ -36,7 +36,7 @@ from bpy.props import *
 from bpy.types import Menu, Operator, UIList, AddonPreferences
 from bpy_extras.object_utils import object_data_add
 from cam import ui, ops, curvecamtools, curvecamequation, curvecamcreate, utils, simple, \
-    polygon_utils_cam  # , post_processors
+    polygon_utils_cam, batch  # , post_processors
 from mathutils import *
 from shapely import geometry as sgeometry
 
@@ -113,12 +113,33 @@ class CamAddonPreferences(AddonPreferences):
         name="Show experimental features",
         default=False,
     )
+    cache_size_limit: IntProperty(
+        name="Image cache size limit in MB",
+        description="Maximum size of cached z-buffer and offset images in the temp_cam directory, "
+                    "least recently used images are removed first",
+        default=2048, min=16,
+    )
+    sampling_processes: IntProperty(
+        name="Sampling processes",
+        description="Number of processes sampling large paths in parallel, 0 uses all processor cores, "
+                    "1 samples only in Blender",
+        default=0, min=0, max=256,
+    )
+    batch_processes: IntProperty(
+        name="Background processes",
+        description="Number of background Blender processes calculating operations at once, "
+                    "0 uses all processor cores",
+        default=0, min=0, max=256,
+    )
 
     def draw(self, context):
         layout = self.layout
         layout.label(text="Use experimental features when you want to help development of Blender CAM:")
 
         layout.prop(self, "experimental")
+        layout.prop(self, "cache_size_limit")
+        layout.prop(self, "sampling_processes")
+        layout.prop(self, "batch_processes")
 
 
 class machineSettings(bpy.types.PropertyGroup):
@@ -166,6 +187,24 @@ class machineSettings(bpy.types.PropertyGroup):
                                           precision=PRECISION, unit='LENGTH')
     feedrate_default: bpy.props.FloatProperty(name="Feedrate default /min", default=1.5, min=0.00001, max=320000,
                                               precision=PRECISION, unit='LENGTH')
+    acceleration: bpy.props.FloatVectorProperty(name='Acceleration /s²',
+                                                description='Acceleration of the machine axes, used to smooth '
+                                                            'feedrates adjusted by simulation',
+                                                default=(0.5, 0.5, 0.5), min=0.00001, max=1000,
+                                                precision=PRECISION, subtype="XYZ", unit='ACCELERATION')
+    axis_feedrate_max: bpy.props.FloatVectorProperty(name='Axis feedrate maximum /min',
+                                                     description='Maximum speed of every axis, used for rapid moves '
+                                                                 'and estimation of machining time',
+                                                     default=(2, 2, 1), min=0.00001, max=320000, precision=PRECISION,
+                                                     subtype="XYZ", unit='LENGTH')
+    junction_deviation: bpy.props.FloatProperty(name="Junction deviation",
+                                                description='How far the machine can deviate from corners of the path '
+                                                            'to keep speed, like grbl junction deviation',
+                                                default=0.00001, min=0.0, max=0.01, precision=PRECISION, unit='LENGTH')
+    rotary_speed_max: bpy.props.FloatProperty(name="Rotary speed maximum /min", default=math.pi * 20, min=0.00001,
+                                              max=320000, precision=1, subtype='ANGLE', unit='ROTATION')
+    rotary_acceleration: bpy.props.FloatProperty(name="Rotary acceleration /s²", default=math.pi * 2, min=0.00001,
+                                                 max=320000, precision=1, subtype='ANGLE', unit='ROTATION')
     hourly_rate: bpy.props.FloatProperty(name="Price per hour", default=100, min=0.005, precision=2)
 
     # UNSUPPORTED:
@@ -860,6 +899,27 @@ class camOperation(bpy.types.PropertyGroup):
     imgres_limit: bpy.props.IntProperty(name="Maximum resolution in megapixels", default=16, min=1, max=512,
                                         description="This property limits total memory usage and prevents crashes. Increase it if you know what are doing.",
                                         update=updateZbufferImage)
+    use_tiled_images: bpy.props.BoolProperty(name="Tiled images",
+                                             description="Keep z-buffer and offset images in memory mapped files in "
+                                                         "the cache directory and compute them in tiles, instead of "
+                                                         "lowering the sampling resolution when it exceeds the limit",
+                                             default=False, update=updateZbufferImage)
+    image_tile_size: bpy.props.IntProperty(name="Tile size", description="Size of image tiles in pixels",
+                                           default=2048, min=256, max=16384, update=updateZbufferImage)
+    zbuffer_method: EnumProperty(name='Z-buffer method',
+                                 items=(('RENDER', 'Render', 'Render depth of the objects with EEVEE'),
+                                        ('RASTER', 'Rasterize',
+                                         'Rasterize triangles of the objects with numpy, works in background mode '
+                                         'without GPU')),
+                                 description='How the height image of objects is made', default='RENDER',
+                                 update=updateZbufferImage)
+    silhouete_method: EnumProperty(name='Silhouete method',
+                                   items=(('AUTO', 'Automatic', 'Polygons up to 200 000 faces, image above'),
+                                          ('POLYGONS', 'Polygons',
+                                           'Union of triangles of the objects, exact, joined in parallel'),
+                                          ('IMAGE', 'Image', 'Outline of the z-buffer image')),
+                                   description='How the silhouete of objects is made', default='AUTO',
+                                   update=updateRest)
     optimize: bpy.props.BoolProperty(name="Reduce path points", description="Reduce path points", default=True,
                                      update=updateRest)
     optimize_threshold: bpy.props.FloatProperty(name="Reduction threshold in μm", default=.2, min=0.000000001,
@@ -1025,6 +1085,8 @@ class camOperation(bpy.types.PropertyGroup):
 
     silhouete = sgeometry.Polygon()
     ambient = sgeometry.Polygon()
+    ambient_mask = None
+    objects_hash = None  # geometry hash of the objects during a path calculation, see getChangeData
     operation_limit = sgeometry.Polygon()
     borderwidth = 50
     object = None
@@ -1047,6 +1109,9 @@ class camOperation(bpy.types.PropertyGroup):
 
     valid: bpy.props.BoolProperty(name="Valid", description="True if operation is ok for calculation", default=True);
     changedata: bpy.props.StringProperty(name='changedata', description='change data for checking if stuff changed.')
+    profile_data: bpy.props.StringProperty(name='profile data',
+                                           description='json with times of the stages of the last calculation',
+                                           default='')
 
     # process related data
 
@@ -1074,6 +1139,7 @@ class camChain(bpy.types.PropertyGroup):  # chain is just a set of operations wh
 @bpy.app.handlers.persistent
 def check_operations_on_load(context):
     """checks any broken computations on load and reset them."""
+    batch.cancel()
     s = bpy.context.scene
     for o in s.cam_operations:
         if o.computing:
@@ -1149,8 +1215,9 @@ class AddPresetCamOperation(bl_operators.presets.AddPresetBase, Operator):
                      'o.optimize_threshold', 'o.protect_vertical', 'o.plunge_feedrate', 'o.minz', 'o.warnings',
                      'o.object_name', 'o.optimize', 'o.parallel_angle', 'o.cutter_length',
                      'o.output_header', 'o.gcode_header', 'o.output_trailer', 'o.gcode_trailer', 'o.use_modifiers',
-                     'o.minz_from_material', 'o.useG64',
-                     'o.G64', 'o.enable_A', 'o.enable_B', 'o.A_along_x', 'o.rotation_A', 'o.rotation_B', 'o.straight']
+                     'o.minz_from_material', 'o.useG64', 'o.use_tiled_images', 'o.image_tile_size',
+                     'o.zbuffer_method', 'o.silhouete_method', 'o.G64', 'o.enable_A', 'o.enable_B', 'o.A_along_x',
+                     'o.rotation_A', 'o.rotation_B', 'o.straight']
 
     preset_subdir = "cam_operations"
 
@@ -1176,6 +1243,11 @@ class AddPresetCamMachine(bl_operators.presets.AddPresetBase, Operator):
         "d.feedrate_min",
         "d.feedrate_max",
         "d.feedrate_default",
+        "d.acceleration",
+        "d.axis_feedrate_max",
+        "d.junction_deviation",
+        "d.rotary_speed_max",
+        "d.rotary_acceleration",
         "d.spindle_min",
         "d.spindle_max",
         "d.spindle_default",
@@ -1232,6 +1304,7 @@ def get_panels():  # convenience function for bot register and unregister functi
         ops.PathExportChain,
         ops.PathsAll,
         ops.PathExport,
+        ops.CamExportProfile,
         ops.CAMPositionObject,
         ops.CAMSimulate,
         ops.CAMSimulateChain,
@@ -1514,7 +1587,6 @@ def register():
     s.cam_import_gcode = bpy.props.PointerProperty(type=import_settings)
 
     s.cam_text = bpy.props.StringProperty()
-    bpy.app.handlers.frame_change_pre.append(ops.timer_update)
     bpy.app.handlers.load_post.append(check_operations_on_load)
     # bpy.types.INFO_HT_header.append(header_info)
 
@@ -0,0 +1,64 @@
+# blender CAM backgroundop.py (c) 2012 Vilem Novak
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+
+# calculation of one operation in a background process started by batch.py:
+# blender -b file.blend --python-exit-code 1 -P backgroundop.py -- -o 3 [-d 0 1] [-s 1]
+# the path is stored in a npz file, which the parent loads with utils.reload_paths.
+
+import os
+import sys
+import argparse
+
+import bpy
+
+from cam import utils
+
+
+def calculatePath(op, dependencies):
+    s = bpy.context.scene
+    # paths of operations calculated in other processes, this one can use them
+    for d in dependencies:
+        utils.reload_paths(s.cam_operations[d])
+
+    o = s.cam_operations[op]
+    fname = utils.getPathResultFile(o)
+    if os.path.isfile(fname):  # result of an earlier calculation
+        os.remove(fname)
+    s.cam_active_operation = op
+    bpy.ops.object.calculate_cam_path()
+    utils.savePathResult(o)
+    sys.stdout.write('progress{%s}\n' % ('finished'))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(description='calculates a cam operation of the blend file in background')
+    parser.add_argument('-o', '--operation', dest='op', type=int, required=True,
+                        help='index of the operation to calculate')
+    parser.add_argument('-d', '--dependencies', type=int, nargs='*', default=[],
+                        help='indices of operations calculated before, whose paths are loaded')
+    parser.add_argument('-s', '--sampling-processes', type=int, default=None,
+                        help='sampling processes, overrides the preferences')
+    args = parser.parse_args(argv)
+    if args.sampling_processes is not None:
+        bpy.context.preferences.addons['cam'].preferences.sampling_processes = args.sampling_processes
+    calculatePath(args.op, args.dependencies)
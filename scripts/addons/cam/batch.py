@@ -0,0 +1,257 @@
+# blender CAM batch.py (c) 2012 Vilem Novak
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+
+# batch calculation of operations in background blender processes, at most as many at once as set in the
+# preferences. An operation starts when the operations it depends on are finished - rest milling operations
+# wait for the operations before them in their chains, operations using path objects of other operations wait
+# for those. Workers run backgroundop.py on the saved file and send paths back in npz files,
+# see utils.savePathResult.
+
+import os
+import re
+import threading
+import subprocess
+
+import bpy
+
+from cam import simple
+from cam import utils
+
+UPDATE_INTERVAL = 0.5  # s between checks of the processes
+PERCENT = re.compile(r'([0-9.]+)%$')
+
+current = None  # the last started batch
+
+
+def getOperationDependencies(scene, o):
+    """names of operations which have to be calculated before operation o"""
+    dependencies = set()
+    if o.start_type == 'OPERATIONRESULT':
+        for chain in scene.cam_chains:
+            names = [cho.name for cho in chain.operations]
+            if o.name in names:
+                dependencies.update(names[:names.index(o.name)])
+    sources = {o.object_name, o.curve_object, o.curve_object1}
+    if o.geometry_source == 'COLLECTION' and o.collection_name in bpy.data.collections:
+        sources.update(ob.name for ob in bpy.data.collections[o.collection_name].objects)
+    for other in scene.cam_operations:
+        if "cam_path_{}".format(other.name) in sources:
+            dependencies.add(other.name)
+    dependencies.discard(o.name)
+    return dependencies
+
+
+def getBackgroundScript():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backgroundop.py')
+
+
+class camBatchJob:
+    def __init__(self, name, dependencies):
+        self.name = name
+        self.dependencies = dependencies
+        self.state = 'WAITING'  # RUNNING, FINISHED or FAILED
+        self.process = None
+        self.thread = None
+        self.text = ''  # last progress message of the process
+        self.percent = 0
+
+
+def readProgress(job):
+    """reads progress messages of the process until it ends, in a thread, so blender doesn't wait for it"""
+    for line in job.process.stdout:
+        line = line.decode(errors='replace').strip()
+        s = line.find('progress{')
+        if s > -1:
+            e = line.find('}', s)
+            job.text = line[s + 9:e]
+            m = PERCENT.search(job.text)
+            if m is not None:
+                job.percent = float(m.group(1))
+
+
+class camBatch:
+    """operations calculated in background processes, at most processes of them at once"""
+
+    def __init__(self, processes):
+        if processes <= 0:
+            processes = os.cpu_count() or 1
+        self.processes = processes
+        self.jobs = []
+
+    def add(self, name, dependencies):
+        for job in self.jobs:
+            if job.name == name and job.state in ('WAITING', 'RUNNING'):
+                return
+        self.jobs.append(camBatchJob(name, set(dependencies)))
+
+    def getJob(self, name):
+        """the last job of operation name, or None"""
+        for job in reversed(self.jobs):
+            if job.name == name:
+                return job
+        return None
+
+    def isRunning(self):
+        for job in self.jobs:
+            if job.state in ('WAITING', 'RUNNING'):
+                return True
+        return False
+
+    def getDependencyStates(self, job):
+        return [self.getJob(name).state for name in job.dependencies if self.getJob(name) is not None]
+
+    def getReady(self):
+        """waiting jobs whose dependencies in the batch are finished, jobs of failed dependencies fail"""
+        failing = True
+        while failing:  # failures go down the chains of dependencies
+            failing = False
+            for job in self.jobs:
+                if job.state == 'WAITING' and 'FAILED' in self.getDependencyStates(job):
+                    job.state = 'FAILED'
+                    job.text = 'dependency failed'
+                    failing = True
+        ready = []
+        for job in self.jobs:
+            if job.state == 'WAITING' and all(state == 'FINISHED' for state in self.getDependencyStates(job)):
+                ready.append(job)
+        return ready
+
+    def start(self, job, scene):
+        index = scene.cam_operations.find(job.name)
+        if index == -1:
+            job.state = 'FAILED'
+            job.text = 'operation removed'
+            return
+        command = [bpy.app.binary_path, '-b', bpy.data.filepath, '--python-exit-code', '1',
+                   '-P', getBackgroundScript(), '--', '-o', str(index)]
+        # paths of dependencies calculated in this batch aren't in the saved file, the process loads them
+        calculated = [scene.cam_operations.find(name) for name in job.dependencies if self.getJob(name) is not None]
+        if len(calculated) > 0:
+            command += ['-d'] + [str(i) for i in calculated]
+        if self.processes > 1:  # processes of the batch already use the cores
+            command += ['-s', '1']
+        job.process = subprocess.Popen(command, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+        job.thread = threading.Thread(target=readProgress, args=(job,), daemon=True)
+        job.thread.start()
+        job.state = 'RUNNING'
+        job.text = 'starting'
+        scene.cam_operations[index].computing = True
+
+    def update(self, scene):
+        """loads paths of finished processes and starts waiting operations, returns True while running"""
+        running = 0
+        for job in self.jobs:
+            if job.state != 'RUNNING':
+                continue
+            o = scene.cam_operations.get(job.name)
+            if job.process.poll() is None:
+                running += 1
+                if o is not None:
+                    o.outtext = job.text
+                continue
+            job.thread.join()
+            if o is not None:
+                o.computing = False
+                o.outtext = ''
+            if job.process.returncode == 0 and o is not None and utils.reload_paths(o):
+                job.state = 'FINISHED'
+                job.percent = 100
+            else:
+                job.state = 'FAILED'
+                print('background calculation of %s failed' % job.name)
+
+        for job in self.getReady()[:max(self.processes - running, 0)]:
+            self.start(job, scene)
+            if job.state == 'RUNNING':
+                running += 1
+
+        if running == 0 and len(self.getReady()) == 0:  # what still waits depends on itself
+            for job in self.jobs:
+                if job.state == 'WAITING':
+                    job.state = 'FAILED'
+                    job.text = 'circular dependency'
+        return self.isRunning()
+
+    def cancel(self, scene, name=None):
+        """kills processes of the batch, or only of operation name"""
+        for job in self.jobs:
+            if name is not None and job.name != name:
+                continue
+            if job.state == 'RUNNING':
+                job.process.kill()
+                o = scene.cam_operations.get(job.name)
+                if o is not None:
+                    o.computing = False
+                    o.outtext = ''
+            if job.state in ('WAITING', 'RUNNING'):
+                job.state = 'FAILED'
+                job.text = 'cancelled'
+
+    def getProgress(self):
+        """finished and failed jobs, all jobs and percentage of the whole batch,
+        running jobs count by the progress of their current stage"""
+        finished = failed = 0
+        percent = 0
+        for job in self.jobs:
+            if job.state == 'FINISHED':
+                finished += 1
+                percent += 100
+            elif job.state == 'FAILED':
+                failed += 1
+                percent += 100
+            elif job.state == 'RUNNING':
+                percent += min(job.percent, 99)
+        return finished, failed, len(self.jobs), percent / max(len(self.jobs), 1)
+
+
+def timerUpdate():
+    """checks the batch periodically, runs in bpy.app.timers"""
+    if current is None:
+        return None
+    running = current.update(bpy.context.scene)
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            area.tag_redraw()
+    if running:
+        return UPDATE_INTERVAL
+    finished, failed, total, percent = current.getProgress()
+    simple.progress('batch finished, %i of %i operations failed' % (failed, total))
+    return None
+
+
+def calculate(names):
+    """calculates operations in background processes, adds them to the batch when one is running"""
+    global current
+    scene = bpy.context.scene
+    if current is None or not current.isRunning():
+        current = camBatch(simple.getBatchProcesses())
+    for name in names:
+        current.add(name, getOperationDependencies(scene, scene.cam_operations[name]))
+    current.update(scene)
+    if not bpy.app.timers.is_registered(timerUpdate):
+        bpy.app.timers.register(timerUpdate, first_interval=UPDATE_INTERVAL)
+    return current
+
+
+def cancel(name=None):
+    """kills background calculations of the batch, or only of operation name"""
+    if current is not None:
+        current.cancel(bpy.context.scene, name)
@@ -0,0 +1,324 @@
+# blender CAM benchmark.py (c) 2012 Vilem Novak
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+
+# benchmark of the path calculation pipeline on generated scenes - noise terrain, text and arrays of pockets
+# in several sizes. Every stage of the pipeline is timed, results are written as json and compared with a baseline.
+# run with:
+# blender -b -P benchmark.py -- --sizes 1 2 4 [--cases terrain_parallel text_cutout] [--output results.json]
+#     [--baseline baseline.json] [--tolerance 0.2] [--cached]
+# exits with code 1 when a stage got slower than the baseline by more than tolerance.
+# zbuffer images are rasterized with numpy by default, so it runs also without GPU, --render uses the renderer.
+
+import sys
+import os
+import json
+import time
+import math
+import shutil
+import argparse
+import tempfile
+import platform
+
+import numpy
+
+import bpy
+
+# stages of the pipeline, by the functions doing them
+STAGES = [
+    ('pattern', 'cam.pattern', 'getPathPattern'),
+    ('zbuffer', 'cam.image_utils', 'renderZbuffer'),
+    ('zbuffer', 'cam.zbuffer', 'rasterizeTriangles'),
+    ('offset', 'cam.image_utils', 'offsetArea'),
+    ('offset', 'cam.image_utils', 'offsetAreaTiled'),
+    ('sample', 'cam.utils', 'sampleChunks'),
+    ('sort', 'cam.utils', 'sortChunks'),
+    ('chunksToMesh', 'cam.strategy', 'chunksToMesh'),
+    ('export', 'cam.gcodepath', 'exportGcodePath'),
+]
+MIN_REGRESSION = 0.05  # s, differences below this are noise
+
+
+class stageTimer:
+    """replaces stage functions in all cam modules with timed wrappers, time of nested calls is counted once"""
+
+    def __init__(self):
+        self.times = {}
+        self.running = {}
+        self.replaced = []
+
+    def wrap(self, stage, function):
+        def timed(*args, **kwargs):
+            if self.running.get(stage, 0) > 0:
+                return function(*args, **kwargs)
+            self.running[stage] = 1
+            t = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.times[stage] = self.times.get(stage, 0) + time.perf_counter() - t
+                self.running[stage] = 0
+
+        return timed
+
+    def install(self):
+        for stage, modulename, name in STAGES:
+            if modulename not in sys.modules:
+                continue
+            function = getattr(sys.modules[modulename], name, None)
+            if function is None:
+                continue
+            timed = self.wrap(stage, function)
+            # functions are also imported to other modules with from ... import *
+            for mname, module in list(sys.modules.items()):
+                if (mname == 'cam' or mname.startswith('cam.')) and getattr(module, name, None) is function:
+                    setattr(module, name, timed)
+                    self.replaced.append((module, name, function))
+
+    def uninstall(self):
+        for module, name, function in self.replaced:
+            setattr(module, name, function)
+        self.replaced = []
+
+    def reset(self):
+        self.times = {}
+
+
+def linkObject(name, data):
+    ob = bpy.data.objects.new(name, data)
+    bpy.context.scene.collection.objects.link(ob)
+    return ob
+
+
+def makeTerrain(size, seed):
+    """noise terrain 10x10 cm, grid of 100 * size vertices along a side"""
+    rng = numpy.random.default_rng(seed)
+    n = 100 * size
+    x, y = numpy.meshgrid(numpy.linspace(-0.05, 0.05, n), numpy.linspace(-0.05, 0.05, n), indexing='ij')
+    z = numpy.zeros_like(x)
+    for octave in range(6):
+        frequency = 40 * 2 ** octave * (1 + rng.random(2))
+        z += 0.008 / 2 ** octave * numpy.sin(frequency[0] * x + rng.random() * 6.3) * \
+            numpy.sin(frequency[1] * y + rng.random() * 6.3)
+    z -= z.max()
+    co = numpy.stack((x, y, z), axis=2).reshape(-1)
+
+    i = numpy.arange(n * n).reshape(n, n)
+    quads = numpy.stack((i[:-1, :-1], i[1:, :-1], i[1:, 1:], i[:-1, 1:]), axis=2).reshape(-1)
+    mesh = bpy.data.meshes.new('bench_terrain')
+    mesh.vertices.add(n * n)
+    mesh.vertices.foreach_set('co', co.astype(numpy.float32))
+    mesh.loops.add(len(quads))
+    mesh.loops.foreach_set('vertex_index', quads.astype(numpy.int32))
+    nfaces = len(quads) // 4
+    mesh.polygons.add(nfaces)
+    mesh.polygons.foreach_set('loop_start', numpy.arange(0, len(quads), 4, dtype=numpy.int32))
+    mesh.polygons.foreach_set('loop_total', numpy.full(nfaces, 4, dtype=numpy.int32))
+    mesh.update()
+    mesh.validate()
+    return linkObject('bench_terrain', mesh)
+
+
+def makeText(size, seed):
+    """text curve with 20 * size characters, in lines of 20"""
+    text = 'Blender CAM 0123456789 ABCDEFGHIJKLMNOPQRSTUVWXYZ abcdefghijklmnopqrstuvwxyz '
+    count = 20 * size
+    body = (text * (count // len(text) + 1))[:count]
+    curve = bpy.data.curves.new('bench_text', 'FONT')
+    curve.body = '\n'.join(body[i:i + 20] for i in range(0, len(body), 20))
+    curve.size = 0.01
+    return linkObject('bench_text', curve)
+
+
+def makePockets(size, seed):
+    """array of 5 * size x 5 * size circles of random radii, every one a pocket"""
+    rng = numpy.random.default_rng(seed)
+    k = 5 * size
+    curve = bpy.data.curves.new('bench_pockets', 'CURVE')
+    curve.dimensions = '2D'
+    a = numpy.linspace(0, 2 * math.pi, 32, endpoint=False)
+    for i in range(k):
+        for j in range(k):
+            r = 0.003 + rng.random() * 0.005
+            spline = curve.splines.new('POLY')
+            spline.points.add(len(a) - 1)
+            co = numpy.stack((i * 0.02 + numpy.cos(a) * r, j * 0.02 + numpy.sin(a) * r, numpy.zeros_like(a),
+                              numpy.ones_like(a)), axis=1)
+            spline.points.foreach_set('co', co.reshape(-1))
+            spline.use_cyclic_u = True
+    return linkObject('bench_pockets', curve)
+
+
+def setupTerrain(o):
+    o.cutter_type = 'BALLNOSE'
+    o.cutter_diameter = 0.003
+    o.dist_between_paths = 0.001
+    o.pixsize = 0.0002
+
+
+def setupWaterline(o):
+    setupTerrain(o)
+    o.slice_detail = 0.0005
+
+
+def setupCurves(o):
+    o.cutter_type = 'END'
+    o.cutter_diameter = 0.002
+    o.dist_between_paths = 0.001
+
+
+# case: (scene generator, strategy, operation setup)
+CASES = {
+    'terrain_parallel': (makeTerrain, 'PARALLEL', setupTerrain),
+    'terrain_waterline': (makeTerrain, 'WATERLINE', setupWaterline),
+    'text_cutout': (makeText, 'CUTOUT', setupCurves),
+    'pockets_pocket': (makePockets, 'POCKET', setupCurves),
+}
+
+
+def clearScene():
+    for ob in list(bpy.data.objects):
+        bpy.data.objects.remove(ob, do_unlink=True)
+    for collection in (bpy.data.meshes, bpy.data.curves):
+        for data in list(collection):
+            collection.remove(data)
+    scene = bpy.context.scene
+    while len(scene.cam_operations) > 0:
+        scene.cam_operations.remove(0)
+
+
+def clearCache():
+    from cam import image_cache
+    cachedir = image_cache.getCacheDir()
+    if os.path.isdir(cachedir):
+        shutil.rmtree(cachedir, ignore_errors=True)
+
+
+def runCase(timer, case, size, render=False, cached=False, seed=1):
+    from cam import gcodepath
+
+    make, strategy, setup = CASES[case]
+    clearScene()
+    ob = make(size, seed)
+    bpy.context.view_layer.objects.active = ob
+    bpy.ops.scene.cam_operation_add()
+    o = bpy.context.scene.cam_operations[-1]
+    o.name = 'bench_' + case
+    o.filename = o.name
+    o.geometry_source = 'OBJECT'
+    o.strategy = strategy
+    o.zbuffer_method = 'RENDER' if render else 'RASTER'
+    o.auto_export = False
+    setup(o)
+    if not cached:
+        clearCache()
+
+    timer.reset()
+    t = time.perf_counter()
+    gcodepath.getPath(bpy.context, o)
+    path = bpy.data.objects.get('cam_path_{}'.format(o.name))
+    if path is not None:
+        gcodepath.exportGcodePath(o.filename, [path.data], [o])
+    total = time.perf_counter() - t
+
+    result = {
+        'case': case,
+        'size': size,
+        'total': total,
+        'stages': dict(timer.times),
+        'points': len(path.data.vertices) if path is not None else 0,
+        'warnings': o.warnings,
+    }
+    print('%-18s size %3i %10.3f s %9i points  ' % (case, size, total, result['points']) +
+          ' '.join('%s %.3f' % (stage, t) for stage, t in sorted(result['stages'].items())))
+    return result
+
+
+def getEnvironment():
+    return {
+        'blender': bpy.app.version_string,
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """regressions of total and stage times against baseline results, as list of messages"""
+    previous = {(r['case'], r['size']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        b = previous.get((r['case'], r['size']))
+        if b is None:
+            continue
+        times = [('total', r['total'], b['total'])]
+        times.extend((stage, t, b['stages'].get(stage)) for stage, t in r['stages'].items())
+        for stage, t, bt in times:
+            if bt is None:
+                continue
+            if t > bt * (1 + tolerance) and t - bt > MIN_REGRESSION:
+                regressions.append('%s size %i %s: %.3f s, baseline %.3f s (+%i%%)' %
+                                   (r['case'], r['size'], stage, t, bt, round((t / bt - 1) * 100)))
+    return regressions
+
+
+def run(sizes, cases, render=False, cached=False):
+    # cache and exported files are written next to the blend file
+    workdir = tempfile.mkdtemp(prefix='cam_benchmark_')
+    bpy.ops.wm.save_as_mainfile(filepath=os.path.join(workdir, 'benchmark.blend'))
+    timer = stageTimer()
+    timer.install()
+    results = []
+    try:
+        for case in cases:
+            for size in sizes:
+                results.append(runCase(timer, case, size, render, cached))
+    finally:
+        timer.uninstall()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'environment': getEnvironment(), 'results': results}
+
+
+if __name__ == '__main__':
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(description='path calculation benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--cases', nargs='+', default=list(CASES.keys()), choices=list(CASES.keys()))
+    parser.add_argument('--output', help='json file for the results')
+    parser.add_argument('--baseline', help='json results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline')
+    parser.add_argument('--render', action='store_true', help='render z-buffer images instead of rasterizing')
+    parser.add_argument('--cached', action='store_true', help='keep cached images between the cases')
+    args = parser.parse_args(argv)
+
+    data = run(args.sizes, args.cases, args.render, args.cached)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(data['results'], json.load(f), args.tolerance)
+        for message in regressions:
+            print('regression', message)
+        if len(regressions) > 0:
+            sys.exit(1)
+        print('no regressions against', args.baseline)
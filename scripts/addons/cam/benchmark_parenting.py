@@ -0,0 +1,127 @@
+# blender CAM benchmark_parenting.py (c) 2012 Vilem Novak
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+
+# scaling benchmark of chunk parenting - parentChildDist, parentChildPoly and chunksToShapely.
+# run with:
+# blender -b -P benchmark_parenting.py -- --sizes 1000 10000 50000 [--brute]
+# --brute also runs the old all pairs tests for comparison, use only with small sizes.
+
+import sys
+import time
+import math
+import random
+import argparse
+import types
+
+from cam import chunk
+
+
+def makeRings(n, seed):
+    """n small rings scattered over an area growing with n, like offset rings of a pocket"""
+    random.seed(seed)
+    size = math.sqrt(n) * 0.004
+    chunks = []
+    for i in range(n):
+        x = random.random() * size
+        y = random.random() * size
+        r = 0.0005 + random.random() * 0.002
+        points = []
+        for a in range(32):
+            points.append((x + math.cos(a * math.pi / 16) * r, y + math.sin(a * math.pi / 16) * r, 0))
+        chunks.append(chunk.camPathChunk(points))
+    return chunks
+
+
+def makeLines(n, seed):
+    """n parallel path segments, which have no polygons, like chunks of parallel strategy"""
+    random.seed(seed)
+    rows = int(math.sqrt(n)) + 1
+    chunks = []
+    for i in range(n):
+        x = (i // rows) * 0.004 + random.random() * 0.001
+        y = (i % rows) * 0.001
+        ch = chunk.camPathChunk([])
+        for p in range(20):
+            ch.points.append((x + p * 0.0001, y, 0))
+        chunks.append(ch)
+    return chunks
+
+
+def bruteParentChildDist(parents, children, dlim):
+    for child in children:
+        for parent in parents:
+            if parent != child:
+                if not parent.poly.is_empty and not child.poly.is_empty:
+                    isrelation = parent.poly.boundary.distance(child.poly.boundary) < dlim
+                else:
+                    isrelation = False
+                    for v in child.points:
+                        for v1 in parent.points:
+                            if chunk.dist2d(v, v1) < dlim:
+                                isrelation = True
+                                break
+                        if isrelation:
+                            break
+
+
+def bruteContains(chunks):
+    for ppart in chunks:
+        for ptest in chunks:
+            if ppart != ptest:
+                ptest.poly.contains(ppart.poly)
+
+
+def timed(results, name, n, f, *args):
+    t = time.time()
+    f(*args)
+    t = time.time() - t
+    results.append((name, n, t))
+    print('%-24s %8i chunks %10.3f s' % (name, n, t))
+
+
+def run(sizes, brute=False):
+    o = types.SimpleNamespace(dist_between_paths=0.001, strategy='OUTLINEFILL', parallel_step_back=False)
+    results = []
+    for n in sizes:
+        parents = makeRings(n // 2, 1)
+        children = makeRings(n // 2, 2)
+        timed(results, 'parentChildDist rings', n, chunk.parentChildDist, parents, children, o)
+        parents = makeLines(n // 2, 3)
+        children = makeLines(n // 2, 4)
+        timed(results, 'parentChildDist lines', n, chunk.parentChildDist, parents, children, o)
+        parents = makeRings(n // 2, 5)
+        children = makeRings(n // 2, 6)
+        timed(results, 'parentChildPoly', n, chunk.parentChildPoly, parents, children, o)
+        timed(results, 'chunksToShapely', n, chunk.chunksToShapely, makeRings(n, 7))
+        if brute:
+            timed(results, 'all pairs distance', n, bruteParentChildDist, makeRings(n // 2, 1),
+                  makeRings(n // 2, 2), o.dist_between_paths * 2)
+            timed(results, 'all pairs contains', n, bruteContains, makeRings(n, 7))
+    return results
+
+
+if __name__ == '__main__':
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(description='chunk parenting benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--brute', action='store_true')
+    args = parser.parse_args(argv)
+    run(args.sizes, args.brute)
@@ -23,9 +23,12 @@
 import shapely
 from shapely.geometry import polygon as spolygon
 from shapely import geometry as sgeometry
+from shapely import prepared as sprepared
 from cam import polygon_utils_cam
+from cam import profiling
 from cam.simple import *
 import math
+import numpy
 
 
 def Rotate_pbyp(originp, p, ang):  # rotate point around another point with angle
@@ -43,30 +46,72 @@ def Rotate_pbyp(originp, p, ang):  # rotate point around another point with angl
     return rot_p
 
 
+def pointsToArray(points):
+    """point list as float64 Nx3 numpy array, packed arrays are returned as they are"""
+    if isinstance(points, numpy.ndarray):
+        return points
+    if len(points) == 0:
+        return numpy.zeros((0, 3))
+    return numpy.array(points, dtype=numpy.float64)
+
+
+def arrayToPoints(a):
+    """list of point tuples from numpy array"""
+    return [tuple(p) for p in a.tolist()]
+
+
+def pointListProperty(name):
+    # point lists are stored either as python lists, as strategies build them, or packed in numpy arrays.
+    # reading the attribute unpacks the array to a list of tuples, so all list editing keeps working.
+    def get(self):
+        points = getattr(self, name)
+        if isinstance(points, numpy.ndarray):
+            points = arrayToPoints(points)
+            setattr(self, name, points)
+        return points
+
+    def set(self, points):
+        if isinstance(points, numpy.ndarray):
+            points = numpy.ascontiguousarray(points, dtype=numpy.float64)
+        setattr(self, name, points)
+
+    return property(get, set)
+
+
 class camPathChunk:
     # parents=[]
     # children=[]
     # sorted=False
 
     # progressIndex=-1# for e.g. parallel strategy, when trying to save time..
+    __slots__ = ('_points', '_startpoints', '_endpoints', '_rotations', '_poly', '_polyfrompoints', 'closed',
+                 'children', 'parents', 'sorted', 'length', 'zstart', 'zend', 'depth', 'nparents', 'simppoly',
+                 'cango')
+
+    points = pointListProperty('_points')  # for 3 axes, this is only storage of points.
+    # For N axes, here go the sampled points
+    startpoints = pointListProperty('_startpoints')  # from where the sweep test begins,
+    # but also retract point for given path
+    endpoints = pointListProperty('_endpoints')  # where sweep test ends
+    rotations = pointListProperty('_rotations')  # rotation of the machine axes
+
     def __init__(self, inpoints, startpoints=None, endpoints=None, rotations=None):
-        if len(inpoints) > 2:
-            self.poly = sgeometry.Polygon(inpoints)
-        else:
-            self.poly = sgeometry.Polygon()
-        self.points = inpoints  # for 3 axes, this is only storage of points. For N axes, here go the sampled points
+        # polygon is built from the initial points only when it's needed
+        self._poly = None
+        self._polyfrompoints = len(inpoints) > 2
+        self.points = inpoints
         if startpoints:
-            self.startpoints = startpoints  # from where the sweep test begins, but also retract point for given path
+            self.startpoints = startpoints
         else:
             self.startpoints = []
         if endpoints:
             self.endpoints = endpoints
         else:
-            self.endpoints = []  # where sweep test ends
+            self.endpoints = []
         if rotations:
             self.rotations = rotations
         else:
-            self.rotations = []  # rotation of the machine axes
+            self.rotations = []
         self.closed = False
         self.children = []
         self.parents = []
@@ -77,12 +122,60 @@ class camPathChunk:
         # because they are added afterwards, but have to use layer info
         self.zend = 0  #
 
+    @property
+    def poly(self):
+        if self._poly is None:
+            if self._polyfrompoints:
+                self._poly = sgeometry.Polygon(self.getPointsArray())
+            else:
+                self._poly = sgeometry.Polygon()
+        return self._poly
+
+    @poly.setter
+    def poly(self, poly):
+        self._poly = poly
+
+    def getPointsArray(self):
+        """points as Nx3 float64 array, without changing how they are stored"""
+        return pointsToArray(self._points)
+
+    def getStartpointsArray(self):
+        return pointsToArray(self._startpoints)
+
+    def getRotationsArray(self):
+        return pointsToArray(self._rotations)
+
+    def setPointsArray(self, a):
+        """sets new point coordinates, in place when the points are a list, because it can be shared."""
+        if isinstance(self._points, numpy.ndarray):
+            self._points = a
+        else:
+            self._points[:] = arrayToPoints(a)
+
+    def pack(self):
+        """stores all point lists as numpy arrays, which takes a fraction of the memory of tuples."""
+        self._points = pointsToArray(self._points)
+        self._startpoints = pointsToArray(self._startpoints)
+        self._endpoints = pointsToArray(self._endpoints)
+        self._rotations = pointsToArray(self._rotations)
+
+    def count(self):
+        return len(self._points)
+
+    def getPoint(self, index):
+        p = self._points[index]
+        if isinstance(p, numpy.ndarray):
+            return tuple(p.tolist())
+        return p
+
     def copy(self):
         nchunk = camPathChunk([])
-        nchunk.points.extend(self.points)
-        nchunk.startpoints.extend(self.startpoints)
-        nchunk.endpoints.extend(self.endpoints)
-        nchunk.rotations.extend(self.rotations)
+        for name in ('_points', '_startpoints', '_endpoints', '_rotations'):
+            points = getattr(self, name)
+            if isinstance(points, numpy.ndarray):
+                setattr(nchunk, name, points.copy())
+            else:
+                getattr(nchunk, name).extend(points)
         nchunk.closed = self.closed
         nchunk.children = self.children
         nchunk.parents = self.parents
@@ -91,88 +184,96 @@ class camPathChunk:
         return nchunk
 
     def shift(self, x, y, z):
-
-        for i, p in enumerate(self.points):
-            self.points[i] = (p[0] + x, p[1] + y, p[2] + z)
-        for i, p in enumerate(self.startpoints):
-            self.startpoints[i] = (p[0] + x, p[1] + y, p[2] + z)
-        for i, p in enumerate(self.endpoints):
-            self.endpoints[i] = (p[0] + x, p[1] + y, p[2] + z)
+        offset = numpy.array((x, y, z), dtype=numpy.float64)
+        if self.count() > 0:
+            self.setPointsArray(self.getPointsArray() + offset)
+        for name in ('_startpoints', '_endpoints'):
+            points = getattr(self, name)
+            if len(points) == 0:
+                continue
+            a = pointsToArray(points) + offset
+            if isinstance(points, numpy.ndarray):
+                setattr(self, name, a)
+            else:
+                points[:] = arrayToPoints(a)
 
     def setZ(self, z):
-        for i, p in enumerate(self.points):
-            self.points[i] = (p[0], p[1], z)
+        if self.count() > 0:
+            a = self.getPointsArray().copy()
+            a[:, 2] = z
+            self.setPointsArray(a)
 
     def offsetZ(self, z):
-        for i, p in enumerate(self.points):
-            self.points[i] = (p[0], p[1], z + p[2])
+        if self.count() > 0:
+            a = self.getPointsArray().copy()
+            a[:, 2] += z
+            self.setPointsArray(a)
 
     def isbelowZ(self, z):
-        isbelow = False
-        for p in self.points:
-            if p[2] <= z:
-                isbelow = True
-        return isbelow
+        if self.count() == 0:
+            return False
+        return bool((self.getPointsArray()[:, 2] <= z).any())
 
     def clampZ(self, z):
-        for i, p in enumerate(self.points):
-            if p[2] < z:
-                self.points[i] = (p[0], p[1], z)
+        if self.count() > 0:
+            a = self.getPointsArray().copy()
+            a[:, 2] = numpy.where(a[:, 2] < z, z, a[:, 2])
+            self.setPointsArray(a)
 
     def clampmaxZ(self, z):
-        for i, p in enumerate(self.points):
-            if p[2] > z:
-                self.points[i] = (p[0], p[1], z)
+        if self.count() > 0:
+            a = self.getPointsArray().copy()
+            a[:, 2] = numpy.where(a[:, 2] > z, z, a[:, 2])
+            self.setPointsArray(a)
+
+    def closestPointIndex(self, pos):
+        """index and 2d distance of the point closest to pos, first one of equally distant points"""
+        a = self.getPointsArray()
+        d = numpy.hypot(a[:, 0] - pos[0], a[:, 1] - pos[1])
+        minv = int(numpy.argmin(d))
+        return minv, float(d[minv])
 
     def dist(self, pos, o):
         if self.closed:
-            mind = 10000000
-            minv = -1
-            for vi in range(0, len(self.points)):
-                v = self.points[vi]
-                # print(v,pos)
-                d = dist2d(pos, v)
-                if d < mind:
-                    mind = d
-                    minv = vi
-            return mind
+            if self.count() == 0:
+                return 10000000
+            return self.closestPointIndex(pos)[1]
         else:
             if o.movement_type == 'MEANDER':
-                d1 = dist2d(pos, self.points[0])
-                d2 = dist2d(pos, self.points[-1])
+                d1 = dist2d(pos, self.getPoint(0))
+                d2 = dist2d(pos, self.getPoint(-1))
                 # if d2<d1:
                 #   ch.points.reverse()
                 return min(d1, d2)
             else:
-                return dist2d(pos, self.points[0])
+                return dist2d(pos, self.getPoint(0))
 
     def distStart(self, pos, o):
-        return dist2d(pos, self.points[0])
+        return dist2d(pos, self.getPoint(0))
 
     def adaptdist(self, pos, o):
         # reorders chunk so that it starts at the closest point to pos.
         if self.closed:
-            mind = 10000000
-            minv = -1
-            for vi in range(0, len(self.points)):
-                v = self.points[vi]
-                # print(v,pos)
-                d = dist2d(pos, v)
-                if d < mind:
-                    mind = d
-                    minv = vi
-
-            newchunk = []
-            newchunk.extend(self.points[minv:])
-            newchunk.extend(self.points[:minv + 1])
-            self.points = newchunk
+            if self.count() == 0:
+                return
+            minv = self.closestPointIndex(pos)[0]
+            if isinstance(self._points, numpy.ndarray):
+                self._points = numpy.concatenate((self._points[minv:], self._points[:minv + 1]))
+            else:
+                newchunk = []
+                newchunk.extend(self._points[minv:])
+                newchunk.extend(self._points[:minv + 1])
+                self.points = newchunk
 
         else:
             if o.movement_type == 'MEANDER':
-                d1 = dist2d(pos, self.points[0])
-                d2 = dist2d(pos, self.points[-1])
+                d1 = dist2d(pos, self.getPoint(0))
+                d2 = dist2d(pos, self.getPoint(-1))
                 if d2 < d1:
-                    self.points.reverse()
+                    if isinstance(self._points, numpy.ndarray):
+                        self._points = self._points[::-1].copy()
+                    else:
+                        self._points.reverse()
 
     def getNextClosest(self, o, pos):
         # finds closest chunk that can be milled, when inside sorting hierarchy.
@@ -211,26 +312,23 @@ class camPathChunk:
 
     def getLength(self):
         # computes length of the chunk - in 3d
-        self.length = 0
-
-        for vi, v1 in enumerate(self.points):
-            # print(len(self.points),vi)
-            v2 = Vector(v1)  # this is for case of last point and not closed chunk..
-            if self.closed and vi == len(self.points) - 1:
-                v2 = Vector(self.points[0])
-            elif vi < len(self.points) - 1:
-                v2 = Vector(self.points[vi + 1])
-            v1 = Vector(v1)
-            v = v2 - v1
-            self.length += v.length
+        a = self.getPointsArray()
+        if len(a) < 2:
+            self.length = 0
+            return
+        if self.closed:
+            a = numpy.concatenate((a, a[:1]))
+        self.length = float(numpy.sqrt((numpy.diff(a, axis=0) ** 2).sum(axis=1)).sum())
 
     # print(v,pos)
 
     def reverse(self):
-        self.points.reverse()
-        self.startpoints.reverse()
-        self.endpoints.reverse()
-        self.rotations.reverse()
+        for name in ('_points', '_startpoints', '_endpoints', '_rotations'):
+            points = getattr(self, name)
+            if isinstance(points, numpy.ndarray):
+                setattr(self, name, points[::-1].copy())
+            else:
+                points.reverse()
 
     def pop(self, index):
         self.points.pop(index)
@@ -616,76 +714,74 @@ def setChunksZ(chunks, z):
 
 
 def optimizeChunk(chunk, operation):
-    if len(chunk.points) > 2:
-        points = chunk.points
-
-        chunk.points = [points[0]]
-        naxispoints = False
-        if len(chunk.startpoints) > 0:
-            startpoints = chunk.startpoints
-            endpoints = chunk.endpoints
-            chunk.startpoints = [startpoints[0]]
-            chunk.endpoints = [endpoints[0]]
-            rotations = chunk.rotations
-            chunk.rotations = [rotations[0]]
-            # TODO FIRST THIS ROTATIONS E.T.C.
-            #  NEED TO MAKE A POINT ADDING FUNCTION SINCE THIS IS A MESS, WOULD BE TOO MUCH IF'S
-            naxispoints = True
+    # kept points are picked by their indices, the chunk gets them back as arrays.
+    if chunk.count() > 2:
+        points = chunk.getPointsArray().tolist()
+        npoints = [points[0]]
+        kept = [0]
 
         protect_vertical = operation.protect_vertical and operation.machine_axes == '3'
         for vi in range(0, len(points) - 1):
 
-            if not compare(chunk.points[-1], points[vi + 1], points[vi], operation.optimize_threshold * 0.000001):
-                if naxispoints:
-                    chunk.append(points[vi], startpoints[vi], endpoints[vi], rotations[vi])
-                else:
-                    chunk.points.append(points[vi])
+            if not compare(npoints[-1], points[vi + 1], points[vi], operation.optimize_threshold * 0.000001):
+                npoints.append(points[vi])
+                kept.append(vi)
                 if protect_vertical:
-                    v1 = chunk.points[-1]
-                    v2 = chunk.points[-2]
+                    v1 = npoints[-1]
+                    v2 = npoints[-2]
                     v1c, v2c = isVerticalLimit(v1, v2, operation.protect_vertical_limit)
                     if v1c != v1:  # TODO FIX THIS FOR N AXIS?
-                        chunk.points[-1] = v1c
+                        npoints[-1] = v1c
                     elif v2c != v2:
-                        chunk.points[-2] = v2c
+                        npoints[-2] = v2c
         # add last point
-        if naxispoints:
-            chunk.append(points[-1], startpoints[-1], endpoints[-1], rotations[-1])
-        else:
-            chunk.points.append(points[-1])
+        npoints.append(points[-1])
+        kept.append(len(points) - 1)
+
+        chunk.points = numpy.array(npoints, dtype=numpy.float64)
+        if len(chunk._startpoints) > 0:
+            kept = numpy.array(kept)
+            for name in ('_startpoints', '_endpoints', '_rotations'):
+                setattr(chunk, name, pointsToArray(getattr(chunk, name))[kept])
 
     return chunk
 
 
+@profiling.timed('limit')
 def limitChunks(chunks, o,
                 force=False):  # TODO: this should at least add point on area border...
     # but shouldn't be needed at all at the first place...
+    # chunks are split to runs of points inside the ambient, found on index arrays.
     if o.use_limit_curve or force:
+        mask = polygon_utils_cam.getAmbientMask(o)
         nchunks = []
         for ch in chunks:
-            prevsampled = True
-            nch = camPathChunk([])
-            nch1 = nch
-            closed = True
-            for s in ch.points:
-                sampled = o.ambient.contains(sgeometry.Point(s[0], s[1]))
-                if not sampled and len(nch.points) > 0:
-                    nch.closed = False
-                    closed = False
-                    nchunks.append(nch)
-                    nch = camPathChunk([])
-                elif sampled:
-                    nch.points.append(s)
-                prevsampled = sampled
-            if len(nch.points) > 2 and closed and ch.closed and ch.points[0] == ch.points[1]:
+            points = ch.getPointsArray()
+            if len(points) == 0:
+                continue
+            inside = mask.contains(points[:, 0], points[:, 1])
+            change = numpy.diff(numpy.concatenate(([0], inside.view(numpy.int8), [0])))
+            starts = numpy.nonzero(change == 1)[0]
+            ends = numpy.nonzero(change == -1)[0]
+            if len(starts) == 0:
+                continue
+            runs = []
+            for start, end in zip(starts, ends):
+                nch = camPathChunk([])
+                nch.points = points[start:end]
+                runs.append(nch)
+            split = len(starts) > 1 or ends[-1] < len(points)  # the chunk was cut by the ambient
+            nch = runs[-1]
+            if len(runs) == 1 and not split and len(nch.points) > 2 and ch.closed and \
+                    numpy.array_equal(points[0], points[1]):
                 nch.closed = True
-            elif ch.closed and nch != nch1 and len(nch.points) > 1 and nch.points[-1] == nch1.points[0]:
+            elif ch.closed and len(runs) > 1 and ends[-1] == len(points) and ends[-1] - starts[-1] > 1 and \
+                    numpy.array_equal(points[-1], points[starts[0]]):
                 # here adds beginning of closed chunk to the end, if the chunks were split during limiting
-                nch.points.extend(nch1.points)
-                nchunks.remove(nch1)
+                nch.points = numpy.concatenate((points[starts[-1]:], points[starts[0]:ends[0]]))
+                runs.pop(0)
                 print('joining stuff')
-            if len(nch.points) > 0:
-                nchunks.append(nch)
+            nchunks.extend(runs)
         return nchunks
     else:
         return chunks
@@ -694,17 +790,50 @@ def limitChunks(chunks, o,
 def parentChildPoly(parents, children, o):
     # hierarchy based on polygons - a polygon inside another is his child.
     # hierarchy works like this: - children get milled first.
-
-    for parent in parents:
-        # print(parent.poly)
-        for child in children:
-            # print(child.poly)
+    # only parents whose bounding box contains the child's start point are tested.
+    index = polygon_utils_cam.geometryIndex([parent.poly for parent in parents])
+    prepared = {}
+    for child in children:
+        p = sgeometry.Point(child.poly.boundary.coords[0])
+        for pi in index.query(p):
+            parent = parents[pi]
             if child != parent:  # and len(child.poly)>0
-                if parent.poly.contains(sgeometry.Point(child.poly.boundary.coords[0])):
+                if pi not in prepared:
+                    prepared[pi] = sprepared.prep(parent.poly)
+                if prepared[pi].contains(p):
                     parent.children.append(child)
                     child.parents.append(parent)
 
 
+def getPointsArray(ch):
+    """2d points of chunk as numpy array"""
+    return ch.getPointsArray()[:, :2]
+
+
+def pointsWithinDistance(a, b, dlim):
+    """true if any point of a is closer than dlim to any point of b"""
+    # only points within bounding box of the other set can be close
+    if len(a) == 0 or len(b) == 0:
+        return False
+    bmin = b.min(axis=0) - dlim
+    bmax = b.max(axis=0) + dlim
+    a = a[numpy.all((a >= bmin) & (a <= bmax), axis=1)]
+    if len(a) == 0:
+        return False
+    amin = a.min(axis=0) - dlim
+    amax = a.max(axis=0) + dlim
+    b = b[numpy.all((b >= amin) & (b <= amax), axis=1)]
+    if len(b) == 0:
+        return False
+    step = max(1, 1000000 // len(b))  # limit size of the distance matrix
+    for i in range(0, len(a), step):
+        part = a[i:i + step]
+        d = numpy.hypot(part[:, None, 0] - b[None, :, 0], part[:, None, 1] - b[None, :, 1])
+        if (d < dlim).any():
+            return True
+    return False
+
+
 def parentChildDist(parents, children, o, distance=None):
     # parenting based on x,y distance between chunks
     # hierarchy works like this: - children get milled first.
@@ -725,8 +854,31 @@ def parentChildDist(parents, children, o, distance=None):
         if not parent.poly.is_empty:
             parent.simppoly = parent.poly.simplify(0.0003).boundary
 
+    # bounding boxes of parents go to an index, only parents closer than dlim to child's bounding box are tested.
+    boxes = []
+    for parent in parents:
+        if not parent.poly.is_empty:
+            boxes.append(sgeometry.box(*parent.poly.bounds))
+        elif len(parent.points) > 0:
+            a = getPointsArray(parent)
+            boxes.append(sgeometry.box(*a.min(axis=0), *a.max(axis=0)))
+        else:
+            boxes.append(sgeometry.Polygon())
+    index = polygon_utils_cam.geometryIndex(boxes)
+    parentpoints = {}
+
     for child in children:
-        for parent in parents:
+        if not child.poly.is_empty:
+            minx, miny, maxx, maxy = child.poly.bounds
+            childpoints = None
+        elif len(child.points) > 0:
+            childpoints = getPointsArray(child)
+            minx, miny = childpoints.min(axis=0)
+            maxx, maxy = childpoints.max(axis=0)
+        else:
+            continue
+        for pi in index.queryBox(minx - dlim, miny - dlim, maxx + dlim, maxy + dlim):
+            parent = parents[pi]
             # print(len(children),len(parents))
             isrelation = False
             if parent != child:
@@ -737,14 +889,11 @@ def parentChildDist(parents, children, o, distance=None):
                         isrelation = True
                 else:  # this is the old method, preferably should be replaced in most cases except parallell
                     # where this method works probably faster.
-                    # print('warning, sorting will be slow due to bad parenting in parentChildDist')
-                    for v in child.points:
-                        for v1 in parent.points:
-                            if dist2d(v, v1) < dlim:
-                                isrelation = True
-                                break
-                        if isrelation:
-                            break
+                    if childpoints is None:
+                        childpoints = getPointsArray(child)
+                    if pi not in parentpoints:
+                        parentpoints[pi] = getPointsArray(parent)
+                    isrelation = pointsWithinDistance(childpoints, parentpoints[pi], dlim)
                 if isrelation:
                     # print('truelink',dist2d(v,v1))
                     parent.children.append(child)
@@ -762,19 +911,26 @@ def parentChild(parents, children, o):
                 child.parents.append(parent)
 
 
+@profiling.timed('chunksToShapely')
 def chunksToShapely(chunks):  # this does more cleve chunks to Poly with hierarchies... ;)
     # print ('analyzing paths')
+    profiling.count('shapely ops', len(chunks))
 
     for ch in chunks:  # first convert chunk to poly
         if len(ch.points) > 2:
             # pchunk=[]
             ch.poly = sgeometry.Polygon(ch.points)
 
-    for ppart in chunks:  # then add hierarchy relations
-        for ptest in chunks:
-
+    # then add hierarchy relations, only polygons with overlapping bounding boxes can contain each other.
+    index = polygon_utils_cam.geometryIndex([ch.poly for ch in chunks])
+    prepared = {}
+    for ppart in chunks:
+        for ti in index.query(ppart.poly):
+            ptest = chunks[ti]
             if ppart != ptest:
-                if ptest.poly.contains(ppart.poly):
+                if ti not in prepared:
+                    prepared[ti] = sprepared.prep(ptest.poly)
+                if prepared[ti].contains(ppart.poly):
                     # hierarchy works like this: - children get milled first.
                     ppart.parents.append(ptest)
 
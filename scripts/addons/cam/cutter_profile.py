@@ -0,0 +1,134 @@
+# blender CAM cutter_profile.py (c) 2012 Vilem Novak
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+
+# cutter footprints as height images, used for offsetting of images and for simulation.
+# pixel a, b of the footprint has its center at (a + 0.5 - res / 2) * pixsize from the cutter axis,
+# pixels outside of the cutter are -10. Profiles are computed for the whole radius grid at once.
+
+import math
+from collections import OrderedDict
+
+import numpy
+
+from cam import image_cache
+from cam import zbuffer
+
+PROFILE_CACHE_SIZE = 8
+profiles = OrderedDict()  # cutter arrays by cutter key and pixsize, most recently used last
+
+
+def getRadiusGrid(res, pixsize):
+    """distances of pixel centers from the cutter axis, computed in single precision like mathutils vectors,
+    so pixels at the edge of the cutter are the same as in the per pixel computation"""
+    m = res / 2.0
+    c = numpy.array([(a + 0.5 - m) * pixsize for a in range(0, res)], dtype=numpy.float32)
+    x = c[:, numpy.newaxis]
+    y = c[numpy.newaxis, :]
+    return numpy.sqrt(x * x + y * y).astype(numpy.float64)
+
+
+def getProfile(cutter_type, l, r, operation):
+    """heights of cutter surface at distances l from the axis, negative above the tip, nan outside of the cutter"""
+    z = numpy.full(l.shape, numpy.nan)
+    inside = l <= r
+    li = l[inside]
+    if cutter_type == 'END':
+        z[inside] = 0
+    elif cutter_type == 'BALL' or cutter_type == 'BALLNOSE':
+        z[inside] = numpy.sin(numpy.arccos(li / r)) * r - r
+    elif cutter_type == 'VCARVE':
+        angle = operation.cutter_tip_angle
+        s = math.tan(math.pi * (90 - angle / 2) / 180)  # angle in degrees
+        z[inside] = -li * s
+    elif cutter_type == 'CYLCONE':
+        angle = operation.cutter_tip_angle
+        cyl_r = operation.cylcone_diameter / 2
+        s = math.tan(math.pi * (90 - angle / 2) / 180)  # angle in degrees
+        z[inside] = numpy.where(li <= cyl_r, 0, -(li - cyl_r) * s)
+    elif cutter_type == 'BALLCONE':
+        angle = math.radians(operation.cutter_tip_angle) / 2
+        ball_r = operation.ball_radius
+        cutter_r = operation.cutter_diameter / 2
+        Ball_R = ball_r / math.cos(angle)
+        D_ofset = ball_r * math.tan(angle)
+        s = math.tan(math.pi / 2 - angle)
+        inside = l <= cutter_r
+        li = l[inside]
+        with numpy.errstate(invalid='ignore'):
+            ball = numpy.sin(numpy.arccos(li / Ball_R)) * Ball_R - Ball_R
+        z[inside] = numpy.where(li <= ball_r, ball, -(li - ball_r) * s - Ball_R + D_ofset)
+    elif cutter_type == 'BULLNOSE':
+        # flat bottom and torus of the corner radius, skin grows the corner
+        corner_r = min(operation.bull_corner_radius + operation.skin, r)
+        flat_r = r - corner_r
+        d = numpy.maximum(li - flat_r, 0)
+        z[inside] = numpy.sqrt(numpy.maximum(corner_r * corner_r - d * d, 0)) - corner_r
+    return z
+
+
+def getCustomCutterArray(operation, res, pixsize, r):
+    """footprint of custom cutter object, lowest surface of the object rasterized from below at once,
+    like a ray cast upwards from every pixel"""
+    import bpy
+    cutob = bpy.data.objects[operation.cutter_object_name]
+    scale = ((cutob.dimensions.x / cutob.scale.x) / 2) / r
+    print('sampling custom cutter')
+    car = numpy.full((res, res), -10.0)
+    triangles = zbuffer.getObjectTriangles(cutob, world=False)  # ray casts were in object space
+    if triangles is None or len(triangles) == 0:
+        return car
+    triangles = triangles.copy()
+    triangles[:, 2::3] *= -1  # rasterizer keeps the highest surface
+    start = -res / 2.0 * pixsize * scale
+    hits = numpy.full((res, res), zbuffer.BACKGROUND)
+    zbuffer.rasterizeTriangles(triangles, hits, start, start, pixsize * scale, max(res, 1))
+    hit = hits != zbuffer.BACKGROUND
+    # ray cast started at z=-10, only surface above it was found
+    hit &= hits < 10
+    z = hits / scale
+    hit &= z > -9
+    car[hit] = z[hit]
+    maxz = z[hit].max() if hit.any() else -1
+    maxz = max(maxz, -1)
+    car -= maxz
+    return car
+
+
+def getCutterArray(operation, pixsize):
+    """footprint of the cutter of operation at pixsize, memoized by cutter dimensions and pixsize"""
+    key = (image_cache.getCutterKey(operation), pixsize)
+    if key in profiles:
+        profiles.move_to_end(key)
+        return profiles[key].copy()
+
+    cutter_type = operation.cutter_type
+    r = operation.cutter_diameter / 2 + operation.skin  # /operation.pixsize
+    res = math.ceil((r * 2) / pixsize)
+    if cutter_type == 'CUSTOM':
+        car = getCustomCutterArray(operation, res, pixsize, r)
+    else:
+        z = getProfile(cutter_type, getRadiusGrid(res, pixsize), r, operation)
+        car = numpy.where(numpy.isnan(z), -10.0, z)
+
+    profiles[key] = car
+    if len(profiles) > PROFILE_CACHE_SIZE:
+        profiles.popitem(last=False)
+    return car.copy()
@@ -0,0 +1,168 @@
+# blender CAM cycle_time.py (c) 2012 Vilem Novak
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+
+# estimation of machining time of paths, with acceleration of the machine.
+# the machine plans its speed like a motion controller with look-ahead: speed in corners is limited by junction
+# deviation, speed along the path by acceleration and velocity of every axis, and it has to be able to brake
+# before every corner. All of it is computed with numpy over the whole path.
+
+import math
+import numpy
+
+import bpy
+
+
+def limitAcceleration(speeds, lengths, acceleration):
+    """lowers speeds, so that the machine can accelerate and brake between them with given acceleration.
+    speed at i can't exceed sqrt(speed(j)^2 + 2 * acceleration * distance) of any j before and after it,
+    both passes are computed with cumulative minimum. lengths[i] is the distance from i - 1 to i,
+    acceleration can be one value or one for every length."""
+    distance = numpy.cumsum(lengths * acceleration)
+    v2 = speeds * speeds
+    v2 = numpy.minimum(v2, numpy.minimum.accumulate(v2 - 2 * distance) + 2 * distance)  # accelerating forward
+    v2 = numpy.minimum(v2, (numpy.minimum.accumulate((v2 + 2 * distance)[::-1]) - 2 * distance[::-1])[::-1])  # braking
+    return numpy.sqrt(numpy.maximum(v2, 0))
+
+
+def getAxisLimit(direction, limits):
+    """limit along unit directions, given by the axis which reaches its own limit first"""
+    direction = numpy.abs(direction)
+    limits = numpy.asarray(limits, dtype=numpy.float64)
+    with numpy.errstate(divide='ignore'):
+        limit = numpy.min(numpy.where(direction > 0, limits / direction, numpy.inf), axis=1)
+    limit[~numpy.isfinite(limit)] = limits.max()
+    return limit
+
+
+def getMoveTimes(lengths, v0, v1, vmax, acceleration):
+    """times of moves with trapezoidal speed profile from entry speed v0 to exit speed v1,
+    with cruising speed vmax. Short moves don't reach vmax and have triangular profile."""
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        accel_length = (vmax * vmax - v0 * v0) / (2 * acceleration)
+        brake_length = (vmax * vmax - v1 * v1) / (2 * acceleration)
+        cruise = lengths - accel_length - brake_length
+        trapezoid = (vmax - v0) / acceleration + (vmax - v1) / acceleration + cruise / vmax
+        peak = numpy.sqrt(numpy.maximum((2 * acceleration * lengths + v0 * v0 + v1 * v1) / 2, 0))
+        triangle = (peak - v0) / acceleration + (peak - v1) / acceleration
+    times = numpy.where(cruise >= 0, trapezoid, triangle)
+    times[lengths <= 0] = 0
+    return numpy.maximum(times, 0)
+
+
+def getTrajectoryTimes(co, feeds, axis_velocity, axis_acceleration, junction_deviation, rotations=None,
+                       rotary_velocity=0, rotary_acceleration=0):
+    """times of moves to vertices co in seconds, 0 for the first vertex.
+    feeds are requested speeds of the moves in m/s, lower by the axis velocities in m/s.
+    Machine starts and stops at the ends of the path."""
+    n = len(co)
+    times = numpy.zeros(n)
+    if n < 2:
+        return times
+    vect = numpy.diff(co, axis=0)
+    lengths = numpy.sqrt((vect * vect).sum(axis=1))
+    moving = numpy.nonzero(lengths > 0)[0]
+    if len(moving) > 0:
+        vect = vect[moving]
+        length = lengths[moving]
+        direction = vect / length[:, numpy.newaxis]
+        vmax = numpy.minimum(feeds[1:][moving], getAxisLimit(direction, axis_velocity))
+        acceleration = getAxisLimit(direction, axis_acceleration)
+
+        # speed at vertices between moves, grbl like junction deviation model: the machine goes through
+        # the corner as if it was an arc deviating junction_deviation from the corner, with centripetal
+        # acceleration of the slower move.
+        cos = -(direction[:-1] * direction[1:]).sum(axis=1)
+        sin_half = numpy.sqrt(numpy.clip((1 - cos) / 2, 0, 1))
+        corner_acceleration = numpy.minimum(acceleration[:-1], acceleration[1:])
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            junction = numpy.sqrt(corner_acceleration * junction_deviation * sin_half / (1 - sin_half))
+        junction[~numpy.isfinite(junction)] = numpy.inf  # straight continuation
+        junction = numpy.minimum(junction, numpy.minimum(vmax[:-1], vmax[1:]))
+        speeds = numpy.concatenate(((0,), junction, (0,)))
+
+        # look ahead - speeds at vertices which can be reached and braked from along the path
+        speeds = limitAcceleration(speeds, numpy.concatenate(((0,), length)),
+                                   numpy.concatenate(((acceleration[0],), acceleration)))
+        times[moving + 1] = getMoveTimes(length, speeds[:-1], speeds[1:], vmax, acceleration)
+
+    if rotations is not None and rotary_velocity > 0 and rotary_acceleration > 0:
+        # rotary axes move together with linear ones, the move takes as long as the slower of them.
+        # rotations start and stop in every move.
+        angles = numpy.abs(numpy.diff(rotations, axis=0)).max(axis=1)
+        zero = numpy.zeros(n - 1)
+        rotary = getMoveTimes(angles, zero, zero, numpy.full(n - 1, rotary_velocity), rotary_acceleration)
+        times[1:] = numpy.maximum(times[1:], rotary)
+    return times
+
+
+def getPathFeeds(o, co, machine):
+    """feedrates of moves to vertices co in m/min, like they are exported, rapid moves have infinite feedrate"""
+    n = len(co)
+    millfeedrate = min(max(o.feedrate, machine.feedrate_min), machine.feedrate_max)
+    plungefeedrate = millfeedrate * o.plunge_feedrate / 100
+    vect = numpy.zeros((n, 3))
+    vect[1:] = numpy.diff(co, axis=0)
+    lengths = numpy.sqrt((vect * vect).sum(axis=1))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        down = -vect[:, 2] / lengths
+    plunge = (lengths > 0) & (down > math.cos(math.pi / 2 - o.plunge_angle))
+    plunge[0] = False
+    rapid = ~plunge & (co[:, 2] >= o.free_movement_height)
+    rapid[0] = True
+    feeds = numpy.where(plunge, plungefeedrate, millfeedrate)
+    return numpy.where(rapid, numpy.inf, feeds)
+
+
+def getPathDuration(o, mesh):
+    """estimated time of path mesh of operation o in minutes"""
+    machine = bpy.context.scene.cam_machine
+    co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+    mesh.vertices.foreach_get('co', co)
+    co = co.reshape(-1, 3).astype(numpy.float64)
+    feeds = getPathFeeds(o, co, machine)
+
+    rotations = None
+    if mesh.shape_keys is not None:
+        keys = mesh.shape_keys.key_blocks
+        if o.do_simulation_feedrate and keys.find('feedrates') != -1:
+            fadjust = numpy.empty(len(co) * 3, dtype=numpy.float32)
+            keys['feedrates'].data.foreach_get('co', fadjust)
+            scale_graph = 0.05  # warning this has to be same as in simulation!!!!
+            feeds = feeds * fadjust.reshape(-1, 3)[:, 2] / scale_graph
+        if o.machine_axes != '3' and keys.find('rotations') != -1:
+            rotations = numpy.empty(len(co) * 3, dtype=numpy.float32)
+            keys['rotations'].data.foreach_get('co', rotations)
+            rotations = rotations.reshape(-1, 3).astype(numpy.float64)
+            # positions are in the rotated coordinates of the machine
+            co = co.copy()
+            for axis in range(3):
+                angle = rotations[:, axis]
+                if not angle.any():
+                    continue
+                a, b = [(1, 2), (2, 0), (0, 1)][axis]
+                ca = numpy.cos(-angle)
+                sa = numpy.sin(-angle)
+                co[:, a], co[:, b] = co[:, a] * ca - co[:, b] * sa, co[:, a] * sa + co[:, b] * ca
+
+    times = getTrajectoryTimes(co, feeds / 60, numpy.array(machine.axis_feedrate_max) / 60,
+                               numpy.array(machine.acceleration), machine.junction_deviation, rotations,
+                               machine.rotary_speed_max / 60, machine.rotary_acceleration)
+    return float(times.sum()) / 60
@@ -23,6 +23,7 @@
 
 import bpy
 import time
+import json
 import mathutils
 import math
 from math import *
@@ -54,6 +55,12 @@ from cam.polygon_utils_cam import *
 
 from cam import image_utils
 from cam.image_utils import *
+from cam import image_cache
+from cam import cycle_time
+from cam import profiling
+
+from shapely import ops as sops
+from shapely import geometry as sgeometry
 from cam.opencamlib.opencamlib import *
 from cam.nc import iso
 
@@ -70,6 +77,48 @@ def pointonline(a, b, c, tolerence):
         return True
 
 
+def exportMovesFast(c, mesh, o, start, last, unitcorr, millfeedrate, plungefeedrate, freefeedrate, shapek,
+                    scale_graph):
+    """3 axis moves of a whole path at once, numpy version of the vertex loop in exportGcodePath,
+    which gives the same output. Returns last vertex and number of moves."""
+    n = len(mesh.vertices)
+    co = numpy.empty(n * 3, dtype=numpy.float32)
+    mesh.vertices.foreach_get('co', co)
+    co = co.reshape(-1, 3)[start:]
+    if len(co) == 0:
+        return last, 0
+    vi = numpy.arange(start, n)
+    # mesh coordinates and mathutils vectors are single precision, differences are computed like in mathutils
+    prev = numpy.concatenate((numpy.array([last], dtype=numpy.float32), co[:-1]))
+    given = (co != prev) | (vi == 0)[:, numpy.newaxis]
+    vect = co - prev
+    length = numpy.sqrt((vect * vect).sum(axis=1))
+    vect = vect.astype(numpy.float64)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        cosangle = -vect[:, 2] / numpy.sqrt((vect * vect).sum(axis=1))  # angle to down vector
+    angle = numpy.arccos(numpy.clip(cosangle.astype(numpy.float32).astype(numpy.float64), -1, 1))
+    angle = angle.astype(numpy.float32).astype(numpy.float64)
+    plunge = (vi > 0) & (length > 0) & (angle < (pi / 2 - o.plunge_angle))
+    co = co.astype(numpy.float64)
+    rapid = ~plunge & ((co[:, 2] >= o.free_movement_height) | (vi == 0))
+
+    if shapek is not None:
+        fadjust = numpy.empty(len(shapek.data) * 3, dtype=numpy.float32)
+        shapek.data.foreach_get('co', fadjust)
+        fadjust = fadjust.reshape(-1, 3)[start:, 2].astype(numpy.float64) / scale_graph
+    else:
+        fadjust = numpy.ones(len(co))
+    base = numpy.where(plunge, plungefeedrate, millfeedrate)
+    f = numpy.where(rapid, freefeedrate, base * fadjust)
+    # feedrate is set when it differs from the base feedrate of the move, or is adjusted.
+    lastf = numpy.concatenate(((0.1123456,), f[:-1]))
+    setf = numpy.where(rapid, lastf != freefeedrate, (lastf != base) | ((shapek is not None) & (fadjust != 1)))
+
+    c.moves(rapid, co * unitcorr, given, numpy.where(setf, f, numpy.nan))
+    return Vector(co[-1]), len(co)
+
+
+@profiling.timed('export')
 def exportGcodePath(filename, vertslist, operations):
     """exports gcode with the heeks nc adopted library."""
     print("EXPORT")
@@ -209,7 +258,13 @@ def exportGcodePath(filename, vertslist, operations):
             c.set_path_control_mode(2, round(o.G64 * 1000, 5), 0)
 
         mesh = vertslist[i]
-        verts = mesh.vertices[:]
+        # simple 3 axis paths are exported by numpy at once
+        fastexport = o.machine_axes == '3' and o.cutter_type not in ['LASER', 'PLASMA'] \
+            and not o.remove_redundant_points and not split
+        if fastexport:
+            verts = []
+        else:
+            verts = mesh.vertices[:]
         if o.machine_axes != '3':
             rots = mesh.shape_keys.key_blocks['rotations'].data
 
@@ -302,7 +357,6 @@ def exportGcodePath(filename, vertslist, operations):
             last = Vector((m.starting_position.x, m.starting_position.y, m.starting_position.z))
 
         lastrot = Euler((0, 0, 0))
-        duration = 0.0
         f = 0.1123456  # nonsense value, so first feedrate always gets written
         fadjustval = 1  # if simulation load data is Not present
 
@@ -315,6 +369,11 @@ def exportGcodePath(filename, vertslist, operations):
         offline = 0
         online = 0
         cut = True  # active cut variable for laser or plasma
+        if fastexport:
+            last, count = exportMovesFast(c, mesh, o, 1 if i > 0 else 0, last, unitcorr, millfeedrate,
+                                                    plungefeedrate, freefeedrate, shapek if fadjust else None,
+                                                    scale_graph)
+            processedops += count
         for vi, vert in enumerate(verts):
             # skip the first vertex if this is a chained operation
             # ie: outputting more than one operation
@@ -456,8 +515,6 @@ def exportGcodePath(filename, vertslist, operations):
                     # print('normalf',ra,rb)
                     c.feed(x=vx, y=vy, z=vz, a=ra, b=rb)
 
-            duration += vect.length / f
-            # print(duration)
             last = v
             if o.machine_axes != '3':
                 lastrot = r
@@ -496,7 +553,8 @@ def exportGcodePath(filename, vertslist, operations):
             for aline in lines:
                 c.write(aline + '\n')
 
-    o.duration = duration * unitcorr
+        o.duration = cycle_time.getPathDuration(o, mesh)
+
     if enable_dust:
         c.write(stop_dust + '\n')
     if enable_hold:
@@ -515,49 +573,54 @@ def getPath(context, operation):  # should do all path calculations.
     if shapely.speedups.available:
         shapely.speedups.enable()
 
-    # these tags are for caching of some of the results. Not working well still
-    # - although it can save a lot of time during calculation...
-
-    chd = getChangeData(operation)
-    # print(chd)
-    # print(o.changedata)
-    if operation.changedata != chd:  # or 1:
-        operation.update_offsetimage_tag = True
-        operation.update_zbufferimage_tag = True
-        operation.changedata = chd
-
     operation.update_silhouete_tag = True
     operation.update_ambient_tag = True
     operation.update_bullet_collision_tag = True
 
-    utils.getOperationSources(operation)
-
-    operation.warnings = ''
-    checkMemoryLimit(operation)
-
-    print(operation.machine_axes)
-
-    if operation.machine_axes == '3':
-        getPath3axis(context, operation)
-
-    elif (operation.machine_axes == '5' and operation.strategy5axis == 'INDEXED') or (
-            operation.machine_axes == '4' and operation.strategy4axis == 'INDEXED'):
-        # 5 axis operations are now only 3 axis operations that get rotated...
-        operation.orientation = prepareIndexed(operation)  # TODO RENAME THIS
-
-        getPath3axis(context, operation)  # TODO RENAME THIS
-
-        cleanupIndexed(operation)  # TODO RENAME THIS
-    # transform5axisIndexed
-    elif operation.machine_axes == '4':
-        getPath4axis(context, operation)
-
-    # export gcode if automatic.
-    if operation.auto_export:
-        if bpy.data.objects.get("cam_path_{}".format(operation.name)) is None:
-            return
-        p = bpy.data.objects["cam_path_{}".format(operation.name)]
-        exportGcodePath(operation.filename, [p.data], [operation])
+    # stages, counters and memory of the calculation, shown in the operation panel
+    profile = profiling.start(operation.name)
+    try:
+        # sources can rotate the objects, so they are hashed after it
+        utils.getOperationSources(operation)
+
+        # these tags are for caching of some of the results. Not working well still
+        # - although it can save a lot of time during calculation...
+        chd = getChangeData(operation)
+        if operation.changedata != chd:  # or 1:
+            operation.update_offsetimage_tag = True
+            operation.update_zbufferimage_tag = True
+            operation.changedata = chd
+
+        operation.warnings = ''
+        checkMemoryLimit(operation)
+
+        print(operation.machine_axes)
+
+        if operation.machine_axes == '3':
+            getPath3axis(context, operation)
+
+        elif (operation.machine_axes == '5' and operation.strategy5axis == 'INDEXED') or (
+                operation.machine_axes == '4' and operation.strategy4axis == 'INDEXED'):
+            # 5 axis operations are now only 3 axis operations that get rotated...
+            operation.orientation = prepareIndexed(operation)  # TODO RENAME THIS
+
+            getPath3axis(context, operation)  # TODO RENAME THIS
+
+            cleanupIndexed(operation)  # TODO RENAME THIS
+        # transform5axisIndexed
+        elif operation.machine_axes == '4':
+            getPath4axis(context, operation)
+
+        # export gcode if automatic.
+        if operation.auto_export:
+            if bpy.data.objects.get("cam_path_{}".format(operation.name)) is None:
+                return
+            p = bpy.data.objects["cam_path_{}".format(operation.name)]
+            exportGcodePath(operation.filename, [p.data], [operation])
+    finally:
+        profiling.finish()
+        operation.profile_data = json.dumps(profile.toDict())
+        operation.objects_hash = None  # objects can change before the next calculation
 
     operation.changed = False
     t1 = time.process_time() - t
@@ -566,7 +629,8 @@ def getPath(context, operation):  # should do all path calculations.
 
 def getChangeData(o):
     """this is a function to check if object props have changed,
-    to see if image updates are needed in the image based method"""
+    to see if image updates are needed in the image based method.
+    The objects hash is kept in the operation for the cache keys of this calculation."""
     changedata = ''
     obs = []
     if o.geometry_source == 'OBJECT':
@@ -577,6 +641,10 @@ def getChangeData(o):
         changedata += str(ob.location)
         changedata += str(ob.rotation_euler)
         changedata += str(ob.dimensions)
+    o.objects_hash = None
+    if len(obs) > 0:
+        o.objects_hash = image_cache.getObjectsHash(obs)
+        changedata += o.objects_hash
 
     return changedata
 
@@ -590,7 +658,10 @@ def checkMemoryLimit(o):
     res = resx * resy
     limit = o.imgres_limit * 1000000
     # print('co se to deje')
-    if res > limit:
+    if res > limit and o.use_tiled_images and not o.use_exact and o.geometry_source != 'IMAGE':
+        # tiled images are stored on disk, resolution can stay.
+        print('sampling resolution over limit, using tiled images')
+    elif res > limit:
         ratio = (res / limit)
         o.pixsize = o.pixsize * math.sqrt(ratio)
         o.warnings = o.warnings + 'sampling resolution had to be reduced!\n'
@@ -599,6 +670,7 @@ def checkMemoryLimit(o):
 
 # this is the main function.
 # FIXME: split strategies into separate file!
+@profiling.timed('getPath3axis')
 def getPath3axis(context, operation):
     s = bpy.context.scene
     o = operation
@@ -723,28 +795,45 @@ def getPath3axis(context, operation):
         slicesfilled = 0
         utils.getAmbient(o)
 
+        slicez = [o.minz + h * o.slice_detail for h in range(0, nslices)]
+        if nslices > 0:
+            slicez[0] += 0.0000001
+            # if people do mill flat areas, this helps to reach those...
+            # otherwise first layer would actually be one slicelevel above min z.
+        # slices are read from one index image, pixel is in slice h when its index > h. A slice differs from
+        # the previous one only where index == h, unchanged slices reuse the previous outlines.
+        sliceindex = getSliceIndex(o.offset_image, slicez)
+        slicechanges = numpy.bincount(sliceindex.ravel(), minlength=nslices + 1)
+        rowmax = sliceindex.max(axis=1)
+        colmax = sliceindex.max(axis=0)
+        slicepolys = None
+        poly = spolygon.Polygon()  # polygversion
+
         for h in range(0, nslices):
             layerstepinc += 1
             slicechunks = []
-            z = o.minz + h * o.slice_detail
-            if h == 0:
-                z += 0.0000001
-                # if people do mill flat areas, this helps to reach those...
-                # otherwise first layer would actually be one slicelevel above min z.
+            z = slicez[h]
 
-            islice = o.offset_image > z
-            slicepolys = imageToShapely(o, islice, with_border=True)
-
-            poly = spolygon.Polygon()  # polygversion
+            if slicepolys is None or slicechanges[h] > 0:
+                crop = getSliceCrop(rowmax, colmax, h)
+                if crop is None:
+                    slicepolys = sgeometry.MultiPolygon()
+                else:
+                    x0, x1, y0, y1 = crop
+                    slicepolys = imageToShapely(o, sliceindex[x0:x1, y0:y1] > h, with_border=True, origin=(x0, y0),
+                                                shape=sliceindex.shape)
+                poly = spolygon.Polygon()  # polygversion
+                if len(slicepolys.geoms) > 0:
+                    poly = sops.unary_union(list(slicepolys.geoms))
+                    profiling.count('shapely ops')
             lastchunks = []
 
-            for p in slicepolys:
-                poly = poly.union(p)  # polygversion TODO: why is this added?
+            for p in slicepolys.geoms:
                 nchunks = shapelyToChunks(p, z)
                 nchunks = limitChunks(nchunks, o, force=True)
                 lastchunks.extend(nchunks)
                 slicechunks.extend(nchunks)
-            if len(slicepolys) > 0:
+            if len(slicepolys.geoms) > 0:
                 slicesfilled += 1
 
             #
@@ -784,6 +873,7 @@ def getPath3axis(context, operation):
                         lastchunks = nchunks
                         # slicechunks.extend(polyToChunks(restpoly,z))
                         restpoly = restpoly.buffer(-o.dist_between_paths, resolution=o.circle_detail)
+                        profiling.count('shapely ops')
 
                         i += 1
                 # print(i)
@@ -813,6 +903,7 @@ def getPath3axis(context, operation):
                         parentChildDist(lastchunks, nchunks, o)
                         lastchunks = nchunks
                         restpoly = restpoly.buffer(-o.dist_between_paths, resolution=o.circle_detail)
+                        profiling.count('shapely ops')
                         i += 1
 
                 percent = int(h / nslices * 100)
@@ -842,6 +933,7 @@ def getPath3axis(context, operation):
         strategy.medial_axis(o)
 
 
+@profiling.timed('getPath4axis')
 def getPath4axis(context, operation):
     o = operation
     utils.getBounds(o)
@@ -0,0 +1,261 @@
+# blender CAM image_cache.py (c) 2012 Vilem Novak
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+
+# content addressed cache for z-buffer and offset images, simulation checkpoints and silhouetes.
+# images are stored under a hash of everything they depend on - geometry, modifiers, cutter, raster settings,
+# so any operation with the same stock and tool can reuse them, also after reopening the file.
+
+import os
+import hashlib
+
+import bpy
+import numpy
+from shapely import wkb as swkb
+
+from cam import simple
+from cam import profiling
+
+CACHE_VERSION = 1  # change this when the image computation changes, to invalidate old cache files
+
+
+def getCacheDir():
+    return simple.getSimulationPath() + 'cache' + os.sep
+
+
+def getCacheFile(key, suffix):
+    return getCacheDir() + key + suffix
+
+
+def getCacheSizeLimit():
+    """cache size limit in bytes from addon preferences"""
+    try:
+        return bpy.context.preferences.addons['cam'].preferences.cache_size_limit * 1024 * 1024
+    except (KeyError, AttributeError):
+        return 2048 * 1024 * 1024
+
+
+def hashValues(h, values):
+    for v in values:
+        h.update(repr(v).encode())
+
+
+def hashModifiers(h, ob):
+    """hashes modifier stack with all simple settings of the modifiers"""
+    for mod in ob.modifiers:
+        hashValues(h, (mod.name, mod.type))
+        for prop in mod.bl_rna.properties:
+            if prop.identifier == 'rna_type':
+                continue
+            value = getattr(mod, prop.identifier, None)
+            if prop.type == 'POINTER':
+                value = getattr(value, 'name', None)
+            elif prop.type == 'COLLECTION':
+                continue
+            elif getattr(prop, 'is_array', False):
+                value = tuple(value)
+            hashValues(h, (prop.identifier, value))
+
+
+def hashObjectGeometry(h, ob):
+    """hashes evaluated geometry of the object in world space"""
+    if ob.mode == 'EDIT':
+        ob.update_from_editmode()
+    hashValues(h, (ob.name, ob.type))
+    h.update(numpy.array(ob.matrix_world, dtype=numpy.float64).tobytes())
+    hashModifiers(h, ob)
+
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    obe = ob.evaluated_get(depsgraph)
+    try:
+        mesh = obe.to_mesh()
+    except RuntimeError:
+        mesh = None
+    if mesh is not None:
+        co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get('co', co)
+        h.update(co.tobytes())
+        loops = numpy.empty(len(mesh.loops), dtype=numpy.int32)
+        mesh.loops.foreach_get('vertex_index', loops)
+        h.update(loops.tobytes())
+        totals = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+        mesh.polygons.foreach_get('loop_total', totals)
+        h.update(totals.tobytes())
+        obe.to_mesh_clear()
+
+
+def getObjectsHash(objects):
+    h = hashlib.blake2b(digest_size=16)
+    for ob in sorted(objects, key=lambda ob: ob.name):
+        hashObjectGeometry(h, ob)
+    return h.hexdigest()
+
+
+def getOperationObjectsHash(o):
+    """hash of the operation objects, computed once during a path calculation by getChangeData"""
+    if o.objects_hash is not None:
+        return o.objects_hash
+    return getObjectsHash(o.objects)
+
+
+def getZbufferKey(o):
+    """key of the z-buffer image, it depends on geometry and the sampled area"""
+    h = hashlib.blake2b(digest_size=16)
+    hashValues(h, ('zbuffer', CACHE_VERSION, getOperationObjectsHash(o), o.pixsize, o.borderwidth,
+                   o.min.x, o.min.y, o.max.x, o.max.y, o.zbuffer_method))
+    return h.hexdigest()
+
+
+def getCutterKey(o):
+    """key of the cutter profile"""
+    h = hashlib.blake2b(digest_size=16)
+    hashValues(h, (o.cutter_type, o.cutter_diameter, o.cutter_tip_angle, o.ball_radius, o.cylcone_diameter,
+                   o.bull_corner_radius, o.skin))
+    if o.cutter_type == 'CUSTOM' and o.cutter_object_name in bpy.data.objects:
+        cutob = bpy.data.objects[o.cutter_object_name]
+        hashValues(h, (cutob.scale.x, getObjectsHash([cutob])))
+    return h.hexdigest()
+
+
+def getStockKey(limits, simulation_detail, borderwidth, resx, resy):
+    """key of the stock before simulation"""
+    h = hashlib.blake2b(digest_size=16)
+    hashValues(h, ('stock', CACHE_VERSION, tuple(limits), simulation_detail, borderwidth, resx, resy))
+    return h.hexdigest()
+
+
+def getSimulationKey(previouskey, o, ob):
+    """key of simulated stock after operation o with path object ob, chained with key of the stock before it"""
+    h = hashlib.blake2b(digest_size=16)
+    hashValues(h, ('simulation', previouskey, getCutterKey(o), o.do_simulation_feedrate))
+    if o.do_simulation_feedrate:  # feedrates are optimized during simulation
+        m = bpy.context.scene.cam_machine
+        hashValues(h, (o.feedrate, o.plunge_angle, m.feedrate_min, m.feedrate_max, tuple(m.acceleration)))
+    h.update(numpy.array(ob.matrix_world, dtype=numpy.float64).tobytes())
+    co = numpy.empty(len(ob.data.vertices) * 3, dtype=numpy.float32)
+    ob.data.vertices.foreach_get('co', co)
+    h.update(co.tobytes())
+    return h.hexdigest()
+
+
+def getArrayHash(a):
+    """hash of image data, for images which don't come from geometry"""
+    h = hashlib.blake2b(digest_size=16)
+    hashValues(h, (a.shape, a.dtype.str))
+    h.update(numpy.ascontiguousarray(a).tobytes())
+    return h.hexdigest()
+
+
+def getOffsetKey(o, zbufferkey):
+    """key of the offset image, z-buffer offset by the cutter"""
+    h = hashlib.blake2b(digest_size=16)
+    hashValues(h, ('offset', CACHE_VERSION, zbufferkey, getCutterKey(o), o.pixsize, o.inverse, o.min.z))
+    return h.hexdigest()
+
+
+def getSilhoueteKey(objectshash, use_modifiers):
+    """key of the silhouete of objects with hash objectshash made from their triangles"""
+    h = hashlib.blake2b(digest_size=16)
+    hashValues(h, ('silhouete', CACHE_VERSION, objectshash, use_modifiers))
+    return h.hexdigest()
+
+
+def loadGeometry(key):
+    """returns cached shapely geometry or None"""
+    fname = getCacheFile(key, '.wkb')
+    if not os.path.isfile(fname):
+        profiling.count('cache misses')
+        return None
+    try:
+        with open(fname, 'rb') as f:
+            geometry = swkb.loads(f.read())
+    except Exception:  # broken file, it gets replaced
+        profiling.count('cache misses')
+        return None
+    os.utime(fname)
+    profiling.count('cache hits')
+    simple.progress('geometry loaded from cache ' + key)
+    return geometry
+
+
+def saveGeometry(key, geometry):
+    """stores shapely geometry in the cache as well known binary"""
+    cachedir = getCacheDir()
+    os.makedirs(cachedir, exist_ok=True)  # background processes of a batch can create it at once
+    fname = getCacheFile(key, '.wkb')
+    tmpname = getCacheFile(key, '.%i.tmp.wkb' % os.getpid())
+    with open(tmpname, 'wb') as f:
+        f.write(swkb.dumps(geometry))
+    os.replace(tmpname, fname)
+    evict()
+
+
+def loadImage(key):
+    """returns cached image array or None"""
+    fname = getCacheFile(key, '.npy')
+    if not os.path.isfile(fname):
+        profiling.count('cache misses')
+        return None
+    try:
+        a = numpy.load(fname)
+    except (IOError, ValueError):
+        profiling.count('cache misses')
+        return None
+    os.utime(fname)  # most recently used
+    profiling.count('cache hits')
+    simple.progress('image loaded from cache ' + key)
+    return a
+
+
+def saveImage(key, a):
+    """stores image array in the cache as raw .npy, which loads without decompression, and evicts old files"""
+    cachedir = getCacheDir()
+    os.makedirs(cachedir, exist_ok=True)  # background processes of a batch can create it at once
+    fname = getCacheFile(key, '.npy')
+    tmpname = getCacheFile(key, '.%i.tmp.npy' % os.getpid())
+    numpy.save(tmpname, numpy.ascontiguousarray(a))
+    os.replace(tmpname, fname)  # readers never see half written files
+    evict()
+
+
+def evict():
+    """removes least recently used files until the cache fits the size limit"""
+    cachedir = getCacheDir()
+    files = []
+    total = 0
+    for name in os.listdir(cachedir):
+        fname = cachedir + name
+        try:
+            st = os.stat(fname)
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, fname))
+        total += st.st_size
+    files.sort()
+    limit = getCacheSizeLimit()
+    for mtime, size, fname in files:
+        if total <= limit:
+            break
+        try:
+            os.remove(fname)
+            total -= size
+        except OSError:  # file in use, e.g. memory mapped on windows
+            pass
+
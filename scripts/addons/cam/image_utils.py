@@ -23,8 +23,8 @@ import numpy
 import math
 import time
 import random
+import os
 
-import curve_simplify
 import mathutils
 from mathutils import *
 
@@ -33,6 +33,12 @@ from cam.simple import *
 from cam import chunk
 from cam.chunk import *
 from cam import simulation
+from cam import image_cache
+from cam import zbuffer
+from cam import profiling
+from cam.sample_worker import getSampleImageArray
+
+DILATE_TILE_SIZE = 2 ** 22  # image pixels processed at once when offsetting the image
 
 
 def getCircle(r, z):
@@ -71,6 +77,7 @@ def getCircleBinary(r):
 
 
 def numpysave(a, iname):
+    """saves 2d array as single channel 32 bit EXR image, only for viewing it in blender"""
     inamebase = bpy.path.basename(iname)
 
     i = numpytoimage(a, inamebase)
@@ -103,12 +110,10 @@ def numpytoimage(a, iname):
             if image.name[:len(iname)] == iname and image.size[0] == a.shape[0] and image.size[1] == a.shape[1]:
                 i = image
 
-    d = a.shape[0] * a.shape[1]
-    a = a.swapaxes(0, 1)
-    a = a.reshape(d)
-    a = a.repeat(4)
-    a[3::4] = 1
-    i.pixels[:] = a[:]  # this gives big speedup!
+    # rgba pixels, rows along x, written at once
+    p = numpy.ones((a.shape[1], a.shape[0], 4), dtype=numpy.float32)
+    p[:, :, :3] = a.swapaxes(0, 1)[:, :, numpy.newaxis]
+    i.pixels.foreach_set(p.reshape(-1))
     print('\ntime ' + str(time.time() - t))
     return i
 
@@ -118,23 +123,16 @@ def imagetonumpy(i):
 
     width = i.size[0]
     height = i.size[1]
-    na = numpy.array((0.1), dtype=float)
-
-    size = width * height
-    na.resize(size * 4)
-
-    p = i.pixels[:]
-    # these 2 lines are about 15% faster than na[:]=i.pixels[:].... whyyyyyyyy!!?!?!?!?!
-    # Blender image data access is evil.
-    na[:] = p
-    na = na[::4]
-    na = na.reshape(height, width)
-    na = na.swapaxes(0, 1)
+    p = numpy.empty(width * height * 4, dtype=numpy.float32)
+    i.pixels.foreach_get(p)
+    # first channel only, as x, y array
+    na = p[::4].reshape(height, width).swapaxes(0, 1).astype(numpy.float64)
 
     print('\ntime of image to numpy ' + str(time.time() - t))
     return na
 
 
+@profiling.timed('offset')
 def offsetArea(o, samples):
     """ offsets the whole image with the cutter + skin offsets """
     if o.update_offsetimage_tag:
@@ -158,21 +156,7 @@ def offsetArea(o, samples):
             sourceArray = -sourceArray + minz
         print(o.offset_image.shape)
         comparearea = o.offset_image[m: width - cwidth + m, m:height - cwidth + m]
-        # i=0
-        for x in range(0, cwidth):  # cwidth):
-            text = "Offsetting depth " + str(int(x * 100 / cwidth))
-            # o.operator.report({"INFO"}, text)
-            simple.progress('offset ', int(x * 100 / cwidth))
-            for y in range(0, cwidth):
-                # TODO:OPTIMIZE THIS - this can run much faster when the areas won't be created each run????
-                #  tests dont work now
-                if cutterArray[x, y] > -10:
-                    # i+=1
-                    # progress(i)
-                    # winner
-                    numpy.maximum(sourceArray[x: width - cwidth + x, y: height - cwidth + y] + cutterArray[x, y],
-                                  comparearea, comparearea)
-                    # contest of performance
+        dilateArea(sourceArray, cutterArray, comparearea)
 
         o.offset_image[m: width - cwidth + m, m:height - cwidth + m] = comparearea
         # progress('offseting done')
@@ -184,6 +168,69 @@ def offsetArea(o, samples):
     return o.offset_image
 
 
+def getCutterRuns(cutterArray):
+    """splits the cutter footprint into row runs of equal depth, returns list of (x, y, length, z)"""
+    runs = []
+    cwidth = len(cutterArray)
+    for x in range(0, cwidth):
+        row = cutterArray[x]
+        y = 0
+        while y < len(row):
+            if row[y] > -10:
+                y1 = y + 1
+                while y1 < len(row) and row[y1] == row[y]:
+                    y1 += 1
+                runs.append((x, y, y1 - y, row[y]))
+                y = y1
+            else:
+                y += 1
+    return runs
+
+
+def dilateArea(sourceArray, cutterArray, comparearea):
+    """grayscale dilation of sourceArray by the cutter, maximized into comparearea.
+    flat parts of the cutter (end mills, flat tips) are evaluated with running maximum filters along rows,
+    so a flat cutter costs O(cutter width) image passes instead of O(cutter pixels).
+    the rest of the cutter is stamped pixel by pixel. The image is processed in tiles of rows
+    to stay in cache. Gives exactly the same result as stamping every cutter pixel."""
+    cwidth = len(cutterArray)
+    owidth = comparearea.shape[0]
+    oheight = comparearea.shape[1]
+    if owidth <= 0 or oheight <= 0:
+        return comparearea
+
+    runs = getCutterRuns(cutterArray)
+    spots = []
+    longruns = {}
+    for r in runs:
+        if r[2] > 1:
+            longruns.setdefault(r[2], []).append(r)
+        else:
+            spots.append(r)
+    if len(longruns) > 0:
+        maxw = max(longruns.keys())
+
+    tilerows = min(owidth, max(cwidth, DILATE_TILE_SIZE // sourceArray.shape[1]))
+    for x0 in range(0, owidth, tilerows):
+        x1 = min(owidth, x0 + tilerows)
+        simple.progress('offset ', int(x0 * 100 / owidth))
+        tile = comparearea[x0:x1]
+
+        for x, y, length, z in spots:
+            numpy.maximum(sourceArray[x0 + x: x1 + x, y: oheight + y] + z, tile, out=tile)
+
+        if len(longruns) > 0:
+            # running maximum of growing width along the rows of the tile
+            src = sourceArray[x0: x1 + cwidth - 1]
+            runmax = src.copy()
+            h = src.shape[1]
+            for w in range(2, maxw + 1):
+                numpy.maximum(runmax[:, :h - w + 1], src[:, w - 1:], out=runmax[:, :h - w + 1])
+                for x, y, length, z in longruns.get(w, ()):
+                    numpy.maximum(runmax[x: x + x1 - x0, y: oheight + y] + z, tile, out=tile)
+    return comparearea
+
+
 def dilateAr(ar, cycles):
     for c in range(cycles):
         ar[1:-1, :] = numpy.logical_or(ar[1:-1, :], ar[:-2, :])
@@ -827,184 +874,190 @@ def crazyStrokeImageBinary(o, ar, avoidar):
     return chunks
 
 
-def imageToChunks(o, image, with_border=False):
-    t = time.time()
-    minx, miny, minz, maxx, maxy, maxz = o.min.x, o.min.y, o.min.z, o.max.x, o.max.y, o.max.z
+def getMaskEdges(image, r, origin=(0, 0), shape=None):
+    """boundary edges of True areas of the image between pixel corners, directed with the True side on the left.
+    Pixel a, b lies between corners a - 1, b - 1 and a, b. Only edges of pixels r < a < w - r, r < b < h - r are
+    used, like the outline never goes through the border. Image can be a part of a bigger image of shape,
+    starting at pixel origin, coordinates are then in the bigger image. Returns start and end corners as Nx2 arrays."""
+    if shape is None:
+        shape = image.shape
+    w, h = shape
+    # between pixels a, b and a, b + 1
+    a, b = numpy.nonzero(image[:, :-1] != image[:, 1:])
+    below = image[a, b]
+    a, b = a + origin[0], b + origin[1]
+    inside = (r < a) & (a < w - r) & (r < b) & (b < h - r)
+    a, b, below = a[inside], b[inside], below[inside]
+    hstart = numpy.stack((numpy.where(below, a, a - 1), b), axis=1)
+    hend = numpy.stack((numpy.where(below, a - 1, a), b), axis=1)
+    # between pixels a, b and a + 1, b
+    a, b = numpy.nonzero(image[:-1, :] != image[1:, :])
+    left = image[a, b]
+    a, b = a + origin[0], b + origin[1]
+    inside = (r < a) & (a < w - r) & (r < b) & (b < h - r)
+    a, b, left = a[inside], b[inside], left[inside]
+    vstart = numpy.stack((a, numpy.where(left, b - 1, b)), axis=1)
+    vend = numpy.stack((a, numpy.where(left, b, b - 1)), axis=1)
+    return numpy.concatenate((hstart, vstart)), numpy.concatenate((hend, vend))
+
+
+def traceContours(image, r=0, origin=(0, 0), shape=None):
+    """ordered outlines of True areas of the boolean image, as corner coordinates and index ranges of the
+    outlines. Outer outlines go counterclockwise and holes clockwise, closed outlines end with their first corner.
+    Outlines are traced for all edges at once: every edge gets its following edge, and rings are ordered with
+    pointer jumping. Diagonal pixels don't connect areas. Origin and shape are like in getMaskEdges."""
+    start, end = getMaskEdges(image, r, origin, shape)
+    n = len(start)
+    if n == 0:
+        return numpy.zeros((0, 2)), []
+    h = (image.shape if shape is None else shape)[1] + 1
+    startid = start[:, 0] * h + start[:, 1]
+    endid = end[:, 0] * h + end[:, 1]
+
+    # following edge starts where the edge ends, in corners with two of them the outline turns left
+    order = numpy.argsort(startid, kind='stable')
+    lo = numpy.searchsorted(startid[order], endid, side='left')
+    count = numpy.searchsorted(startid[order], endid, side='right') - lo
+    edges = numpy.arange(n)
+    nxt = edges.copy()  # edges without following edge point to themselves
+    first = order[numpy.minimum(lo, n - 1)]
+    second = order[numpy.minimum(lo + 1, n - 1)]
+    direction = end - start
+    firstdirection = direction[first]
+    leftturn = (firstdirection[:, 0] == -direction[:, 1]) & (firstdirection[:, 1] == direction[:, 0])
+    nxt[count == 1] = first[count == 1]
+    saddle = count == 2
+    nxt[saddle] = numpy.where(leftturn[saddle], first[saddle], second[saddle])
+
+    # rings are cut before their lowest edge, so all outlines become lists
+    steps = int(numpy.ceil(numpy.log2(n))) + 1
+    label = edges.copy()
+    jump = nxt.copy()
+    for i in range(steps):
+        label = numpy.minimum(label, label[jump])
+        jump = jump[jump]
+    ring = nxt[jump] != jump
+    nxt[ring & (nxt == label)] = edges[ring & (nxt == label)]
+
+    # list ranking - distance of every edge to the last edge of its outline
+    distance = (nxt != edges).astype(numpy.int64)
+    jump = nxt.copy()
+    for i in range(steps):
+        distance = distance + distance[jump]
+        jump = jump[jump]
+    order = numpy.lexsort((-distance, jump))
+    last = jump[order]
+    ends = numpy.nonzero(numpy.diff(last))[0] + 1
+    bounds = numpy.concatenate(((0,), ends, (n,)))
+
+    # corners of an outline are starts of its edges and end of the last edge
+    corners = numpy.empty((n + len(bounds) - 1, 2), dtype=numpy.float64)
+    slots = numpy.arange(n) + numpy.searchsorted(bounds, numpy.arange(n), side='right') - 1
+    corners[slots] = start[order]
+    corners[bounds[1:] + numpy.arange(len(bounds) - 1)] = end[order[bounds[1:] - 1]]
+    ranges = [(i0 + k, i1 + k + 1) for k, (i0, i1) in enumerate(zip(bounds[:-1], bounds[1:]))]
+    return corners, ranges
+
+
+def simplifyRDP(points, ranges, tolerance):
+    """Ramer-Douglas-Peucker simplification of all polylines given by index ranges of points at once, recursion
+    is done level by level for all segments together. Distances are measured to lines through the segment ends,
+    or to the end point for closed polylines. Returns mask of kept points."""
+    keep = numpy.zeros(len(points), dtype=bool)
+    s = numpy.array([i0 for i0, i1 in ranges], dtype=numpy.int64)
+    e = numpy.array([i1 - 1 for i0, i1 in ranges], dtype=numpy.int64)
+    keep[s] = True
+    keep[e] = True
+    while len(s) > 0:
+        inner = e - s > 1
+        s, e = s[inner], e[inner]
+        if len(s) == 0:
+            break
+        counts = e - s - 1
+        offsets = numpy.cumsum(counts) - counts
+        segment = numpy.repeat(numpy.arange(len(s)), counts)
+        index = s[segment] + 1 + numpy.arange(len(segment)) - offsets[segment]
+        pa = points[s][segment]
+        d = points[e][segment] - pa
+        v = points[index] - pa
+        length = numpy.sqrt((d * d).sum(axis=1))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            dist = numpy.where(length > 0, numpy.abs(d[:, 0] * v[:, 1] - d[:, 1] * v[:, 0]) / length,
+                               numpy.sqrt((v * v).sum(axis=1)))
+        maxdist = numpy.maximum.reduceat(dist, offsets)
+        # first point with the maximum distance in every segment
+        ismax = numpy.nonzero(dist == maxdist[segment])[0]
+        segments, firstmax = numpy.unique(segment[ismax], return_index=True)
+        k = index[ismax[firstmax]]
+        split = maxdist > tolerance
+        k = k[split]
+        keep[k] = True
+        s, e = numpy.concatenate((s[split], k)), numpy.concatenate((k, e[split]))
+    return keep
+
+
+def imageToChunks(o, image, with_border=False, origin=(0, 0), shape=None):
+    """outlines of True areas of image as chunks, simplified by RDP. Image can be a part of the operation image,
+    see getMaskEdges."""
+    minx, miny = o.min.x, o.min.y
     pixsize = o.pixsize
 
-    image = image.astype(numpy.uint8)
-
-    # progress('detecting outline')
-    edges = []
-    ar = image[:, :-1] - image[:, 1:]
-
-    indices1 = ar.nonzero()
     borderspread = 2
     # o.cutter_diameter/o.pixsize#when the border was excluded precisely, sometimes it did remove some silhouette parts
     r = o.borderwidth - borderspread
     # to prevent outline of the border was 3 before and also (o.cutter_diameter/2)/pixsize+o.borderwidth
     if with_border:
-        #   print('border')
         r = 0
-    w = image.shape[0]
-    h = image.shape[1]
     coef = 0.75  # compensates for imprecisions
-    for id in range(0, len(indices1[0])):
-        a = indices1[0][id]
-        b = indices1[1][id]
-        if r < a < w - r and r < b < h - r:
-            edges.append(((a - 1, b), (a, b)))
-
-    ar = image[:-1, :] - image[1:, :]
-    indices2 = ar.nonzero()
-    for id in range(0, len(indices2[0])):
-        a = indices2[0][id]
-        b = indices2[1][id]
-        if r < a < w - r and r < b < h - r:
-            edges.append(((a, b - 1), (a, b)))
-
-    polychunks = []
-    # progress(len(edges))
-
-    d = {}
-    for e in edges:
-        d[e[0]] = []
-        d[e[1]] = []
-    for e in edges:
-        verts1 = d[e[0]]
-        verts2 = d[e[1]]
-        verts1.append(e[1])
-        verts2.append(e[0])
-
-    if len(edges) > 0:
-
-        ch = [edges[0][0], edges[0][1]]  # first and his reference
-
-        d[edges[0][0]].remove(edges[0][1])
-
-        i = 0
-        specialcase = 0
-        # progress('condensing outline')
-        while len(
-                d) > 0 and i < 20000000:
-            verts = d.get(ch[-1], [])
-            closed = False
-            # print(verts)
-
-            if len(verts) <= 1:  # this will be good for not closed loops...some time
-                closed = True
-                if len(verts) == 1:
-                    ch.append(verts[0])
-                    verts.remove(verts[0])
-            elif len(verts) >= 3:
-                specialcase += 1
-                v1 = ch[-1]
-                v2 = ch[-2]
-                white = image[v1[0], v1[1]]
-                comesfromtop = v1[1] < v2[1]
-                comesfrombottom = v1[1] > v2[1]
-                comesfromleft = v1[0] > v2[0]
-                comesfromright = v1[0] < v2[0]
-                take = False
-                for v in verts:
-                    if v[0] == ch[-2][0] and v[1] == ch[-2][1]:
-                        pass
-                        verts.remove(v)
-
-                    if not take:
-                        if (not white and comesfromtop) or (white and comesfrombottom):  # goes right
-                            if v1[0] + 0.5 < v[0]:
-                                take = True
-                        elif (not white and comesfrombottom) or (white and comesfromtop):  # goes left
-                            if v1[0] > v[0] + 0.5:
-                                take = True
-                        elif (not white and comesfromleft) or (white and comesfromright):  # goes down
-                            if v1[1] > v[1] + 0.5:
-                                take = True
-                        elif (not white and comesfromright) or (white and comesfromleft):  # goes up
-                            if v1[1] + 0.5 < v[1]:
-                                take = True
-                        if take:
-                            ch.append(v)
-                            verts.remove(v)
-
-            else:  # here it has to be 2 always
-                done = False
-                for vi in range(len(verts) - 1, -1, -1):
-                    if not done:
-                        v = verts[vi]
-                        if v[0] == ch[-2][0] and v[1] == ch[-2][1]:
-                            pass
-                            verts.remove(v)
-                        else:
-
-                            ch.append(v)
-                            done = True
-                            verts.remove(v)
-                            if v[0] == ch[0][0] and v[1] == ch[0][1]:  # or len(verts)<=1:
-                                closed = True
-
-            if closed:
-                polychunks.append(ch)
-                for si, s in enumerate(ch):
-                    # print(si)
-                    if si > 0:  # first one was popped
-                        if d.get(s, None) is not None and len(d[s]) == 0:
-                            # this makes the case much less probable, but i think not impossible
-                            d.pop(s)
-                if len(d) > 0:
-                    newch = False
-                    while not newch:
-                        v1 = d.popitem()
-                        if len(v1[1]) > 0:
-                            ch = [v1[0], v1[1][0]]
-                            newch = True
-
-            # print(' la problema grandiosa')
-            i += 1
-            if i % 10000 == 0:
-                print(len(ch))
-                # print(polychunks)
-                print(i)
-
-        vecchunks = []
-
-        for ch in polychunks:
-            vecchunk = []
-            vecchunks.append(vecchunk)
-            for i in range(0, len(ch)):
-                ch[i] = ((ch[i][0] + coef - o.borderwidth) * pixsize + minx,
-                         (ch[i][1] + coef - o.borderwidth) * pixsize + miny, 0)
-                vecchunk.append(Vector(ch[i]))
-        # print('optimizing outline')
-
-        # print('directsimplify')
-        reduxratio = 1.25  # was 1.25
-        soptions = ['distance', 'distance', o.pixsize * reduxratio, 5, o.pixsize * reduxratio]
-        nchunks = []
-        for i, ch in enumerate(vecchunks):
-
-            s = curve_simplify.simplify_RDP(ch, soptions)
-            # print(s)
-            nch = camPathChunk([])
-            for i in range(0, len(s)):
-                nch.points.append((ch[s[i]].x, ch[s[i]].y))
-
-            if len(nch.points) > 2:
-                nchunks.append(nch)
-
-        return nchunks
-    else:
+    corners, ranges = traceContours(numpy.asarray(image, dtype=bool), r, origin, shape)
+    if len(ranges) == 0:
         return []
+    corners[:, 0] = (corners[:, 0] + coef - o.borderwidth) * pixsize + minx
+    corners[:, 1] = (corners[:, 1] + coef - o.borderwidth) * pixsize + miny
+
+    reduxratio = 1.25  # was 1.25
+    keep = simplifyRDP(corners, ranges, o.pixsize * reduxratio)
+    nchunks = []
+    for i0, i1 in ranges:
+        points = corners[i0:i1][keep[i0:i1]]
+        if len(points) > 2:
+            nch = camPathChunk([])
+            nch.points = chunk.arrayToPoints(points)
+            nchunks.append(nch)
+    return nchunks
 
 
-def imageToShapely(o, i, with_border=False):
-    polychunks = imageToChunks(o, i, with_border)
+@profiling.timed('outlines')
+def imageToShapely(o, i, with_border=False, origin=(0, 0), shape=None):
+    polychunks = imageToChunks(o, i, with_border, origin, shape)
     polys = chunksToShapely(polychunks)
 
     return polys
 
 
+@profiling.timed('slices')
+def getSliceIndex(image, levels, rows=1024):
+    """count of levels below every pixel, pixel is above levels[i] when index > i, so slices of the image
+    at all levels come from one image. Levels must be ascending, image is processed by rows,
+    it can be memory mapped."""
+    levels = numpy.asarray(levels, dtype=image.dtype)  # compared in the precision of the image, like image > z
+    index = numpy.empty(image.shape, dtype=numpy.int32)
+    for x0 in range(0, image.shape[0], rows):
+        index[x0:x0 + rows] = numpy.searchsorted(levels, image[x0:x0 + rows], side='left')
+    return index
+
+
+def getSliceCrop(rowmax, colmax, level, margin=1):
+    """index ranges of the part of the slice image containing all pixels above level with a margin of empty pixels,
+    from maxima of slice index along rows and columns. None for empty slice."""
+    xs = numpy.nonzero(rowmax > level)[0]
+    ys = numpy.nonzero(colmax > level)[0]
+    if len(xs) == 0:
+        return None
+    return (max(xs[0] - margin, 0), min(xs[-1] + margin + 1, len(rowmax)), max(ys[0] - margin, 0),
+            min(ys[-1] + margin + 1, len(colmax)))
+
+
 def getSampleImage(s, sarray, minz):
     x = s[0]
     y = s[1]
@@ -1033,10 +1086,197 @@ def getResolution(o):
     resx = ceil(sx / o.pixsize) + 2 * o.borderwidth
     resy = ceil(sy / o.pixsize) + 2 * o.borderwidth
 
+def renderZbuffer(o, resx, resy, cx, cy, iname):
+    """renders the depth of operation objects with an orthographic camera centered at cx, cy,
+    saves it as iname and returns the loaded image"""
+    s = bpy.context.scene
+
+    # prepare nodes first
+    s.use_nodes = True
+    n = s.node_tree
+
+    n.links.clear()
+    n.nodes.clear()
+    n1 = n.nodes.new('CompositorNodeRLayers')
+    n2 = n.nodes.new('CompositorNodeViewer')
+    n3 = n.nodes.new('CompositorNodeComposite')
+    n.links.new(n1.outputs['Depth'], n2.inputs['Image'])
+    n.links.new(n1.outputs['Depth'], n3.inputs['Image'])
+    n.nodes.active = n2
+    ###################
+
+    r = s.render
+    r.resolution_x = resx
+    r.resolution_y = resy
+
+    # various settings for  faster render
+    r.resolution_percentage = 100
+
+    r.engine = 'BLENDER_EEVEE'
+    ff = r.image_settings.file_format
+    cm = r.image_settings.color_mode
+    r.image_settings.file_format = 'OPEN_EXR'
+    r.image_settings.color_mode = 'BW'
+    r.image_settings.color_depth = '32'
+
+    # camera settings
+    camera = s.camera
+    if camera is None:
+        bpy.ops.object.camera_add(align='WORLD', enter_editmode=False, location=(0, 0, 0),
+                                  rotation=(0, 0, 0))
+        camera = bpy.context.active_object
+        bpy.context.scene.camera = camera
+
+    camera.data.type = 'ORTHO'
+    camera.data.ortho_scale = max(resx * o.pixsize, resy * o.pixsize)
+    camera.location = (cx, cy, 1)
+    camera.rotation_euler = (0, 0, 0)
+    # if not o.render_all:#removed in 0.3
+
+    h = []
+
+    # ob=bpy.data.objects[o.object_name]
+    for ob in s.objects:
+        h.append(ob.hide_render)
+        ob.hide_render = True
+    for ob in o.objects:
+        ob.hide_render = False
+
+    bpy.ops.render.render()
+
+    # if not o.render_all:
+    for id, obs in enumerate(s.objects):
+        obs.hide_render = h[id]
+
+    imgs = bpy.data.images
+    for isearch in imgs:
+        if len(isearch.name) >= 13:
+            if isearch.name[:13] == 'Render Result':
+                i = isearch
+
+                # progress(iname)
+                i.save_render(iname)
+
+    r.image_settings.file_format = ff
+    r.image_settings.color_mode = cm
+
+    i = bpy.data.images.load(iname)
+    bpy.context.scene.render.engine = 'BLENDERCAM_RENDER'
+    return i
+
+
+def useTiledImages(o):
+    """tiled, memory mapped images are used only for the image method with object sources"""
+    return o.use_tiled_images and not o.use_exact and (o.geometry_source == 'OBJECT' or
+                                                       o.geometry_source == 'COLLECTION')
+
+
+def getImageTiles(resx, resy, tilesize):
+    """splits image of resx * resy into tiles, returns list of (startx, endx, starty, endy)"""
+    tiles = []
+    for x0 in range(0, resx, tilesize):
+        for y0 in range(0, resy, tilesize):
+            tiles.append((x0, min(resx, x0 + tilesize), y0, min(resy, y0 + tilesize)))
+    return tiles
+
+
+def loadImageArray(fname, shape):
+    """opens memory mapped image array from the cache, returns None if it doesn't exist or doesn't fit"""
+    try:
+        a = numpy.load(fname, mmap_mode='r')
+    except (IOError, ValueError):
+        return None
+    if a.shape != shape:
+        return None
+    os.utime(fname)  # most recently used, for the cache eviction
+    return a
+
+
+def renderSampleImageTiled(o, resx, resy):
+    """renders the zbuffer tile by tile into a memory mapped array in the cache directory,
+    so the resolution isn't limited by available memory"""
+    fname = image_cache.getCacheFile(image_cache.getZbufferKey(o), '_z.npy')
+    a = loadImageArray(fname, (resx, resy))
+    if a is not None:
+        o.zbuffer_image = a
+        o.update_zbufferimage_tag = False
+        return a
+    if not os.path.exists(os.path.dirname(fname)):
+        os.makedirs(os.path.dirname(fname))
+
+    a = numpy.lib.format.open_memmap(fname, mode='w+', dtype=numpy.float32, shape=(resx, resy))
+    cx = o.min.x + (o.max.x - o.min.x) / 2
+    cy = o.min.y + (o.max.y - o.min.y) / 2
+    if o.zbuffer_method == 'RASTER':
+        zbuffer.rasterizeTriangles(zbuffer.getObjectsTriangles(o.objects), a, cx - resx / 2 * o.pixsize,
+                                   cy - resy / 2 * o.pixsize, o.pixsize, o.image_tile_size)
+    else:
+        iname = getCachePath(o) + '_ztile.exr'
+        tiles = getImageTiles(resx, resy, o.image_tile_size)
+        for ti, (x0, x1, y0, y1) in enumerate(tiles):
+            simple.progress('zbuffer tile ', int(ti * 100 / len(tiles)))
+            # camera in the center of the tile, pixels stay aligned with the whole image.
+            tcx = cx + ((x0 + x1) / 2 - resx / 2) * o.pixsize
+            tcy = cy + ((y0 + y1) / 2 - resy / 2) * o.pixsize
+            i = renderZbuffer(o, x1 - x0, y1 - y0, tcx, tcy, iname)
+            a[x0:x1, y0:y1] = 1.0 - imagetonumpy(i)
+            bpy.data.images.remove(i)
+    a.flush()
+    del a
+    image_cache.evict()
+
+    o.zbuffer_image = numpy.load(fname, mmap_mode='r')
+    o.update_zbufferimage_tag = False
+    return o.zbuffer_image
+
+
+@profiling.timed('offset')
+def offsetAreaTiled(o, samples):
+    """offsets the zbuffer tile by tile into a memory mapped array in the cache directory.
+    every tile reads the source with a halo of the cutter size."""
+    width = samples.shape[0]
+    height = samples.shape[1]
+    fname = image_cache.getCacheFile(image_cache.getOffsetKey(o, image_cache.getZbufferKey(o)), '_off.npy')
+    a = loadImageArray(fname, (width, height))
+    if a is not None:
+        o.offset_image = a
+        o.update_offsetimage_tag = False
+        return a
+
+    t = time.time()
+    cutterArray = simulation.getCutterArray(o, o.pixsize)
+    cwidth = len(cutterArray)
+    m = int(cwidth / 2.0)
+
+    a = numpy.lib.format.open_memmap(fname, mode='w+', dtype=numpy.float32, shape=(width, height))
+    for x0, x1, y0, y1 in getImageTiles(width, height, o.image_tile_size):
+        a[x0:x1, y0:y1] = -10
+
+    tiles = getImageTiles(width - cwidth, height - cwidth, o.image_tile_size)
+    for ti, (x0, x1, y0, y1) in enumerate(tiles):
+        simple.progress('offset tile ', int(ti * 100 / len(tiles)))
+        sourceArray = numpy.array(samples[x0: x1 + cwidth - 1, y0: y1 + cwidth - 1], dtype=float)
+        if o.inverse:
+            sourceArray = numpy.maximum(sourceArray, o.min.z - 0.00001)
+            sourceArray = -sourceArray + o.min.z
+        comparearea = numpy.full((x1 - x0, y1 - y0), -10.0)
+        dilateArea(sourceArray, cutterArray, comparearea)
+        a[m + x0: m + x1, m + y0: m + y1] = comparearea
+    a.flush()
+    del a
+    image_cache.evict()
+    simple.progress('\ntime ' + str(time.time() - t))
+
+    o.offset_image = numpy.load(fname, mmap_mode='r')
+    o.update_offsetimage_tag = False
+    return o.offset_image
+
+
 # this basically renders blender zbuffer and makes it accessible by saving & loading it again.
 # that's because blender doesn't allow accessing pixels in render :(
 
 
+@profiling.timed('zbuffer')
 def renderSampleImage(o):
     t = time.time()
     simple.progress('getting zbuffer')
@@ -1055,93 +1295,26 @@ def renderSampleImage(o):
             # if we call this accidentally in more functions, which currently happens...
             # print('has zbuffer')
             return o.zbuffer_image
-        # ###setup image name
-        iname = getCachePath(o) + '_z.exr'
-        if not o.update_zbufferimage_tag:
-            try:
-                i = bpy.data.images.load(iname)
-            except:
-                o.update_zbufferimage_tag = True
-        if o.update_zbufferimage_tag:
-            s = bpy.context.scene
-
-            # prepare nodes first
-            s.use_nodes = True
-            n = s.node_tree
-
-            n.links.clear()
-            n.nodes.clear()
-            n1 = n.nodes.new('CompositorNodeRLayers')
-            n2 = n.nodes.new('CompositorNodeViewer')
-            n3 = n.nodes.new('CompositorNodeComposite')
-            n.links.new(n1.outputs['Depth'], n2.inputs['Image'])
-            n.links.new(n1.outputs['Depth'], n3.inputs['Image'])
-            n.nodes.active = n2
-            ###################
-
-            r = s.render
-            r.resolution_x = resx
-            r.resolution_y = resy
-
-            # resize operation image
-            o.offset_image.resize((resx, resy))
-            o.offset_image.fill(-10)
-
-            # various settings for  faster render
-            r.resolution_percentage = 100
-
-            r.engine = 'BLENDER_EEVEE'
-            ff = r.image_settings.file_format
-            cm = r.image_settings.color_mode
-            r.image_settings.file_format = 'OPEN_EXR'
-            r.image_settings.color_mode = 'BW'
-            r.image_settings.color_depth = '32'
-
-            # camera settings
-            camera = s.camera
-            if camera is None:
-                bpy.ops.object.camera_add(align='WORLD', enter_editmode=False, location=(0, 0, 0),
-                                          rotation=(0, 0, 0))
-                camera = bpy.context.active_object
-                bpy.context.scene.camera = camera
-
-            camera.data.type = 'ORTHO'
-            camera.data.ortho_scale = max(resx * o.pixsize, resy * o.pixsize)
-            camera.location = (o.min.x + sx / 2, o.min.y + sy / 2, 1)
-            camera.rotation_euler = (0, 0, 0)
-            # if not o.render_all:#removed in 0.3
-
-            h = []
-
-            # ob=bpy.data.objects[o.object_name]
-            for ob in s.objects:
-                h.append(ob.hide_render)
-                ob.hide_render = True
-            for ob in o.objects:
-                ob.hide_render = False
-
-            bpy.ops.render.render()
-
-            # if not o.render_all:
-            for id, obs in enumerate(s.objects):
-                obs.hide_render = h[id]
-
-            imgs = bpy.data.images
-            for isearch in imgs:
-                if len(isearch.name) >= 13:
-                    if isearch.name[:13] == 'Render Result':
-                        i = isearch
-
-                        # progress(iname)
-                        i.save_render(iname)
-
-            r.image_settings.file_format = ff
-            r.image_settings.color_mode = cm
-
-            i = bpy.data.images.load(iname)
-            bpy.context.scene.render.engine = 'BLENDERCAM_RENDER'
-        a = imagetonumpy(i)
-        a = 1.0 - a
+        if useTiledImages(o):
+            return renderSampleImageTiled(o, resx, resy)
+        if isinstance(o.offset_image, numpy.memmap):  # left from tiled mode, can't be resized
+            o.offset_image = numpy.array([], dtype=float)
+            o.zbuffer_image = numpy.array([], dtype=float)
+        # images are cached by content, so unchanged setups don't need to render again.
+        key = image_cache.getZbufferKey(o)
+        a = image_cache.loadImage(key)
+        if a is None or a.shape != (resx, resy):
+            if o.zbuffer_method == 'RASTER':
+                a = numpy.empty((resx, resy))
+                zbuffer.rasterizeTriangles(zbuffer.getObjectsTriangles(o.objects), a,
+                                           o.min.x + sx / 2 - resx / 2 * pixsize, o.min.y + sy / 2 - resy / 2 * pixsize,
+                                           pixsize, o.image_tile_size)
+            else:
+                iname = getCachePath(o) + '_z.exr'
+                i = renderZbuffer(o, resx, resy, o.min.x + sx / 2, o.min.y + sy / 2, iname)
+                a = imagetonumpy(i)
+                a = 1.0 - a
+            image_cache.saveImage(key, a)
         o.zbuffer_image = a
         o.update_zbufferimage_tag = False
 
@@ -1158,6 +1331,8 @@ def renderSampleImage(o):
             sy = 0
             ey = i.size[1]
 
+        if isinstance(o.offset_image, numpy.memmap):
+            o.offset_image = numpy.array([], dtype=float)
         o.offset_image.resize(ex - sx + 2 * o.borderwidth, ey - sy + 2 * o.borderwidth)
 
         o.pixsize = o.source_image_size_x / i.size[0]
@@ -1211,19 +1386,27 @@ def prepareArea(o):
     # if not o.use_exact:
     renderSampleImage(o)
     samples = o.zbuffer_image
+    if useTiledImages(o):
+        # offset image is read from the memory mapped file, pages of it are cached by the system.
+        offsetAreaTiled(o, samples)
+        return
 
-    iname = simple.getCachePath(o) + '_off.exr'
-
-    if not o.update_offsetimage_tag:
-        progress('loading offset image')
-        try:
-            o.offset_image = imagetonumpy(bpy.data.images.load(iname))
-
-        except:
-            o.update_offsetimage_tag = True
+    if o.geometry_source == 'IMAGE':
+        zbufferkey = image_cache.getArrayHash(samples)
+    else:
+        zbufferkey = image_cache.getZbufferKey(o)
+    key = image_cache.getOffsetKey(o, zbufferkey)
+    progress('loading offset image')
+    a = image_cache.loadImage(key)
 
-    if o.update_offsetimage_tag:
+    if a is not None and a.shape == samples.shape:
+        o.offset_image = a
+        o.update_offsetimage_tag = False
+    else:
+        o.update_offsetimage_tag = True
         if o.inverse:
             samples = numpy.maximum(samples, o.min.z - 0.00001)
+        # the z-buffer can come from the cache while the offset image is empty or of an older size
+        o.offset_image = numpy.full(samples.shape, -10.0)
         offsetArea(o, samples)
-        numpysave(o.offset_image, iname)
+        image_cache.saveImage(key, o.offset_image)
@@ -7,9 +7,14 @@
 
 from . import nc
 import math
+import numpy
 from .format import Format
 from .format import *
 
+# methods which moves() does in bulk, post processors which change them use the normal output
+MOVES_METHODS = ('feedrate', 'rapid', 'feed', 'same_xyz', 'on_move', 'write', 'writem', 'write_preps',
+		'write_feedrate', 'write_spindle', 'write_misc', 'SPACE')
+
 ################################################################################
 class Creator(nc.Creator):
 
@@ -357,6 +362,7 @@ class Creator(nc.Creator):
 		if name == None:
 			name = self.program_name + ' subroutine ' + str(id)
 
+		self.write_buffer()
 		self.save_file = self.file
 		if self.subroutines_in_own_files:
 			new_name = self.make_subroutine_name(id)
@@ -384,6 +390,7 @@ class Creator(nc.Creator):
 	def sub_end(self):
 		self.write(self.SPACE() + self.SUBPROG_END() + '\n')
 
+		self.write_buffer()
 		self.file.close()
 		self.file = self.save_file
 
@@ -674,6 +681,115 @@ class Creator(nc.Creator):
 		self.write_misc()
 		self.write('\n')
 
+	def moves_formatted(self, values):
+		# every distinct number is formatted only once, paths repeat coordinates a lot
+		unique, inverse = numpy.unique(values, return_inverse=True)
+		strings = [self.fmt.string(v) for v in unique.tolist()]
+		return [strings[i] for i in inverse.ravel().tolist()]
+
+	def moves_fast(self):
+		# the bulk output below does the same as feedrate(), rapid() and feed(), so it can be used
+		# only if these are not changed by the post processor and nothing else is waiting for output.
+		for name in MOVES_METHODS:
+			if getattr(type(self), name) is not getattr(Creator, name):
+				return False
+		if type(self.f) is not Address or self.fhv or not self.absolute_flag or self.output_fixtures:
+			return False
+		if self.output_disabled or self.shift_x != 0 or self.shift_y != 0 or self.shift_z != 0:
+			return False
+		return True
+
+	def moves_clean(self):
+		return self.start_of_line and self.x != None and self.y != None and self.z != None and \
+			self.g_plane.str == None and len(self.g_list) == 0 and len(self.m) == 0 and self.s.str == None
+
+	def moves(self, rapid, coords, given, f):
+		if not self.moves_fast():
+			nc.Creator.moves(self, rapid, coords, given, f)
+			return
+		# moves are output the normal way until the state allows bulk output, usually only the first one
+		i = 0
+		n = len(rapid)
+		while i < n and not self.moves_clean():
+			nc.Creator.moves(self, rapid[i:i + 1], coords[i:i + 1], given[i:i + 1], f[i:i + 1])
+			i += 1
+		if i == n:
+			return
+		rapid = rapid[i:].tolist()
+		xs = self.moves_formatted(coords[i:, 0] + self.shift_x)
+		ys = self.moves_formatted(coords[i:, 1] + self.shift_y)
+		zs = self.moves_formatted(coords[i:, 2] + self.shift_z)
+		gx, gy, gz = (given[i:, 0].tolist(), given[i:, 1].tolist(), given[i:, 2].tolist())
+		fset = ~numpy.isnan(f[i:])
+		fstrs = [None] * (n - i)
+		if fset.any():
+			unique, inverse = numpy.unique(f[i:][fset], return_inverse=True)
+			strings = [self.f.text + self.f.fmt.string(v) for v in unique.tolist()]
+			for k, si in zip(numpy.nonzero(fset)[0].tolist(), inverse.ravel().tolist()):
+				fstrs[k] = strings[si]
+
+		space = self.SPACE_STR()
+		g_rapid = self.RAPID()
+		g_feed = self.FEED()
+		ax, ay, az = self.X(), self.Y(), self.Z()
+		modal = self.g0123_modal
+		prev_g0123 = self.prev_g0123
+		fstr = self.f.str
+		fprev = self.f.previous
+		fmodal = self.f.modal
+		cx, cy, cz = self.fmt.string(self.x), self.fmt.string(self.y), self.fmt.string(self.z)
+		lastx = lasty = lastz = None
+		moved = False
+		lines = []
+		for k in range(n - i):
+			if fstrs[k] != None:
+				fstr = fstrs[k]
+			# same as same_xyz()
+			if (not gx[k] or xs[k] == cx) and (not gy[k] or ys[k] == cy) and (not gz[k] or zs[k] == cz):
+				continue
+			moved = True
+			g = g_rapid if rapid[k] else g_feed
+			if modal and prev_g0123 == g:
+				words = []
+			else:
+				words = [g]
+				prev_g0123 = g
+			if gx[k]:
+				words.append(ax + xs[k])
+				cx = xs[k]
+				lastx = k
+			if gy[k]:
+				words.append(ay + ys[k])
+				cy = ys[k]
+				lasty = k
+			if gz[k]:
+				words.append(az + zs[k])
+				cz = zs[k]
+				lastz = k
+			if not rapid[k] and fstr != None:
+				if not fmodal or fstr != fprev:
+					words.append(fstr)
+					fprev = fstr
+				fstr = None
+			lines.append(space.join(words) + '\n')
+			if len(lines) >= 10000:
+				self.write(''.join(lines))
+				lines = []
+		if len(lines):
+			self.write(''.join(lines))
+
+		if lastx != None:
+			self.x = coords[i + lastx, 0]
+		if lasty != None:
+			self.y = coords[i + lasty, 1]
+		if lastz != None:
+			self.z = coords[i + lastz, 2]
+		if moved:
+			self.move_done_since_tool_change = True
+		self.prev_g0123 = prev_g0123
+		self.f.str = fstr
+		self.f.previous = fprev
+
 	def same_xyz(self, x=None, y=None, z=None, a=None, b=None, c=None):
 		if (x != None):
 			if (self.fmt.string(x + self.shift_x)) != (self.fmt.string(self.x)):
@@ -20,6 +20,8 @@ ncCCW = +1
 ncMIST = 1
 ncFLOOD = 2
 
+BUFFER_SIZE = 1 << 20 # characters of output collected before writing to the file
+
 ################################################################################
 class Creator:
 
@@ -30,25 +32,30 @@ class Creator:
 	##	Internals
 
 	def file_open(self, name):
-		#self.buffer=[]
+		self.buffer = []
+		self.buffer_size = 0
 		self.file = open(name, 'w')
 		self.filename = name
 
 	def file_close(self):
-		#self.file.write(''.join(self.buffer))
-		#self.buffer=[]
+		self.write_buffer()
 		self.file.close()
 
+	def write_buffer(self):
+		"""Write buffered output to the file"""
+		if len(self.buffer):
+			self.file.write(''.join(self.buffer))
+		self.buffer = []
+		self.buffer_size = 0
+
 	def write(self, s):
-		self.file.write(s)
-		#self.buffer.append(s)
-		#if len(self.buffer)>100000:
-		#	self.file.write(''.join(self.buffer))
-		#	self.buffer=[]
+		self.buffer.append(s)
+		self.buffer_size += len(s)
+		if self.buffer_size > BUFFER_SIZE:
+			self.write_buffer()
 
 	def writem(self, a):
-		self.file.write(''.join(a))
-		#self.buffer.extend(a)
+		Creator.write(self, ''.join(a))
 	############################################################################
 	##	Programs
 
@@ -224,6 +231,23 @@ class Creator:
 		"""Feed move"""
 		pass
 
+	def moves(self, rapid, coords, given, f):
+		"""Sequence of linear moves, from numpy arrays.
+		rapid - True for rapid moves, coords - Nx3 xyz, given - Nx3 True for coordinates which are output,
+		f - feedrate set before the move, nan where it doesn't change"""
+		coords = coords.tolist()
+		given = given.tolist()
+		f = f.tolist()
+		for i, r in enumerate(rapid.tolist()):
+			if f[i] == f[i]:
+				self.feedrate(f[i])
+			x, y, z = coords[i]
+			gx, gy, gz = given[i]
+			if r:
+				self.rapid(x=x if gx else None, y=y if gy else None, z=z if gz else None)
+			else:
+				self.feed(x=x if gx else None, y=y if gy else None, z=z if gz else None)
+
 	def arc_cw(self, x=None, y=None, z=None, i=None, j=None, k=None, r=None):
 		"""Clockwise arc move"""
 		pass
@@ -4,71 +4,127 @@ try:
 except ImportError:
     pass
 import tempfile
+import numpy
 
-from io_mesh_stl import blender_utils
-import mathutils
 import math
 from cam.simple import activate
+from cam import sample_worker
+from cam import image_cache
+from cam.zbuffer import getObjectTriangles
 
 OCL_SCALE = 1000.0
+OCL_CACHE_SIZE = 2  # surfaces of big models take a lot of memory
+
+# surfaces and cutters are kept between calls, sampling, resampling of connections and waterline of one
+# operation use the same ones. Surfaces are found by hash of the evaluated geometry, so they are rebuilt
+# after the objects change.
+oclSurfaces = {}
+oclCutters = {}
+
+
+def getSurfaceKey(operation):
+    """key of the opencamlib surface - objects with their geometry, modifier setting and skin"""
+    return (image_cache.getOperationObjectsHash(operation), operation.use_modifiers, operation.skin)
+
+
+def getSurface(operation):
+    """cache entry of operation objects, triangles are built on first use, surface when it's needed"""
+    key = getSurfaceKey(operation)
+    surface = oclSurfaces.pop(key, None)
+    if surface is None:
+        surface = {'triangles': None, 'stl': None}
+    oclSurfaces[key] = surface  # most recently used last
+    while len(oclSurfaces) > OCL_CACHE_SIZE:
+        oclSurfaces.pop(next(iter(oclSurfaces)))
+    return surface
+
+
+def clearCache():
+    oclSurfaces.clear()
+    oclCutters.clear()
+
+
+def get_oclTriangles(operation, surface=None):
+    """triangles of operation objects in opencamlib units, as Nx9 array"""
+    if surface is None:
+        surface = getSurface(operation)
+    if surface['triangles'] is None:
+        triangles = []
+        for collision_object in operation.objects:
+            activate(collision_object)
+            if collision_object.type == "MESH":
+                faces = getObjectTriangles(collision_object, operation.use_modifiers)
+                if faces is not None:
+                    triangles.append(faces)
+
+            # FIXME needs to work with collections
+        if len(triangles) > 0:
+            triangles = numpy.concatenate(triangles)
+        else:
+            triangles = numpy.zeros((0, 9))
+        triangles[:, 2::3] += operation.skin
+        triangles *= OCL_SCALE
+        surface['triangles'] = triangles
+    return surface['triangles']
 
-def get_oclSTL(operation):
-    me = None
-    oclSTL = ocl.STLSurf()
 
-    for collision_object in operation.objects:
-        activate(collision_object)
-        if collision_object.type == "MESH":
-            global_matrix = mathutils.Matrix.Identity(4)
-            faces = blender_utils.faces_from_mesh(collision_object, global_matrix, operation.use_modifiers)
-            for face in faces:
-                t = ocl.Triangle(ocl.Point(face[0][0]*OCL_SCALE, face[0][1]*OCL_SCALE, (face[0][2]+operation.skin)*OCL_SCALE),
-                        ocl.Point(face[1][0]*OCL_SCALE, face[1][1]*OCL_SCALE, (face[1][2]+operation.skin)*OCL_SCALE),
-                        ocl.Point(face[2][0]*OCL_SCALE, face[2][1]*OCL_SCALE, (face[2][2]+operation.skin)*OCL_SCALE))
-                oclSTL.addTriangle(t)
+def get_oclSTL(operation):
+    surface = getSurface(operation)
+    if surface['stl'] is None:
+        surface['stl'] = sample_worker.oclSTL(get_oclTriangles(operation, surface))
+    return surface['stl']
 
-        # FIXME needs to work with collections
-    return oclSTL
 
+def getCutter(operation, cutter_length=10):
+    """opencamlib cutter of the operation, one cutter is shared by all calls with the same settings"""
+    spec = getCutterSpec(operation, cutter_length)
+    cutter = oclCutters.get(spec)
+    if cutter is None:
+        cutter = sample_worker.oclCutter(spec)
+        oclCutters[spec] = cutter
+    return cutter
 
-def ocl_sample(operation, chunks):
-
-    oclSTL = get_oclSTL(operation)
 
+def getCutterSpec(operation, cutter_length=10):
+    """cutter type and arguments of the opencamlib cutter, which can be passed to worker processes"""
     op_cutter_type = operation.cutter_type
     op_cutter_diameter = operation.cutter_diameter
-    op_minz = operation.minz
     op_cutter_tip_angle = math.radians(operation.cutter_tip_angle)/2
-    if op_cutter_type == "VCARVE": 
+    if op_cutter_type == "VCARVE":
         cutter_length = (op_cutter_diameter/math.tan(op_cutter_tip_angle))/2
-    else:
-     cutter_length = 10
-
-    cutter = None
 
     if op_cutter_type == 'END':
-        cutter = ocl.CylCutter((op_cutter_diameter + operation.skin * 2) * 1000, cutter_length)
+        args = ((op_cutter_diameter + operation.skin * 2) * 1000, cutter_length)
     elif op_cutter_type == 'BALLNOSE':
-        cutter = ocl.BallCutter((op_cutter_diameter + operation.skin * 2) * 1000, cutter_length)
+        args = ((op_cutter_diameter + operation.skin * 2) * 1000, cutter_length)
     elif op_cutter_type == 'VCARVE':
-        cutter = ocl.ConeCutter((op_cutter_diameter + operation.skin * 2) * 1000, op_cutter_tip_angle, cutter_length)
+        args = ((op_cutter_diameter + operation.skin * 2) * 1000, op_cutter_tip_angle, cutter_length)
     elif op_cutter_type =='CYLCONE':
-        cutter = ocl.CylConeCutter((operation.cylcone_diameter/2+operation.skin)*2000,(op_cutter_diameter + operation.skin * 2) * 1000, op_cutter_tip_angle)
+        args = ((operation.cylcone_diameter/2+operation.skin)*2000,(op_cutter_diameter + operation.skin * 2) * 1000, op_cutter_tip_angle)
     elif op_cutter_type == 'BALLCONE':
-        cutter = ocl.BallConeCutter((operation.ball_radius + operation.skin) * 2000,
-                                    (op_cutter_diameter + operation.skin * 2) * 1000, op_cutter_tip_angle)
+        args = ((operation.ball_radius + operation.skin) * 2000,
+                (op_cutter_diameter + operation.skin * 2) * 1000, op_cutter_tip_angle)
     elif op_cutter_type =='BULLNOSE':
-        cutter = ocl.BullCutter((op_cutter_diameter + operation.skin * 2) * 1000,operation.bull_corner_radius*1000, cutter_length)
+        args = ((op_cutter_diameter + operation.skin * 2) * 1000,operation.bull_corner_radius*1000, cutter_length)
     else:
         print("Cutter unsupported: {0}\n".format(op_cutter_type))
         quit()
+    return op_cutter_type, args
+
+
+def ocl_sample(operation, chunks):
+
+    oclSTL = get_oclSTL(operation)
+
+    op_minz = operation.minz
+    cutter = getCutter(operation)
 
     bdc = ocl.BatchDropCutter()
     bdc.setSTL(oclSTL)
     bdc.setCutter(cutter)
 
     for chunk in chunks:
-        for coord in chunk.points:
+        for coord in chunk.getPointsArray().tolist():
             bdc.appendPoint(ocl.CLPoint(coord[0] * 1000, coord[1] * 1000, op_minz * 1000))
 
     bdc.run()
@@ -76,3 +132,10 @@ def ocl_sample(operation, chunks):
     cl_points = bdc.getCLPoints()
 
     return cl_points
+
+
+def ocl_sample_parallel(operation, chunks, processes):
+    """heights of ocl_sample computed by worker processes, None if that fails"""
+    pts = numpy.concatenate([chunk.getPointsArray()[:, :2] for chunk in chunks])
+    return sample_worker.sampleOclParallel(pts[:, 0] * 1000, pts[:, 1] * 1000, operation.minz * 1000,
+                                           get_oclTriangles(operation), getCutterSpec(operation), processes)
@@ -7,15 +7,17 @@ except ImportError:
     pass
 import os
 import tempfile
+import numpy
 from subprocess import call
 from cam.collision import BULLET_SCALE
 from cam import simple
 from cam.chunk import camPathChunk
 from cam.simple import *
 from shapely import geometry as sgeometry
-from .oclSample import get_oclSTL
+from .oclSample import get_oclSTL, getCutter
 
-from cam.opencamlib.oclSample import ocl_sample
+from cam.opencamlib.oclSample import ocl_sample, ocl_sample_parallel
+from cam import sample_worker
 
 OCL_SCALE = 1000.0
 
@@ -31,7 +33,7 @@ def chunkPointSamplesFromOCL(chunks, samples):
         p_index = 0
         for point in ch.points:
             if len(point) == 2 or point[2] != 2:
-                z_sample = samples[s_index].z / OCL_SCALE
+                z_sample = samples[s_index] / OCL_SCALE
                 ch.points[p_index] = (point[0], point[1], z_sample)
             # print(str(point[2]))
             else:
@@ -81,27 +83,37 @@ def oclSamplePoints(operation, points):
 
 
 def oclSample(operation, chunks):
-    samples = ocl_sample(operation, chunks)
+    samples = None
+    processes = simple.getSamplingProcesses()
+    if sample_worker.useParallel(processes, sum(chunk.count() for chunk in chunks)):
+        samples = ocl_sample_parallel(operation, chunks, processes)
+        if samples is None:
+            operation.warnings += sample_worker.error + '\n'
+    if samples is not None:
+        samples = samples.tolist()
+    else:
+        samples = [p.z for p in ocl_sample(operation, chunks)]
     chunkPointSamplesFromOCL(chunks, samples)
 
 
 def oclResampleChunks(operation, chunks_to_resample):
+    # connections are sampled together, their points are taken from the chunk arrays and written back to them
+    if len(chunks_to_resample) == 0:
+        return
     tmp_chunks = list()
     tmp_chunks.append(camPathChunk(inpoints=[]))
-    for chunk, i_start, i_length in chunks_to_resample:
-        for p_index in range(i_start, i_start + i_length):
-            tmp_chunks[0].append(chunk.points[p_index])
- 
+    tmp_chunks[0].points = numpy.concatenate([chunk.getPointsArray()[i_start:i_start + i_length]
+                                              for chunk, i_start, i_length in chunks_to_resample])
 
     samples = ocl_sample(operation, tmp_chunks)
 
     sample_index = 0
     for chunk, i_start, i_length in chunks_to_resample:
-        for p_index in range(i_start, i_start + i_length):
-            z = samples[sample_index].z / OCL_SCALE
-            sample_index += 1
-            if z > chunk.points[p_index][2]:
-                chunk.points[p_index][2] = z
+        zs = numpy.array([s.z for s in samples[sample_index:sample_index + i_length]]) / OCL_SCALE
+        sample_index += i_length
+        a = chunk.getPointsArray().copy()
+        a[i_start:i_start + i_length, 2] = numpy.maximum(a[i_start:i_start + i_length, 2], zs)
+        chunk.setPointsArray(a)
 
 
 def oclWaterlineLayerHeights(operation):
@@ -128,25 +140,7 @@ def oclGetWaterline(operation, chunks):
     layers = oclWaterlineLayerHeights(operation)
     oclSTL = get_oclSTL(operation)
 
-    op_cutter_type = operation.cutter_type
-    op_cutter_diameter = operation.cutter_diameter
-    op_minz = operation.minz
-    if op_cutter_type == "VCARVE":
-        op_cutter_tip_angle = operation['cutter_tip_angle']
-
-    cutter = None
-    cutter_length = 150 #TODO: automatically determine necessary cutter length depending on object size
-
-    if op_cutter_type == 'END':
-        cutter = ocl.CylCutter((op_cutter_diameter + operation.skin * 2) * 1000, cutter_length)
-    elif op_cutter_type == 'BALLNOSE':
-        cutter = ocl.BallCutter((op_cutter_diameter + operation.skin * 2) * 1000, cutter_length)
-    elif op_cutter_type == 'VCARVE':
-        cutter = ocl.ConeCutter((op_cutter_diameter + operation.skin * 2) * 1000, op_cutter_tip_angle, cutter_length)
-    else:
-        print("Cutter unsupported: {0}\n".format(op_cutter_type))
-        quit()
-
+    cutter = getCutter(operation, 150)  # TODO: automatically determine necessary cutter length depending on object size
 
     waterline = ocl.Waterline()
     waterline.setSTL(oclSTL)
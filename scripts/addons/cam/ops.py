@@ -24,34 +24,16 @@
 
 import bpy
 from bpy.props import *
-from bpy_extras.io_utils import ImportHelper
+from bpy_extras.io_utils import ImportHelper, ExportHelper
 
-import subprocess, os, threading
-from cam import utils, pack, polygon_utils_cam, simple, gcodepath, bridges, simulation
+import json
+from cam import utils, pack, polygon_utils_cam, simple, gcodepath, bridges, simulation, profiling, batch
 import shapely
 import mathutils
 import math
 import cam
 
 
-class threadCom:  # object passed to threads to read background process stdout info
-    def __init__(self, o, proc):
-        self.opname = o.name
-        self.outtext = ''
-        self.proc = proc
-        self.lasttext = ''
-
-
-def threadread(tcom):
-    """reads stdout of background process, done this way to have it non-blocking"""
-    inline = tcom.proc.stdout.readline()
-    inline = str(inline)
-    s = inline.find('progress{')
-    if s > -1:
-        e = inline.find('}')
-        tcom.outtext = inline[s + 9:e]
-
-
 class CAMPositionObject(bpy.types.Operator):
     """position object for CAM operation. Tests object bounds and places them so the object
     is aligned to be positive from x and y and negative from z."""
@@ -74,41 +56,6 @@ class CAMPositionObject(bpy.types.Operator):
         layout.prop_search(self, "operation", bpy.context.scene, "cam_operations")
 
 
-@bpy.app.handlers.persistent
-def timer_update(context):
-    """monitoring of background processes"""
-    text = ''
-    s = bpy.context.scene
-    if hasattr(bpy.ops.object.calculate_cam_paths_background.__class__, 'cam_processes'):
-        processes = bpy.ops.object.calculate_cam_paths_background.__class__.cam_processes
-        for p in processes:
-            # proc=p[1].proc
-            readthread = p[0]
-            tcom = p[1]
-            if not readthread.is_alive():
-                readthread.join()
-                # readthread.
-                tcom.lasttext = tcom.outtext
-                if tcom.outtext != '':
-                    print(tcom.opname, tcom.outtext)
-                    tcom.outtext = ''
-
-                if 'finished' in tcom.lasttext:
-                    processes.remove(p)
-
-                    o = s.cam_operations[tcom.opname]
-                    o.computing = False
-                    utils.reload_paths(o)
-                    update_zbufferimage_tag = False
-                    update_offsetimage_tag = False
-                else:
-                    readthread = threading.Thread(target=threadread, args=([tcom]), daemon=True)
-                    readthread.start()
-                    p[0] = readthread
-            o = s.cam_operations[tcom.opname]  # changes
-            o.outtext = tcom.lasttext  # changes
-
-
 class PathsBackground(bpy.types.Operator):
     """calculate CAM paths in background. File has to be saved before."""
     bl_idname = "object.calculate_cam_paths_background"
@@ -118,27 +65,10 @@ class PathsBackground(bpy.types.Operator):
     def execute(self, context):
         s = bpy.context.scene
         o = s.cam_operations[s.cam_active_operation]
-        self.operation = o
-        o.computing = True
-
-        bpath = bpy.app.binary_path
-        fpath = bpy.data.filepath
-
-        for p in bpy.utils.script_paths():
-            scriptpath = p + os.sep + 'addons' + os.sep + 'cam' + os.sep + 'backgroundop.py'
-            print(scriptpath)
-            if os.path.isfile(scriptpath):
-                break
-        proc = subprocess.Popen([bpath, '-b', fpath, '-P', scriptpath, '--', '-o=' + str(s.cam_active_operation)],
-                                bufsize=1, stdout=subprocess.PIPE, stdin=subprocess.PIPE)
-
-        tcom = threadCom(o, proc)
-        readthread = threading.Thread(target=threadread, args=([tcom]), daemon=True)
-        readthread.start()
-        # self.__class__.cam_processes=[]
-        if not hasattr(bpy.ops.object.calculate_cam_paths_background.__class__, 'cam_processes'):
-            bpy.ops.object.calculate_cam_paths_background.__class__.cam_processes = []
-        bpy.ops.object.calculate_cam_paths_background.__class__.cam_processes.append([readthread, tcom])
+        if bpy.data.filepath == '':
+            self.report({'ERROR'}, "File has to be saved before background calculation")
+            return {'CANCELLED'}
+        batch.calculate([o.name])
         return {'FINISHED'}
 
 
@@ -148,20 +78,16 @@ class KillPathsBackground(bpy.types.Operator):
     bl_label = "Kill background computation of an operation"
     bl_options = {'REGISTER', 'UNDO'}
 
+    whole_batch: BoolProperty(name="Whole batch", description="Kill computation of all operations in background",
+                              default=False)
+
     def execute(self, context):
         s = bpy.context.scene
         o = s.cam_operations[s.cam_active_operation]
-        self.operation = o
-
-        if hasattr(bpy.ops.object.calculate_cam_paths_background.__class__, 'cam_processes'):
-            processes = bpy.ops.object.calculate_cam_paths_background.__class__.cam_processes
-            for p in processes:
-                tcom = p[1]
-                if tcom.opname == o.name:
-                    processes.remove(p)
-                    tcom.proc.kill()
-                    o.computing = False
-
+        if self.whole_batch:
+            batch.cancel()
+        else:
+            batch.cancel(o.name)
         return {'FINISHED'}
 
 
@@ -220,26 +146,33 @@ class CalculatePath(bpy.types.Operator):
 
 
 class PathsAll(bpy.types.Operator):
-    """calculate all CAM paths"""
+    """calculate all CAM paths in background processes, as many at once as set in preferences.
+    Operations wait for the operations they depend on. File has to be saved before."""
     bl_idname = "object.calculate_cam_paths_all"
     bl_label = "Calculate all CAM paths"
     bl_options = {'REGISTER', 'UNDO'}
 
-    def execute(self, context):
-        i = 0
-        for o in bpy.context.scene.cam_operations:
-            bpy.context.scene.cam_active_operation = i
-            print('\nCalculating path :' + o.name)
-            print('\n')
-            bpy.ops.object.calculate_cam_paths_background()
-            i += 1
+    source: EnumProperty(name='Operations',
+                         items=(('ALL', 'All', 'All operations of the scene'),
+                                ('CHAIN', 'Chain', 'Operations of the active chain')),
+                         default='ALL')
 
+    def execute(self, context):
+        s = bpy.context.scene
+        if bpy.data.filepath == '':
+            self.report({'ERROR'}, "File has to be saved before background calculation")
+            return {'CANCELLED'}
+        if self.source == 'CHAIN':
+            if len(s.cam_chains) == 0:
+                return {'CANCELLED'}
+            operations = getChainOperations(s.cam_chains[s.cam_active_chain])
+        else:
+            operations = s.cam_operations
+        if bpy.data.is_dirty:
+            self.report({'WARNING'}, "Paths are calculated from the last saved version of the file")
+        batch.calculate([o.name for o in operations if o.valid])
         return {'FINISHED'}
 
-    def draw(self, context):
-        layout = self.layout
-        layout.prop_search(self, "operation", bpy.context.scene, "cam_operations")
-
 
 class CamPackObjects(bpy.types.Operator):
     """calculate all CAM paths"""
@@ -350,6 +283,30 @@ class PathExport(bpy.types.Operator):
         return {'FINISHED'}
 
 
+class CamExportProfile(bpy.types.Operator, ExportHelper):
+    """Export times of the stages of the last calculation as chrome trace, which opens in chrome://tracing
+    or ui.perfetto.dev"""
+    bl_idname = "object.cam_export_profile"
+    bl_label = "Export calculation profile"
+
+    filename_ext = '.json'
+    filter_glob: StringProperty(default='*.json', options={'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        s = context.scene
+        if len(s.cam_operations) == 0:
+            return False
+        return s.cam_operations[s.cam_active_operation].profile_data != ''
+
+    def execute(self, context):
+        s = bpy.context.scene
+        operation = s.cam_operations[s.cam_active_operation]
+        profiling.saveChromeTrace(json.loads(operation.profile_data), self.filepath)
+        self.report({'INFO'}, 'profile saved to ' + self.filepath)
+        return {'FINISHED'}
+
+
 class CAMSimulate(bpy.types.Operator):
     """simulate CAM operation
     this is performed by: creating an image, painting Z depth of the brush substractively.
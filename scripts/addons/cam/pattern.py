@@ -27,6 +27,7 @@ from cam import simple, chunk, utils
 from cam.simple import *
 from cam.chunk import *
 from cam import polygon_utils_cam
+from cam import profiling
 from cam.polygon_utils_cam import *
 import shapely
 from shapely import geometry as sgeometry
@@ -132,6 +133,7 @@ def getPathPatternParallel(o, angle):
     return pathchunks
 
 
+@profiling.timed('pattern')
 def getPathPattern(operation):
     o = operation
     t = time.time()
@@ -389,6 +391,7 @@ def getPathPattern(operation):
     return pathchunks
 
 
+@profiling.timed('pattern')
 def getPathPattern4axis(operation):
     o = operation
     t = time.time()
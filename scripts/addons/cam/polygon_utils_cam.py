@@ -22,14 +22,167 @@
 import math
 import mathutils
 import curve_simplify
+import numpy
 
 import shapely
 from shapely.geometry import polygon as spolygon
 from shapely import geometry as sgeometry
+from shapely import prepared as sprepared
+from shapely.strtree import STRtree
+
+try:  # shapely 2.x
+    from shapely import contains_xy
+except ImportError:
+    try:  # shapely 1.x with speedups
+        from shapely.vectorized import contains as contains_xy
+    except ImportError:
+        contains_xy = None
 
 SHAPELY = True
 
 
+def containsPoints(poly, xs, ys):
+    """point in polygon test for whole coordinate arrays, returns boolean array.
+    same result as poly.contains(Point(x,y)) for every point"""
+    xs = numpy.asarray(xs, dtype=numpy.float64)
+    ys = numpy.asarray(ys, dtype=numpy.float64)
+    if len(xs) == 0:
+        return numpy.zeros(0, dtype=bool)
+    if contains_xy is not None:
+        return numpy.asarray(contains_xy(poly, xs, ys), dtype=bool)
+    ppoly = sprepared.prep(poly)
+    return numpy.fromiter((ppoly.contains(sgeometry.Point(x, y)) for x, y in zip(xs, ys)), dtype=bool,
+                          count=len(xs))
+
+
+def getRings(poly):
+    """coordinate arrays of all exterior and interior rings of polygons in poly"""
+    if poly.is_empty:
+        return []
+    if poly.geom_type == 'Polygon':
+        return [numpy.asarray(poly.exterior.coords)] + [numpy.asarray(i.coords) for i in poly.interiors]
+    rings = []
+    if hasattr(poly, 'geoms'):
+        for g in poly.geoms:
+            rings.extend(getRings(g))
+    return rings
+
+
+def getBoundaryDistance(poly, xs, ys):
+    """distances of points xs, ys to the boundary of polygons in poly, as array.
+    Same as poly.boundary.distance(Point(x,y)), with shapely 2 the nearest boundary segment is found in STRtree."""
+    xs = numpy.asarray(xs, dtype=numpy.float64)
+    ys = numpy.asarray(ys, dtype=numpy.float64)
+    rings = getRings(poly)
+    if len(xs) == 0 or len(rings) == 0:
+        return numpy.zeros(len(xs))
+    if hasattr(shapely, 'linestrings') and hasattr(STRtree, 'query_nearest'):
+        segments = numpy.concatenate([numpy.stack((r[:-1, :2], r[1:, :2]), axis=1) for r in rings])
+        tree = STRtree(shapely.linestrings(segments))
+        (pointindex, segmentindex), dist = tree.query_nearest(shapely.points(xs, ys), return_distance=True,
+                                                              all_matches=False)
+        distances = numpy.empty(len(xs))
+        distances[pointindex] = dist
+        return distances
+    boundary = poly.boundary
+    return numpy.array([boundary.distance(sgeometry.Point(x, y)) for x, y in zip(xs, ys)])
+
+
+class polygonMask:
+    """point in polygon test of many points against one polygon, like the operation ambient.
+    With pixsize the polygon is rasterized once into a boolean image and points are looked up in it,
+    which is fast also for polygons with many holes, but can differ from the polygon by a pixel at its border.
+    Without pixsize the test is exact, with the prepared polygon."""
+
+    def __init__(self, poly, pixsize=None):
+        self.poly = poly
+        self.pixsize = pixsize
+        self.image = None
+        if pixsize is not None and not poly.is_empty:
+            self.rasterize()
+        elif hasattr(shapely, 'prepare'):  # shapely 2 prepares geometry in place
+            shapely.prepare(poly)
+
+    def rasterize(self):
+        """even-odd scanline fill of all rings at pixel centers"""
+        pixsize = self.pixsize
+        minx, miny, maxx, maxy = self.poly.bounds
+        self.minx = minx
+        self.miny = miny
+        width = int(math.ceil((maxx - minx) / pixsize)) + 1
+        height = int(math.ceil((maxy - miny) / pixsize)) + 1
+        edges = numpy.concatenate([numpy.hstack((r[:-1, :2], r[1:, :2])) for r in getRings(self.poly)])
+        x0, y0, x1, y1 = edges.T
+        # rows of pixel centers each edge crosses, centers on the lower end count, on the upper don't
+        r0 = numpy.ceil((numpy.minimum(y0, y1) - miny) / pixsize - 0.5).astype(numpy.int64)
+        r1 = numpy.ceil((numpy.maximum(y0, y1) - miny) / pixsize - 0.5).astype(numpy.int64)
+        counts = numpy.maximum(r1 - r0, 0)
+        e = numpy.repeat(numpy.arange(len(edges)), counts)
+        rows = numpy.repeat(r0, counts) + numpy.arange(len(e)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        yc = miny + (rows + 0.5) * pixsize
+        x = x0[e] + (yc - y0[e]) * (x1[e] - x0[e]) / (y1[e] - y0[e])
+        order = numpy.lexsort((x, rows))
+        rows = rows[order]
+        cols = numpy.ceil((x[order] - minx) / pixsize - 0.5).astype(numpy.int64)
+        cols = numpy.clip(cols, 0, width)
+        # crossings of every row come in pairs, pixels between them are inside
+        diff = numpy.zeros((height, width + 1), dtype=numpy.int8)
+        numpy.add.at(diff, (rows[0::2], cols[0::2]), 1)
+        numpy.add.at(diff, (rows[1::2], cols[1::2]), -1)
+        self.image = numpy.cumsum(diff[:, :width], axis=1, dtype=numpy.int8) > 0
+
+    def contains(self, xs, ys):
+        """boolean array, True for points inside the polygon"""
+        if self.image is None:
+            return containsPoints(self.poly, xs, ys)
+        xs = numpy.asarray(xs, dtype=numpy.float64)
+        ys = numpy.asarray(ys, dtype=numpy.float64)
+        xi = numpy.floor((xs - self.minx) / self.pixsize).astype(numpy.int64)
+        yi = numpy.floor((ys - self.miny) / self.pixsize).astype(numpy.int64)
+        inside = (xi >= 0) & (xi < self.image.shape[1]) & (yi >= 0) & (yi < self.image.shape[0])
+        result = numpy.zeros(len(xs), dtype=bool)
+        result[inside] = self.image[yi[inside], xi[inside]]
+        return result
+
+
+def getAmbientMask(o):
+    """mask of the operation ambient, image based operations test points at their sampling resolution.
+    With tiled images the test is exact, a mask image of the whole area would need the memory they save."""
+    if o.ambient_mask is None or o.ambient_mask.poly is not o.ambient:
+        exact = o.use_exact or o.use_tiled_images
+        o.ambient_mask = polygonMask(o.ambient, None if exact else o.pixsize)
+    return o.ambient_mask
+
+
+class geometryIndex:
+    """bounding box index over a list of geometries, query returns sorted indices into that list.
+    works with STRtree of shapely 1.x, which returns geometries, and 2.x, which returns indices."""
+
+    def __init__(self, geoms):
+        self.geoms = [g for g in geoms]
+        self.ids = {}
+        for i, g in enumerate(self.geoms):
+            self.ids[id(g)] = i
+        self.nonempty = [i for i, g in enumerate(self.geoms) if not g.is_empty]
+        if len(self.nonempty) > 0:
+            self.tree = STRtree([self.geoms[i] for i in self.nonempty])
+        else:
+            self.tree = None
+
+    def query(self, geom):
+        if self.tree is None or geom.is_empty:
+            return []
+        result = self.tree.query(geom)
+        if len(result) == 0:
+            return []
+        if isinstance(result[0], (int, numpy.integer)):  # shapely 2 returns indices of the tree geometries
+            return sorted(self.nonempty[int(i)] for i in result)
+        return sorted(self.ids[id(g)] for g in result)
+
+    def queryBox(self, minx, miny, maxx, maxy):
+        return self.query(sgeometry.box(minx, miny, maxx, maxy))
+
+
 def Circle(r, np):
     c = []
     v = mathutils.Vector((r, 0, 0))
@@ -0,0 +1,159 @@
+# blender CAM profiling.py (c) 2012 Vilem Novak
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+
+# timing instrumentation of path calculation. Stages are recorded as named spans, nested in each other,
+# together with counters and peak memory. The profile of the last calculation is stored in the operation
+# as json and can be exported in chrome trace format, which opens in chrome://tracing or ui.perfetto.dev.
+# Without a running profile, spans and counters cost only a function call.
+
+import sys
+import json
+import time
+import functools
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+current = None  # profile of the running calculation
+
+
+class camProfile:
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []  # (name, start, duration, nesting depth from 0, peak memory at the end) in seconds and bytes
+        self.counters = {}
+        self.times = {}  # summed durations of blocks running too often to be spans
+        self.depth = 0
+        self.peak_memory = getPeakMemory()
+
+    def toDict(self):
+        return {'name': self.name, 'spans': self.spans, 'counters': self.counters, 'times': self.times,
+                'peak_memory': self.peak_memory}
+
+
+def getPeakMemory():
+    """peak resident memory of the process in bytes, None when it can't be found"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024  # kilobytes on linux
+
+
+def start(name):
+    """starts profile of a calculation, spans and counters go to it until finish()"""
+    global current
+    current = camProfile(name)
+    return current
+
+
+def finish():
+    """ends the running profile and returns it"""
+    global current
+    profile = current
+    current = None
+    if profile is not None:
+        profile.peak_memory = getPeakMemory()
+    return profile
+
+
+@contextmanager
+def span(name):
+    """times the enclosed block as named span of the running profile"""
+    profile = current
+    if profile is None:
+        yield
+        return
+    t = time.perf_counter()
+    profile.depth += 1
+    try:
+        yield
+    finally:
+        profile.depth -= 1
+        profile.spans.append((name, t - profile.start, time.perf_counter() - t, profile.depth, getPeakMemory()))
+
+
+def timed(name):
+    """decorator recording every call of the function as span"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if current is None:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def accumulate(name):
+    """adds duration of the enclosed block to summed time name of the running profile, for inner loops"""
+    profile = current
+    if profile is None:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.times[name] = profile.times.get(name, 0) + time.perf_counter() - t
+
+
+def count(name, n=1):
+    """adds n to counter of the running profile"""
+    if current is not None:
+        current.counters[name] = current.counters.get(name, 0) + n
+
+
+def getStageTimes(data):
+    """list of (name, depth, total time, calls) of spans summed by name and depth, in order of first start,
+    from profile dict"""
+    stages = {}
+    for name, start, duration, depth, memory in sorted(data['spans'], key=lambda s: s[1]):
+        stage = stages.setdefault((name, depth), [name, depth, 0, 0])
+        stage[2] += duration
+        stage[3] += 1
+    return [tuple(stage) for stage in stages.values()]
+
+
+def toChromeTrace(data):
+    """chrome trace event dict from profile dict, spans are complete events, counters and memory are metadata"""
+    events = []
+    for name, start, duration, depth, memory in data['spans']:
+        event = {'name': name, 'cat': 'cam', 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6, 'pid': 1, 'tid': 1}
+        if memory is not None:
+            event['args'] = {'peak_memory_mb': memory / 1048576}
+        events.append(event)
+    events.append({'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': data['name']}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms',
+            'otherData': {'counters': data['counters'], 'times': data.get('times', {}),
+                          'peak_memory': data['peak_memory']}}
+
+
+def saveChromeTrace(data, filename):
+    with open(filename, 'w') as f:
+        json.dump(toChromeTrace(data), f)
@@ -0,0 +1,345 @@
+# blender CAM sample_worker.py (c) 2012 Vilem Novak
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+
+# parallel sampling of paths and union of silhouettes in worker processes.
+# sampling needs only the offset image or the triangles of the model, not bpy, so workers are plain python
+# processes. This module mustn't import bpy or the cam package, workers import it as a top level module.
+
+import os
+import sys
+import numpy
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python older than 3.8
+    shared_memory = None
+
+try:
+    import shapely
+    from shapely import polygons as shapelyPolygons  # vectorized constructors of shapely 2
+except ImportError:
+    shapelyPolygons = None
+
+PARALLEL_MIN_POINTS = 200000  # below this, starting the processes takes longer than sampling
+PARALLEL_MIN_TRIANGLES = 50000  # union of triangles is much slower than sampling
+SHARDS_PER_PROCESS = 4
+SILHOUETTE_GROW = 0.000001  # triangles are grown by this, so that neighbours join without slivers between them
+
+# state of the worker process
+worker_image = None
+worker_memory = None
+worker_stl = None
+worker_cutter = None
+worker_triangles = None
+
+error = ''  # why the last parallel run failed, callers put it in the warnings of the operation
+
+
+def getSampleImageArray(xs, ys, sarray, minz):
+    """vectorized getSampleImage, samples whole arrays of image coordinates at once, gives same results"""
+    xs = numpy.asarray(xs, dtype=numpy.float64)
+    ys = numpy.asarray(ys, dtype=numpy.float64)
+    z = numpy.full(xs.shape, -10.0)
+    inside = (xs >= 0) & (xs <= len(sarray) - 1) & (ys >= 0) & (ys <= len(sarray[0]) - 1)
+    x = xs[inside]
+    y = ys[inside]
+    minx = numpy.floor(x)
+    maxx = minx + 1
+    miny = numpy.floor(y)
+    maxy = miny + 1
+    # the far index is clamped only for samples lying exactly on the last pixel, where its weight is zero.
+    ix = minx.astype(numpy.intp)
+    iy = miny.astype(numpy.intp)
+    ix1 = numpy.minimum(ix + 1, len(sarray) - 1)
+    iy1 = numpy.minimum(iy + 1, len(sarray[0]) - 1)
+    s1a = sarray[ix, iy]
+    s2a = sarray[ix1, iy]
+    s1b = sarray[ix, iy1]
+    s2b = sarray[ix1, iy1]
+
+    sa = s1a * (maxx - x) + s2a * (x - minx)
+    sb = s1b * (maxx - x) + s2b * (x - minx)
+    z[inside] = sa * (maxy - y) + sb * (y - miny)
+    return z
+
+
+def oclCutter(spec):
+    """opencamlib cutter from (type, arguments), as made by oclSample.getCutterSpec"""
+    import ocl
+    cuttertype, args = spec
+    if cuttertype == 'END':
+        return ocl.CylCutter(*args)
+    elif cuttertype == 'BALLNOSE':
+        return ocl.BallCutter(*args)
+    elif cuttertype == 'VCARVE':
+        return ocl.ConeCutter(*args)
+    elif cuttertype == 'CYLCONE':
+        return ocl.CylConeCutter(*args)
+    elif cuttertype == 'BALLCONE':
+        return ocl.BallConeCutter(*args)
+    elif cuttertype == 'BULLNOSE':
+        return ocl.BullCutter(*args)
+
+
+def oclSTL(triangles):
+    """opencamlib surface from Nx9 array of triangle corners"""
+    import ocl
+    stl = ocl.STLSurf()
+    for t in triangles.tolist():
+        stl.addTriangle(ocl.Triangle(ocl.Point(t[0], t[1], t[2]), ocl.Point(t[3], t[4], t[5]),
+                                     ocl.Point(t[6], t[7], t[8])))
+    return stl
+
+
+def oclDropCutter(stl, cutter, xs, ys, z):
+    """heights of the cutter dropped at points xs, ys from z, in opencamlib units"""
+    import ocl
+    bdc = ocl.BatchDropCutter()
+    bdc.setSTL(stl)
+    bdc.setCutter(cutter)
+    for x, y in zip(xs.tolist(), ys.tolist()):
+        bdc.appendPoint(ocl.CLPoint(x, y, z))
+    bdc.run()
+    return numpy.array([p.z for p in bdc.getCLPoints()], dtype=numpy.float64)
+
+
+def getTopTriangles(triangles):
+    """corners of triangles seen from the top as Nx3x2 array, from Nx9 array of triangles.
+    Vertical and degenerate triangles are dropped. Back facing triangles are dropped too when there are front facing
+    ones, which cover them in closed meshes."""
+    xy = triangles.reshape(-1, 3, 3)[:, :, :2]
+    area = (xy[:, 1, 0] - xy[:, 0, 0]) * (xy[:, 2, 1] - xy[:, 0, 1]) - \
+        (xy[:, 2, 0] - xy[:, 0, 0]) * (xy[:, 1, 1] - xy[:, 0, 1])
+    front = area > 0
+    if front.any():
+        return xy[front]
+    return xy[area < 0]  # only back faces, e.g. flipped normals
+
+
+def unionTriangles(xy, grow=SILHOUETTE_GROW):
+    """union of Nx3x2 triangles, polygons are built and grown at once with shapely 2"""
+    if len(xy) == 0:
+        return shapely.Polygon()
+    polys = shapelyPolygons(numpy.concatenate((xy, xy[:, :1]), axis=1))
+    polys = shapely.buffer(polys, grow, quad_segs=1, join_style='mitre')
+    return shapely.union_all(polys)  # GEOS cascaded union merges neighbours first, in a tree
+
+
+def attachArray(name, shape, dtype):
+    """numpy array in shared memory created by the main process"""
+    global worker_memory
+    # workers share the resource tracker of the main process, which removes the memory after unlink()
+    worker_memory = shared_memory.SharedMemory(name=name)
+    return numpy.ndarray(shape, dtype=dtype, buffer=worker_memory.buf)
+
+
+def initImage(name, shape, dtype, fname):
+    global worker_image
+    if fname is not None:  # tiled images are memory mapped files already
+        worker_image = numpy.load(fname, mmap_mode='r')
+    else:
+        worker_image = attachArray(name, shape, dtype)
+
+
+def sampleImageShard(args):
+    xs, ys, minz = args
+    return getSampleImageArray(xs, ys, worker_image, minz)
+
+
+def initOcl(name, shape, spec):
+    global worker_stl, worker_cutter
+    # opencamlib would start a thread per core in every worker
+    os.environ['OMP_NUM_THREADS'] = '1'
+    worker_stl = oclSTL(attachArray(name, shape, numpy.float64))
+    worker_cutter = oclCutter(spec)
+
+
+def sampleOclShard(args):
+    xs, ys, z = args
+    return oclDropCutter(worker_stl, worker_cutter, xs, ys, z)
+
+
+def initTriangles(name, shape):
+    global worker_triangles
+    worker_triangles = attachArray(name, shape, numpy.float64)
+
+
+def unionShard(args):
+    i0, i1 = args
+    return unionTriangles(worker_triangles[i0:i1])
+
+
+# main process side
+
+
+def getProcessCount(processes):
+    """processes setting, 0 means a process for every core"""
+    if processes <= 0:
+        processes = os.cpu_count() or 1
+    return processes
+
+
+def getPythonBinary():
+    """python interpreter for the workers, sys.executable is the blender binary in older blender versions"""
+    if 'python' in os.path.basename(sys.executable).lower():
+        return sys.executable
+    names = ['python%i.%i' % sys.version_info[:2], 'python3', 'python', 'python.exe']
+    for directory in (os.path.join(sys.prefix, 'bin'), sys.prefix):
+        for name in names:
+            fname = os.path.join(directory, name)
+            if os.path.isfile(fname):
+                return fname
+    return None
+
+
+def getWorkerModule():
+    """this module imported as top level module, whose functions can be called in the workers"""
+    path = os.path.dirname(os.path.abspath(__file__))
+    if 'sample_worker' not in sys.modules:
+        sys.path.append(path)
+        try:
+            import sample_worker
+        finally:
+            sys.path.remove(path)
+    return sys.modules['sample_worker']
+
+
+def runShards(processes, initializer, initargs, function, shards):
+    """runs function on all shards in worker processes, returns the results in order"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    python = getPythonBinary()
+    if python is None:
+        raise RuntimeError('python interpreter for worker processes not found')
+    context = multiprocessing.get_context('spawn')
+    context.set_executable(python)
+    # workers get sys.path of this process when they start, with the directory of this module
+    path = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(path)
+    # spawned workers run the main script of this process again, which is a script importing bpy when blender
+    # runs with -P, e.g. backgroundop.py. Without its file and spec the workers don't import it.
+    main = sys.modules['__main__']
+    mainfile = getattr(main, '__file__', None)
+    mainspec = getattr(main, '__spec__', None)
+    if mainfile is not None:
+        del main.__file__
+    main.__spec__ = None
+    try:
+        with ProcessPoolExecutor(max_workers=min(processes, len(shards)), mp_context=context,
+                                 initializer=initializer, initargs=initargs) as executor:
+            return list(executor.map(function, shards))
+    finally:
+        if mainfile is not None:
+            main.__file__ = mainfile
+        main.__spec__ = mainspec
+        sys.path.remove(path)
+
+
+def setError(message, e):
+    global error
+    error = '%s: %s' % (message, e)
+
+
+def getShards(n, processes):
+    """index ranges splitting n points to a few shards for each process"""
+    count = max(min(processes * SHARDS_PER_PROCESS, n // 1000), 1)
+    bounds = numpy.linspace(0, n, count + 1).astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def shareArray(a):
+    """copy of array in new shared memory"""
+    memory = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+    b = numpy.ndarray(a.shape, dtype=a.dtype, buffer=memory.buf)
+    b[:] = a
+    return memory
+
+
+def useParallel(processes, n, minimum=PARALLEL_MIN_POINTS):
+    return shared_memory is not None and getProcessCount(processes) > 1 and n >= minimum
+
+
+def sampleImageParallel(xs, ys, image, minz, processes):
+    """getSampleImageArray in worker processes. Returns None when it fails, so the caller can sample itself."""
+    processes = getProcessCount(processes)
+    worker = getWorkerModule()
+    shards = [(xs[i0:i1], ys[i0:i1], minz) for i0, i1 in getShards(len(xs), processes)]
+    memory = None
+    try:
+        if isinstance(image, numpy.memmap):
+            initargs = (None, image.shape, image.dtype, image.filename)
+        else:
+            image = numpy.ascontiguousarray(image)
+            memory = shareArray(image)
+            initargs = (memory.name, image.shape, image.dtype, None)
+        zs = runShards(processes, worker.initImage, initargs, worker.sampleImageShard, shards)
+    except Exception as e:
+        setError('parallel sampling failed, sampling in one process', e)
+        return None
+    finally:
+        if memory is not None:
+            memory.close()
+            memory.unlink()
+    return numpy.concatenate(zs)
+
+
+def sampleOclParallel(xs, ys, z, triangles, spec, processes):
+    """oclDropCutter in worker processes, every worker builds the surface once.
+    Returns None when it fails, so the caller can sample itself."""
+    processes = getProcessCount(processes)
+    worker = getWorkerModule()
+    shards = [(xs[i0:i1], ys[i0:i1], z) for i0, i1 in getShards(len(xs), processes)]
+    memory = None
+    try:
+        triangles = numpy.ascontiguousarray(triangles, dtype=numpy.float64)
+        memory = shareArray(triangles)
+        zs = runShards(processes, worker.initOcl, (memory.name, triangles.shape, spec), worker.sampleOclShard,
+                       shards)
+    except Exception as e:
+        setError('parallel sampling failed, sampling in one process', e)
+        return None
+    finally:
+        if memory is not None:
+            memory.close()
+            memory.unlink()
+    return numpy.concatenate(zs)
+
+
+def unionTrianglesParallel(xy, processes):
+    """unionTriangles in worker processes. Triangles should be sorted along an axis, so that every worker joins
+    a strip of the model and the strips are joined at the end. Returns None when it fails."""
+    processes = getProcessCount(processes)
+    worker = getWorkerModule()
+    memory = None
+    try:
+        xy = numpy.ascontiguousarray(xy, dtype=numpy.float64)
+        memory = shareArray(xy)
+        parts = runShards(processes, worker.initTriangles, (memory.name, xy.shape), worker.unionShard,
+                          getShards(len(xy), processes))
+    except Exception as e:
+        setError('parallel union failed, joining in one process', e)
+        return None
+    finally:
+        if memory is not None:
+            memory.close()
+            memory.unlink()
+    return shapely.union_all(parts)
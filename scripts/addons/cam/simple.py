@@ -178,6 +178,22 @@ def getSimulationPath():
     return iname
 
 
+def getSamplingProcesses():
+    """number of processes for parallel sampling from addon preferences, 0 means all cores"""
+    try:
+        return bpy.context.preferences.addons['cam'].preferences.sampling_processes
+    except (KeyError, AttributeError):
+        return 0
+
+
+def getBatchProcesses():
+    """number of background blender processes calculating operations at once, 0 means all cores"""
+    try:
+        return bpy.context.preferences.addons['cam'].preferences.batch_processes
+    except (KeyError, AttributeError):
+        return 0
+
+
 def safeFileName(name):  # for export gcode
     valid_chars = "-_.()%s%s" % (string.ascii_letters, string.digits)
     filename = ''.join(c for c in name if c in valid_chars)
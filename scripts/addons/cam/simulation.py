@@ -22,7 +22,6 @@
 # here is the main functionality of Blender CAM. The functions here are called with operators defined in ops.py.
 
 import bpy
-import mathutils
 import math
 import time
 from bpy.props import *
@@ -31,6 +30,9 @@ import numpy as np
 
 from cam import simple
 from cam import image_utils
+from cam import image_cache
+from cam import cycle_time
+from cam import cutter_profile
 
 
 def createSimulationObject(name, operations, i):
@@ -101,7 +103,7 @@ def doSimulation(name, operations):
     print('cp=', cp)
     iname = cp + '_sim.exr'
 
-    image_utils.numpysave(i, iname)
+    image_utils.numpysave(i, iname)  # displacement of the simulation object
     i = bpy.data.images.load(iname)
     createSimulationObject(name, operations, i)
 
@@ -118,163 +120,39 @@ def generateSimulationImage(operations, limits):
     resx = math.ceil(sx / simulation_detail) + 2 * borderwidth
     resy = math.ceil(sy / simulation_detail) + 2 * borderwidth
 
-    # create array in which simulation happens, similar to an image to be painted in.
-    si = np.array(0.1, dtype=float)
-    si.resize(resx, resy)
-    si.fill(maxz)
-
-    for o in operations:
-        ob = bpy.data.objects["cam_path_{}".format(o.name)]
-        m = ob.data
-        verts = m.vertices
-
-        if o.do_simulation_feedrate:
-            kname = 'feedrates'
-            m.use_customdata_edge_crease = True
-
-            if m.shape_keys is None or m.shape_keys.key_blocks.find(kname) == -1:
-                ob.shape_key_add()
-                if len(m.shape_keys.key_blocks) == 1:
-                    ob.shape_key_add()
-                shapek = m.shape_keys.key_blocks[-1]
-                shapek.name = kname
-            else:
-                shapek = m.shape_keys.key_blocks[kname]
-            shapek.data[0].co = (0.0, 0, 0)
-        # print(len(shapek.data))
-        # print(len(verts_rotations))
-
-        # print(r)
-
-        totalvolume = 0.0
-
-        cutterArray = getCutterArray(o, simulation_detail)
-        cutterArray = -cutterArray
-        lasts = verts[1].co
-        perc = -1
-        vtotal = len(verts)
-        dropped = 0
-
-        xs = 0
-        ys = 0
-
-        for i, vert in enumerate(verts):
-            if perc != int(100 * i / vtotal):
-                perc = int(100 * i / vtotal)
-                simple.progress('simulation', perc)
-            # progress('simulation ',int(100*i/l))
-
-            if i > 0:
-                volume = 0
-                volume_partial = 0
-                s = vert.co
-                v = s - lasts
-
-                l = v.length
-                if (lasts.z < maxz or s.z < maxz) and not (
-                        v.x == 0 and v.y == 0 and v.z > 0):  # only simulate inside material, and exclude lift-ups
-                    if (
-                            v.x == 0 and v.y == 0 and v.z < 0):
-                        # if the cutter goes straight down, we don't have to interpolate.
-                        pass
-
-                    elif v.length > simulation_detail:  # and not :
-
-                        v.length = simulation_detail
-                        lastxs = xs
-                        lastys = ys
-                        while v.length < l:
-                            xs = int((lasts.x + v.x - minx) / simulation_detail + borderwidth + simulation_detail / 2)
-                            # -middle
-                            ys = int((lasts.y + v.y - miny) / simulation_detail + borderwidth + simulation_detail / 2)
-                            # -middle
-                            z = lasts.z + v.z
-                            # print(z)
-                            if lastxs != xs or lastys != ys:
-                                volume_partial = simCutterSpot(xs, ys, z, cutterArray, si, o.do_simulation_feedrate)
-                                if o.do_simulation_feedrate:
-                                    totalvolume += volume
-                                    volume += volume_partial
-                                lastxs = xs
-                                lastys = ys
-                            else:
-                                dropped += 1
-                            v.length += simulation_detail
-
-                    xs = int((s.x - minx) / simulation_detail + borderwidth + simulation_detail / 2)  # -middle
-                    ys = int((s.y - miny) / simulation_detail + borderwidth + simulation_detail / 2)  # -middle
-                    volume_partial = simCutterSpot(xs, ys, s.z, cutterArray, si, o.do_simulation_feedrate)
-                if o.do_simulation_feedrate:  # compute volumes and write data into shapekey.
-                    volume += volume_partial
-                    totalvolume += volume
-                    if l > 0:
-                        load = volume / l
-                    else:
-                        load = 0
-
-                    # this will show the shapekey as debugging graph and will use same data to estimate parts
-                    # with heavy load
-                    if l != 0:
-                        shapek.data[i].co.y = (load) * 0.000002
-                    else:
-                        shapek.data[i].co.y = shapek.data[i - 1].co.y
-                    shapek.data[i].co.x = shapek.data[i - 1].co.x + l * 0.04
-                    shapek.data[i].co.z = 0
-                lasts = s
-
-        # print('dropped '+str(dropped))
-        if o.do_simulation_feedrate:  # smoothing ,but only backward!
-            xcoef = shapek.data[len(shapek.data) - 1].co.x / len(shapek.data)
-            for a in range(0, 10):
-                # print(shapek.data[-1].co)
-                nvals = []
-                val1 = 0  #
-                val2 = 0
-                w1 = 0  #
-                w2 = 0
-
-                for i, d in enumerate(shapek.data):
-                    val = d.co.y
-
-                    if i > 1:
-                        d1 = shapek.data[i - 1].co
-                        val1 = d1.y
-                        if d1.x - d.co.x != 0:
-                            w1 = 1 / (abs(d1.x - d.co.x) / xcoef)
-
-                    if i < len(shapek.data) - 1:
-                        d2 = shapek.data[i + 1].co
-                        val2 = d2.y
-                        if d2.x - d.co.x != 0:
-                            w2 = 1 / (abs(d2.x - d.co.x) / xcoef)
-
-                    # print(val,val1,val2,w1,w2)
-
-                    val = (val + val1 * w1 + val2 * w2) / (1.0 + w1 + w2)
-                    nvals.append(val)
-                for i, d in enumerate(shapek.data):
-                    d.co.y = nvals[i]
-
-            # apply mapping - convert the values to actual feedrates.
-            total_load = 0
-            max_load = 0
-            for i, d in enumerate(shapek.data):
-                total_load += d.co.y
-                max_load = max(max_load, d.co.y)
-            normal_load = total_load / len(shapek.data)
-
-            thres = 0.5
-
-            scale_graph = 0.05  # warning this has to be same as in export in utils!!!!
-
-            totverts = len(shapek.data)
-            for i, d in enumerate(shapek.data):
-                if d.co.y > normal_load:
-                    d.co.z = scale_graph * max(0.3, normal_load / d.co.y)
-                else:
-                    d.co.z = scale_graph * 1
-                if i < totverts - 1:
-                    m.edges[i].crease = d.co.y / (normal_load * 4)
+    paths = [bpy.data.objects["cam_path_{}".format(o.name)] for o in operations]
+
+    # stock is stored after every operation under a key chained from all operations before it,
+    # so simulation resumes after the last operation which didn't change.
+    keys = []
+    key = image_cache.getStockKey(limits, simulation_detail, borderwidth, resx, resy)
+    for o, ob in zip(operations, paths):
+        key = image_cache.getSimulationKey(key, o, ob)
+        keys.append(key)
+    resumable = 0
+    for o, ob in zip(operations, paths):  # feedrate shape keys of skipped operations have to exist
+        if o.do_simulation_feedrate and (ob.data.shape_keys is None
+                                         or ob.data.shape_keys.key_blocks.find('feedrates') == -1):
+            break
+        resumable += 1
+    start = 0
+    si = None
+    for i in range(resumable - 1, -1, -1):
+        si = image_cache.loadImage(keys[i])
+        if si is not None and si.shape == (resx, resy):
+            start = i + 1
+            break
+        si = None
+
+    if si is None:
+        # create array in which simulation happens, similar to an image to be painted in.
+        si = np.array(0.1, dtype=float)
+        si.resize(resx, resy)
+        si.fill(maxz)
+
+    for i in range(start, len(operations)):
+        simulateOperation(operations[i], paths[i], si, limits, simulation_detail, borderwidth)
+        image_cache.saveImage(keys[i], si)
 
     si = si[borderwidth:-borderwidth, borderwidth:-borderwidth]
     si += -minz
@@ -282,138 +160,223 @@ def generateSimulationImage(operations, limits):
     return si
 
 
+def simulateOperation(o, ob, si, limits, simulation_detail, borderwidth):
+    """simulates path of one operation into stock image si"""
+    minx, miny, minz, maxx, maxy, maxz = limits
+    m = ob.data
+    verts = m.vertices
+
+    if o.do_simulation_feedrate:
+        kname = 'feedrates'
+        m.use_customdata_edge_crease = True
+
+        if m.shape_keys is None or m.shape_keys.key_blocks.find(kname) == -1:
+            ob.shape_key_add()
+            if len(m.shape_keys.key_blocks) == 1:
+                ob.shape_key_add()
+            shapek = m.shape_keys.key_blocks[-1]
+            shapek.name = kname
+        else:
+            shapek = m.shape_keys.key_blocks[kname]
+        shapek.data[0].co = (0.0, 0, 0)
+    # print(len(shapek.data))
+    # print(len(verts_rotations))
+
+    # print(r)
+
+    cutterArray = getCutterArray(o, simulation_detail)
+    cutterArray = -cutterArray
+    simple.progress('simulation', 0)
+
+    co = np.empty(len(verts) * 3, dtype=np.float32)
+    verts.foreach_get('co', co)
+    co = co.reshape(-1, 3).astype(np.float64)
+    xs, ys, zs, segments, lengths = getStampPositions(co, minx, miny, maxz, simulation_detail, borderwidth)
+    volumes, depths = simCutterStamps(xs, ys, zs, segments, len(co), cutterArray, si, o.do_simulation_feedrate)
+
+    if o.do_simulation_feedrate and len(co) > 1:
+        machine = bpy.context.scene.cam_machine
+        feedrate = min(max(o.feedrate, machine.feedrate_min), machine.feedrate_max)
+        feeds, load = optimizeFeedrates(co, lengths, volumes * simulation_detail ** 2, depths,
+                                        o.cutter_diameter + 2 * o.skin, feedrate, machine.feedrate_min,
+                                        machine.feedrate_max, machine.acceleration, o.plunge_angle)
+
+        # x and y of the shapekey show the load as debugging graph, z is the feedrate factor used in export
+        scale_graph = 0.05  # warning this has to be same as in export in gcodepath!!!!
+        kco = np.zeros((len(co), 3))
+        kco[:, 0] = np.cumsum(lengths * 0.04)
+        kco[:, 1] = load * 50
+        kco[:, 2] = scale_graph * feeds / feedrate
+        kco[0, :2] = 0
+        shapek.data.foreach_set('co', kco.astype(np.float32).ravel())
+        normal_load = max(load.mean(), 1e-12)
+        crease = np.clip(load[:len(m.edges)] / (normal_load * 4), 0, 1)
+        m.edges.foreach_set('crease', crease.astype(np.float32))
+
+
+def getMovingSum(values, distance, window):
+    """sums of values within window along the path, distance is the path length at every vertex"""
+    cum = np.concatenate(((0,), np.cumsum(values)))
+    lo = np.searchsorted(distance, distance - window / 2, side='left')
+    hi = np.searchsorted(distance, distance + window / 2, side='right')
+    return cum[hi] - cum[lo]
+
+
+def optimizeFeedrates(co, lengths, volumes, depths, diameter, feedrate, feedrate_min, feedrate_max, acceleration,
+                      plunge_angle):
+    """feedrates of moves ending at vertices co, which keep the chip load of the cutter at the chip load
+    of the full width cut with feedrate.
+    Radial engagement of every move comes from its removed volume and depth of cut. Narrower cuts give
+    thinner chips, so they can go faster. Feedrates are limited by machine feedrates and by the acceleration
+    per axis along the path.
+    Returns feedrates per vertex and material removal rate at that feedrate, in cubic meters per minute."""
+    n = len(co)
+    distance = np.cumsum(lengths)
+    # engagement averaged over cutter radius along the path, single moves are too short to be measured
+    window = max(diameter / 2, 1e-9)
+    length_sum = getMovingSum(lengths, distance, window)
+    volume_sum = getMovingSum(volumes, distance, window)
+    cutting = depths > 0
+    depth_sum = getMovingSum(depths * lengths * cutting, distance, window)
+    cutting_length = getMovingSum(lengths * cutting, distance, window)
+    area = np.zeros(n)
+    depth = np.zeros(n)
+    np.divide(volume_sum, length_sum, out=area, where=length_sum > 0)
+    np.divide(depth_sum, cutting_length, out=depth, where=cutting_length > 0)
+    width = np.zeros(n)
+    np.divide(area, depth, out=width, where=depth > 0)
+    engagement = np.clip(width / diameter, 0, 1)
+
+    # radial chip thinning, chip thickness is feed per tooth * 2 * sqrt(e * (1 - e)) for engagement under half.
+    thinning = 2 * np.sqrt(engagement * (1 - engagement))
+    factor = np.full(n, np.inf)
+    np.divide(1.0, thinning, out=factor, where=(engagement < 0.5) & (thinning > 0))
+    factor[engagement >= 0.5] = 1
+    feeds = np.clip(feedrate * factor, feedrate_min, feedrate_max)
+
+    v = np.zeros((n, 3))
+    v[1:] = co[1:] - co[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        direction = np.abs(v) / lengths[:, np.newaxis]
+        # acceleration along the move is limited by the axis which reaches its limit first
+        limit = np.min(np.where(direction > 0, np.asarray(acceleration)[np.newaxis, :] / direction, np.inf), axis=1)
+        plunge = (lengths > 0) & (-v[:, 2] / lengths > np.cos(math.pi / 2 - plunge_angle))
+    limit[~np.isfinite(limit)] = max(acceleration)
+    feeds[plunge] = np.minimum(feeds[plunge], feedrate)
+
+    # feedrates are per minute, acceleration per second
+    feeds = cycle_time.limitAcceleration(feeds / 60, lengths, limit) * 60
+    feeds = np.maximum(feeds, feedrate_min)
+    return feeds, area * feeds
+
+
 def getCutterArray(operation, pixsize):
-    type = operation.cutter_type
-    # print('generating cutter')
-    r = operation.cutter_diameter / 2 + operation.skin  # /operation.pixsize
-    res = math.ceil((r * 2) / pixsize)
-    m = res / 2.0
-    car = np.array((0), dtype=float)
-    car.resize(res, res)
-    car.fill(-10)
-
-    v = mathutils.Vector((0, 0, 0))
-    ps = pixsize
-    if type == 'END':
-        for a in range(0, res):
-            v.x = (a + 0.5 - m) * ps
-            for b in range(0, res):
-                v.y = (b + 0.5 - m) * ps
-                if v.length <= r:
-                    car.itemset((a, b), 0)
-    elif type == 'BALL' or type == 'BALLNOSE':
-        for a in range(0, res):
-            v.x = (a + 0.5 - m) * ps
-            for b in range(0, res):
-                v.y = (b + 0.5 - m) * ps
-                if v.length <= r:
-                    z = math.sin(math.acos(v.length / r)) * r - r
-                    car.itemset((a, b), z)  # [a,b]=z
-
-    elif type == 'VCARVE':
-        angle = operation.cutter_tip_angle
-        s = math.tan(math.pi * (90 - angle / 2) / 180)  # angle in degrees
-        for a in range(0, res):
-            v.x = (a + 0.5 - m) * ps
-            for b in range(0, res):
-                v.y = (b + 0.5 - m) * ps
-                if v.length <= r:
-                    z = (-v.length * s)
-                    car.itemset((a, b), z)
-    elif type == 'CYLCONE':
-        angle = operation.cutter_tip_angle
-        cyl_r = operation.cylcone_diameter/2
-        s = math.tan(math.pi * (90 - angle / 2) / 180)  # angle in degrees
-        for a in range(0, res):
-            v.x = (a + 0.5 - m) * ps
-            for b in range(0, res):
-                v.y = (b + 0.5 - m) * ps
-                if v.length <= r:
-                    z = (-(v.length - cyl_r) * s)
-                    if v.length <= cyl_r:
-                        z = 0
-                    car.itemset((a, b), z)
-    elif type == 'BALLCONE':
-        angle = math.radians(operation.cutter_tip_angle)/2
-        ball_r = operation.ball_radius
-        cutter_r = operation.cutter_diameter / 2
-        conedepth = (cutter_r - ball_r)/math.tan(angle)
-        Ball_R = ball_r/math.cos(angle)
-        D_ofset = ball_r * math.tan(angle)
-        s = math.tan(math.pi/2-angle)
-        for a in range(0, res):
-            v.x = (a + 0.5 - m) * ps
-            for b in range(0, res):
-                v.y = (b + 0.5 - m) * ps
-                if v.length <= cutter_r:
-                    z = -(v.length - ball_r) * s - Ball_R + D_ofset
-                    if v.length <= ball_r:
-                        z = math.sin(math.acos(v.length / Ball_R)) * Ball_R - Ball_R
-                    car.itemset((a, b), z)
-    elif type == 'CUSTOM':
-        cutob = bpy.data.objects[operation.cutter_object_name]
-        scale = ((cutob.dimensions.x / cutob.scale.x) / 2) / r  #
-        # print(cutob.scale)
-        vstart = mathutils.Vector((0, 0, -10))
-        vend = mathutils.Vector((0, 0, 10))
-        print('sampling custom cutter')
-        maxz = -1
-        for a in range(0, res):
-            vstart.x = (a + 0.5 - m) * ps * scale
-            vend.x = vstart.x
-
-            for b in range(0, res):
-                vstart.y = (b + 0.5 - m) * ps * scale
-                vend.y = vstart.y
-                v = vend - vstart
-                c = cutob.ray_cast(vstart, v, distance=1.70141e+38)
-                if c[3] != -1:
-                    z = -c[1][2] / scale
-                    # print(c)
-                    if z > -9:
-                        # print(z)
-                        if z > maxz:
-                            maxz = z
-                        car.itemset((a, b), z)
-        car -= maxz
-    return car
-
-
-def simCutterSpot(xs, ys, z, cutterArray, si, getvolume=False):
-    """simulates a cutter cutting into stock, taking away the volume,
-    and optionally returning the volume that has been milled. This is now used for feedrate tweaking."""
-    m = int(cutterArray.shape[0] / 2)
+    """cutter footprint as height image, see cutter_profile"""
+    return cutter_profile.getCutterArray(operation, pixsize)
+
+
+def getStampPositions(co, minx, miny, maxz, simulation_detail, borderwidth):
+    """pixel positions and heights where the cutter is stamped into the stock along the path of vertices co.
+    Moves are interpolated at simulation_detail steps, like the cutter went through the path vertex by vertex.
+    Returns arrays xs, ys, zs and segments, the index of the move of every stamp, and lengths of the moves."""
+    n = len(co)
+    if n < 2:
+        e = np.zeros(0)
+        return e.astype(int), e.astype(int), e, e.astype(int), np.zeros(n)
+    starts = co[:-1].copy()
+    starts[0] = co[1]  # first move starts at the second vertex
+    ends = co[1:]
+    v = ends - starts
+    lengths = np.zeros(n)
+    lengths[1:] = np.sqrt((v * v).sum(axis=1))
+    flat = (v[:, 0] == 0) & (v[:, 1] == 0)
+    # only simulate inside material, and exclude lift-ups
+    simulated = ((starts[:, 2] < maxz) | (ends[:, 2] < maxz)) & ~(flat & (v[:, 2] > 0))
+    # if the cutter goes straight down, we don't have to interpolate.
+    steps = np.zeros(n - 1, dtype=int)
+    interpolated = simulated & ~flat & (lengths[1:] > simulation_detail)
+    steps[interpolated] = np.ceil(lengths[1:][interpolated] / simulation_detail).astype(int) - 1
+    counts = steps + simulated  # interpolated stamps and the stamp at the end of move
+
+    segments = np.repeat(np.arange(n - 1), counts)
+    first = np.cumsum(counts) - counts
+    k = np.arange(len(segments)) - first[segments] + 1  # step of the stamp within its move
+    atend = k > steps[segments]
+    t = np.ones(len(segments))
+    moving = ~atend
+    t[moving] = k[moving] * simulation_detail / lengths[1:][segments[moving]]
+    points = starts[segments] + v[segments] * t[:, None]
+    points[atend] = ends[segments[atend]]
+
+    xs = ((points[:, 0] - minx) / simulation_detail + borderwidth + simulation_detail / 2).astype(int)
+    ys = ((points[:, 1] - miny) / simulation_detail + borderwidth + simulation_detail / 2).astype(int)
+    # interpolated stamps on the same pixel as the stamp before are dropped
+    if len(xs) > 0:
+        same = np.zeros(len(xs), dtype=bool)
+        same[0] = xs[0] == 0 and ys[0] == 0
+        same[1:] = (xs[1:] == xs[:-1]) & (ys[1:] == ys[:-1])
+        keep = atend | ~same
+        xs, ys, points, segments = xs[keep], ys[keep], points[keep], segments[keep]
+    return xs, ys, points[:, 2], segments + 1, lengths
+
+
+def simCutterStamps(xs, ys, zs, segments, nsegments, cutterArray, si, getvolume=False, batchsize=4000000):
+    """simulates cutter stamped at all positions xs, ys with heights zs into stock si, in order.
+    Stamps are applied in batches, with a scatter minimum into the image.
+    Optionally returns volume taken away by every segment, indexed by segments of the stamps,
+    and the largest depth it cut into the stock."""
+    volumes = np.zeros(nsegments) if getvolume else None
+    depths = np.zeros(nsegments) if getvolume else None
+    if len(xs) == 0:
+        return volumes, depths
     size = cutterArray.shape[0]
-    if xs > m and xs < si.shape[0] - m and ys > m and ys < si.shape[1] - m:  # whole cutter in image there
-        if getvolume:
-            volarray = si[xs - m:xs - m + size, ys - m:ys - m + size].copy()
-        si[xs - m:xs - m + size, ys - m:ys - m + size] = np.minimum(si[xs - m:xs - m + size, ys - m:ys - m + size],
-                                                                    cutterArray + z)
-        if getvolume:
-            volarray = si[xs - m:xs - m + size, ys - m:ys - m + size] - volarray
-            vsum = abs(volarray.sum())
-            # print(vsum)
-            return vsum
-
-    elif xs > -m and xs < si.shape[0] + m and ys > -m and ys < si.shape[1] + m:
-        # part of cutter in image, for extra large cutters
-
-        startx = max(0, xs - m)
-        starty = max(0, ys - m)
-        endx = min(si.shape[0], xs - m + size)
-        endy = min(si.shape[0], ys - m + size)
-        castartx = max(0, m - xs)
-        castarty = max(0, m - ys)
-        caendx = min(size, si.shape[0] - xs + m)
-        caendy = min(size, si.shape[1] - ys + m)
-
-        if getvolume:
-            volarray = si[startx:endx, starty:endy].copy()
-        si[startx:endx, starty:endy] = np.minimum(si[startx:endx, starty:endy],
-                                                  cutterArray[castartx:caendx, castarty:caendy] + z)
+    m = int(size / 2)
+    ca, cb = np.nonzero(cutterArray < si.max() - zs.min())  # other cells of the cutter can't touch the stock
+    cutter = cutterArray[ca, cb]
+    ca = ca - m
+    cb = cb - m
+    flat = si.reshape(-1)
+    step = max(1, batchsize // max(len(cutter), 1))
+    for start in range(0, len(xs), step):
+        end = min(start + step, len(xs))
+        px = (xs[start:end, None] + ca[None, :]).ravel()
+        py = (ys[start:end, None] + cb[None, :]).ravel()
+        values = (zs[start:end, None] + cutter[None, :]).ravel()
+        inside = (px >= 0) & (px < si.shape[0]) & (py >= 0) & (py < si.shape[1])
+        pixels = px * si.shape[1] + py
+        inside[inside] = values[inside] < flat[pixels[inside]]  # only stamps cutting something matter
+        pixels = pixels[inside]
+        values = values[inside]
         if getvolume:
-            volarray = si[startx:endx, starty:endy] - volarray
-            vsum = abs(volarray.sum())
-            # print(vsum)
-            return vsum
-    return 0
+            stamps = np.repeat(np.arange(start, end), len(cutter))[inside]
+            getStampVolumes(flat, pixels, values, segments[stamps], volumes, depths)
+        np.minimum.at(flat, pixels, values)
+        simple.progress('simulation', int(100 * end / len(xs)))
+    return volumes, depths
+
+
+def getStampVolumes(flat, pixels, values, segments, volumes, depths):
+    """adds volume taken away by every segment to volumes and its depth of cut to depths,
+    when stamps are applied in their order.
+    Stamps must be ordered as they are cut, every pixel gets the running minimum of its stamps."""
+    if len(pixels) == 0:
+        return
+    order = np.argsort(pixels, kind='stable')  # keeps the cutting order for every pixel
+    pixels = pixels[order]
+    values = values[order]
+    segments = segments[order]
+    newpixel = np.ones(len(pixels), dtype=bool)
+    newpixel[1:] = pixels[1:] != pixels[:-1]
+    group = np.cumsum(newpixel) - 1
+    before = flat[pixels[newpixel]]
+    # running minimum restarting at every pixel - each group is shifted below all groups before it
+    span = max(before.max() - values.min(), 0) + 1.0
+    shift = group * span
+    running = np.minimum.accumulate(values - shift)
+    running = np.minimum(running + shift, before[group])
+    previous = np.empty(len(running))
+    previous[newpixel] = before
+    previous[~newpixel] = running[:-1][~newpixel[1:]]
+    removed = previous - running
+    volumes += np.bincount(segments, weights=removed, minlength=len(volumes))
+    np.maximum.at(depths, segments, removed)
@@ -25,6 +25,7 @@ import bpy
 from bpy.props import *
 import time
 import math
+import numpy
 from math import *
 from bpy_extras import object_utils
 from cam import chunk
@@ -41,6 +42,8 @@ from cam import polygon_utils_cam
 from cam.polygon_utils_cam import *
 from cam import image_utils
 from cam.image_utils import *
+from cam import cycle_time
+from cam import profiling
 
 from shapely.geometry import polygon as spolygon
 from shapely import geometry as sgeometry
@@ -50,6 +53,7 @@ SHAPELY = True
 
 
 # cutout strategy is completely here:
+@profiling.timed('cutout')
 def cutout(o):
     max_depth = checkminz(o)
     cutter_angle = math.radians(o.cutter_tip_angle / 2)
@@ -200,6 +204,7 @@ def cutout(o):
     chunksToMesh(chunks, o)
 
 
+@profiling.timed('curve')
 def curve(o):
     print('operation: curve')
     pathSamples = []
@@ -242,6 +247,7 @@ def curve(o):
         chunksToMesh(pathSamples, o)
 
 
+@profiling.timed('projected curve')
 def proj_curve(s, o):
     print('operation: projected curve')
     pathSamples = []
@@ -293,6 +299,7 @@ def proj_curve(s, o):
     chunksToMesh(chunks, o)
 
 
+@profiling.timed('pocket')
 def pocket(o):
     print('operation: pocket')
     scene = bpy.context.scene
@@ -330,7 +337,7 @@ def pocket(o):
         nchunks = shapelyToChunks(p, o.min.z)
         # print("nchunks")
         pnew = p.buffer(-o.dist_between_paths, o.circle_detail)
-        # print("pnew")
+        profiling.count('shapely ops')
 
         nchunks = limitChunks(nchunks, o)
         chunksFromCurve.extend(nchunks)
@@ -472,6 +479,7 @@ def pocket(o):
         chunksToMesh(chunks, o)  # make normal pocket path
 
 
+@profiling.timed('drill')
 def drill(o):
     print('operation: Drill')
     chunks = []
@@ -566,13 +574,42 @@ def drill(o):
     chunksToMesh(chunklayers, o)
 
 
+def getVoronoiEdges(verts, xbuff=5, ybuff=5):
+    """vertices as Nx2 array and edges as Mx2 array of vertex indices of the voronoi diagram of points verts.
+    Computed by GEOS through shapely, the python Fortune sweep of cam.voronoi is used when it's not available."""
+    try:
+        from shapely.ops import voronoi_diagram
+    except ImportError:  # shapely older than 1.8
+        voronoi_diagram = None
+    if voronoi_diagram is None:
+        from cam.voronoi import computeVoronoiDiagram
+        vertsPts = [Point(vert[0], vert[1], vert[2]) for vert in verts]
+        pts, edgesIdx = computeVoronoiDiagram(vertsPts, xbuff, ybuff, polygonsOutput=False, formatOutput=True)
+        return numpy.array([(p[0], p[1]) for p in pts]).reshape(-1, 2), numpy.array(edgesIdx).reshape(-1, 2)
+
+    diagram = voronoi_diagram(sgeometry.MultiPoint(numpy.array(verts)[:, :2]), edges=True)
+    lines = []
+    parts = [diagram]
+    while len(parts) > 0:  # edges come as lines in a collection of multilinestrings
+        g = parts.pop()
+        if hasattr(g, 'geoms'):
+            parts.extend(g.geoms)
+        elif not g.is_empty:
+            lines.append(numpy.asarray(g.coords)[:, :2])
+    if len(lines) == 0:
+        return numpy.zeros((0, 2)), numpy.zeros((0, 2), dtype=int)
+    segments = numpy.concatenate([numpy.stack((l[:-1], l[1:]), axis=1) for l in lines])
+    # edges share exactly the same vertex coordinates
+    pts, index = numpy.unique(segments.reshape(-1, 2), axis=0, return_inverse=True)
+    return pts, index.reshape(-1, 2)
+
+
+@profiling.timed('medial axis')
 def medial_axis(o):
     print('operation: Medial Axis')
 
     simple.remove_multiple("medialMesh")
 
-    from cam.voronoi import Site, computeVoronoiDiagram
-
     chunks = []
 
     gpoly = spolygon.Polygon()
@@ -610,7 +647,6 @@ def medial_axis(o):
 
     polys = utils.getOperationSilhouete(o)
     mpoly = sgeometry.shape(polys)
-    mpoly_boundary = mpoly.boundary
     ipol = 0
     for poly in polys.geoms:
         ipol = ipol + 1
@@ -640,69 +676,28 @@ def medial_axis(o):
             return {'FINISHED'}
         # Create diagram
         print("Tesselation... (" + str(nVerts) + " points)")
-        xbuff, ybuff = 5, 5  # %
-        zPosition = 0
-        vertsPts = [Point(vert[0], vert[1], vert[2]) for vert in verts]
-        # vertsPts= [Point(vert[0], vert[1]) for vert in verts]
-
-        pts, edgesIdx = computeVoronoiDiagram(vertsPts, xbuff, ybuff, polygonsOutput=False, formatOutput=True)
+        pts, edgesIdx = getVoronoiEdges(verts)
 
-        # pts=[[pt[0], pt[1], zPosition] for pt in pts]
-        newIdx = 0
-        vertr = []
-        filteredPts = []
         print('filter points')
-        ipts = 0
-        for p in pts:
-            ipts = ipts + 1
-            if ipts % 500 == 0:
-                sys.stdout.write('\r')
-                # the exact output you're looking for:
-                prog_message = "points: " + str(ipts) + " / " + str(len(pts)) + " " + str(
-                    round(100 * ipts / len(pts))) + "%"
-                sys.stdout.write(prog_message)
-                sys.stdout.flush()
-
-            if not poly.contains(sgeometry.Point(p)):
-                vertr.append((True, -1))
-            else:
-                vertr.append((False, newIdx))
-                if o.cutter_type == 'VCARVE':
-                    # start the z depth calc from the "start depth" of the operation.
-                    z = o.maxz - mpoly.boundary.distance(sgeometry.Point(p)) * slope
-                    if z < maxdepth:
-                        z = maxdepth
-                elif o.cutter_type == 'BALL' or o.cutter_type == 'BALLNOSE':
-                    d = mpoly_boundary.distance(sgeometry.Point(p))
-                    r = new_cutter_diameter / 2.0
-                    if d >= r:
-                        z = -r
-                    else:
-                        # print(r, d)
-                        z = -r + sqrt(r * r - d * d)
-                else:
-                    z = 0  #
-                # print(mpoly.distance(sgeometry.Point(0,0)))
-                # if(z!=0):print(z)
-                filteredPts.append((p[0], p[1], z))
-                newIdx += 1
+        # voronoi vertices outside the polygon are excluded, depth is given by distance to the boundary
+        inside = polygon_utils_cam.containsPoints(poly, pts[:, 0], pts[:, 1])
+        filteredPts = pts[inside]
+        d = polygon_utils_cam.getBoundaryDistance(mpoly, filteredPts[:, 0], filteredPts[:, 1])
+        if o.cutter_type == 'VCARVE':
+            # start the z depth calc from the "start depth" of the operation.
+            z = numpy.maximum(o.maxz - d * slope, maxdepth)
+        elif o.cutter_type == 'BALL' or o.cutter_type == 'BALLNOSE':
+            r = new_cutter_diameter / 2.0
+            z = numpy.where(d >= r, -r, -r + numpy.sqrt(numpy.maximum(r * r - d * d, 0)))
+        else:
+            z = numpy.zeros(len(filteredPts))
+        filteredPts = numpy.column_stack((filteredPts, z))
 
         print('filter edges')
-        filteredEdgs = []
-        ledges = []
-        for e in edgesIdx:
-            do = True
-            # p1 = pts[e[0]]
-            # p2 = pts[e[1]]
-            # print(p1,p2,len(vertr))
-            if vertr[e[0]][0]:  # exclude edges with allready excluded points
-                do = False
-            elif vertr[e[1]][0]:
-                do = False
-            if do:
-                filteredEdgs.append((vertr[e[0]][1], vertr[e[1]][1]))
-                ledges.append(sgeometry.LineString((filteredPts[vertr[e[0]][1]], filteredPts[vertr[e[1]][1]])))
-        # print(ledges[-1].has_z)
+        # exclude edges with allready excluded points
+        newIdx = numpy.cumsum(inside) - 1
+        edgesIdx = edgesIdx[inside[edgesIdx[:, 0]] & inside[edgesIdx[:, 1]]]
+        ledges = sgeometry.MultiLineString(list(filteredPts[newIdx[edgesIdx]]))
 
         bufpoly = poly.buffer(-new_cutter_diameter / 2, resolution=64)
 
@@ -776,6 +771,7 @@ def getLayers(operation, startdepth, enddepth):
     return layers
 
 
+@profiling.timed('chunksToMesh')
 def chunksToMesh(chunks, o):
     """convert sampled chunks to path, optimization of paths"""
     t = time.time()
@@ -820,36 +816,37 @@ def chunksToMesh(chunks, o):
         ch = chunks[chi]
         # print(chunks)
         # print (ch)
-        if len(ch.points) > 0:  # TODO: there is a case where parallel+layers+zigzag ramps send empty chunks here...
+        if ch.count() > 0:  # TODO: there is a case where parallel+layers+zigzag ramps send empty chunks here...
             # print(len(ch.points))
             nverts = []
             if o.optimize:
                 ch = optimizeChunk(ch, o)
+            points = ch.getPointsArray()
 
             # lift and drop
 
             if lifted:  # did the cutter lift before? if yes, put a new position above of the first point of next chunk.
                 if o.machine_axes == '3' or (o.machine_axes == '5' and o.strategy5axis == 'INDEXED') or (
                         o.machine_axes == '4' and o.strategy4axis == 'INDEXED'):
-                    v = (ch.points[0][0], ch.points[0][1], free_movement_height)
+                    v = (points[0][0], points[0][1], free_movement_height)
                 else:  # otherwise, continue with the next chunk without lifting/dropping
-                    v = ch.startpoints[0]  # startpoints=retract points
-                    verts_rotations.append(ch.rotations[0])
+                    v = ch.getStartpointsArray()[0]  # startpoints=retract points
+                    verts_rotations.append(ch.getRotationsArray()[0])
                 verts.append(v)
 
             # add whole chunk
-            verts.extend(ch.points)
+            verts.append(points)
 
             # add rotations for n-axis
             if o.machine_axes != '3':
-                verts_rotations.extend(ch.rotations)
+                verts_rotations.append(ch.getRotationsArray())
 
             lift = True
             # check if lifting should happen
-            if chi < len(chunks) - 1 and len(chunks[chi + 1].points) > 0:
+            if chi < len(chunks) - 1 and chunks[chi + 1].count() > 0:
                 # TODO: remake this for n axis, and this check should be somewhere else...
-                last = Vector(ch.points[-1])
-                first = Vector(chunks[chi + 1].points[0])
+                last = Vector(points[-1])
+                first = Vector(chunks[chi + 1].getPoint(0))
                 vect = first - last
                 if (o.machine_axes == '3' and (o.strategy == 'PARALLEL' or o.strategy == 'CROSS')
                     and vect.z == 0 and vect.length < o.dist_between_paths * 2.5) \
@@ -862,10 +859,10 @@ def chunksToMesh(chunks, o):
             if lift:
                 if o.machine_axes == '3' or (o.machine_axes == '5' and o.strategy5axis == 'INDEXED') or (
                         o.machine_axes == '4' and o.strategy4axis == 'INDEXED'):
-                    v = (ch.points[-1][0], ch.points[-1][1], free_movement_height)
+                    v = (points[-1][0], points[-1][1], free_movement_height)
                 else:
-                    v = ch.startpoints[-1]
-                    verts_rotations.append(ch.rotations[-1])
+                    v = ch.getStartpointsArray()[-1]
+                    verts_rotations.append(ch.getRotationsArray()[-1])
                 verts.append(v)
             lifted = lift
     # print(verts_rotations)
@@ -875,15 +872,21 @@ def chunksToMesh(chunks, o):
     t = time.time()
 
     # actual blender object generation starts here:
-    edges = []
-    for a in range(0, len(verts) - 1):
-        edges.append((a, a + 1))
+    # chunks are kept as arrays and written to the mesh in one go, without building a list of all vertices.
+    verts = numpy.concatenate([numpy.asarray(v, dtype=numpy.float64).reshape(-1, 3) for v in verts]) \
+        if len(verts) > 0 else numpy.zeros((0, 3))
+    edges = numpy.arange(max(len(verts) - 1, 0), dtype=numpy.int32).repeat(2)
+    edges[1::2] += 1
 
     oname = "cam_path_{}".format(o.name)
 
     mesh = bpy.data.meshes.new(oname)
     mesh.name = oname
-    mesh.from_pydata(verts, edges, [])
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set('co', verts.astype(numpy.float32).ravel())
+    mesh.edges.add(len(edges) // 2)
+    mesh.edges.foreach_set('vertices', edges)
+    mesh.update()
 
     if oname in s.objects:
         s.objects[oname].data = mesh
@@ -899,13 +902,14 @@ def chunksToMesh(chunks, o):
         ob.shape_key_add()
         shapek = mesh.shape_keys.key_blocks[1]
         shapek.name = 'rotations'
-        print(len(shapek.data))
-        print(len(verts_rotations))
-
-        for i, co in enumerate(verts_rotations):  # TODO: optimize this. this is just rewritten too many times...
-            shapek.data[i].co = co
+        # rotations of chunks are arrays too, single rotations of retract points are rows
+        verts_rotations = numpy.concatenate([numpy.asarray(r, dtype=numpy.float64).reshape(-1, 3)
+                                             for r in verts_rotations]) \
+            if len(verts_rotations) > 0 else numpy.zeros((0, 3))
+        shapek.data.foreach_set('co', verts_rotations.astype(numpy.float32).ravel())
 
     print(time.time() - t)
+    o.duration = cycle_time.getPathDuration(o, mesh)
 
     ob.location = (0, 0, 0)
     o.path_object_name = oname
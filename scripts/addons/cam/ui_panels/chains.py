@@ -66,6 +66,8 @@ class CAM_CHAINS_Panel(CAMButtonsPanel, bpy.types.Panel):
                     if chain.valid:
                         pass
                         layout.operator("object.calculate_cam_paths_chain", text="Calculate chain paths & Export Gcode")
+                        layout.operator("object.calculate_cam_paths_all",
+                                        text="Calculate chain paths in background").source = 'CHAIN'
                         layout.operator("object.cam_export_paths_chain", text="Export chain gcode")
                         layout.operator("object.cam_simulate_chain", text="Simulate this chain")
                     else:
@@ -1,12 +1,17 @@
 import sys
+import json
 import bpy
 
 from cam.simple import strInUnits
 from cam.ui_panels.buttons_panel import CAMButtonsPanel
+from cam import profiling
 
 # Info panel
 # This panel gives general information about the current operation
 
+# parsed profile of the last drawn operation, panels are redrawn often
+parsed_profile = {'text': None, 'data': None}
+
 class CAM_INFO_Panel(CAMButtonsPanel, bpy.types.Panel):
     """CAM info panel"""
     bl_label = "CAM info & warnings"
@@ -21,6 +26,7 @@ class CAM_INFO_Panel(CAMButtonsPanel, bpy.types.Panel):
             self.draw_active_op_warnings()
             self.draw_active_op_data()
             self.draw_active_op_money_cost()
+            self.draw_active_op_profile()
         else:
             self.layout.label(text='No CAM operation created')
 
@@ -71,3 +77,29 @@ class CAM_INFO_Panel(CAMButtonsPanel, bpy.types.Panel):
         self.layout.label(text = "Operation cost: $%.2f (%.2f $/s)"
             % (active_op.duration * 60 * cost_per_second, cost_per_second)
         )
+
+    def draw_active_op_profile(self):
+        active_op = self.active_operation()
+        if active_op is None: return
+        if active_op.profile_data == '': return
+
+        if parsed_profile['text'] != active_op.profile_data:
+            parsed_profile['text'] = active_op.profile_data
+            parsed_profile['data'] = json.loads(active_op.profile_data)
+        data = parsed_profile['data']
+
+        box = self.layout.box()
+        box.label(text="Calculation profile:")
+        col = box.column(align=True)
+        for name, depth, duration, calls in profiling.getStageTimes(data):
+            text = "%s%s: %.3f s" % ("    " * depth, name, duration)
+            if calls > 1:
+                text += " (%i calls)" % calls
+            col.label(text=text)
+        for name, duration in data.get('times', {}).items():
+            col.label(text="%s: %.3f s" % (name, duration))
+        for name, n in data['counters'].items():
+            col.label(text="%s: %i" % (name, n))
+        if data['peak_memory'] is not None:
+            col.label(text="Peak memory: %i MB" % (data['peak_memory'] / 1048576))
+        box.operator("object.cam_export_profile", text="Export profile")
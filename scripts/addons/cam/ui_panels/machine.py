@@ -43,6 +43,9 @@ class CAM_MACHINE_Panel(CAMButtonsPanel, bpy.types.Panel):
             layout.prop(ao, 'feedrate_min')
             layout.prop(ao, 'feedrate_max')
             layout.prop(ao, 'feedrate_default')
+            layout.prop(ao, 'acceleration')
+            layout.prop(ao, 'axis_feedrate_max')
+            layout.prop(ao, 'junction_deviation')
             # TODO: spindle default and feedrate default should become part of the cutter definition...
             layout.prop(ao, 'spindle_min')
             layout.prop(ao, 'spindle_max')
@@ -56,6 +59,9 @@ class CAM_MACHINE_Panel(CAMButtonsPanel, bpy.types.Panel):
             if use_experimental:
                 layout.prop(ao, 'axis4')
                 layout.prop(ao, 'axis5')
+                if ao.axis4 or ao.axis5:
+                    layout.prop(ao, 'rotary_speed_max')
+                    layout.prop(ao, 'rotary_acceleration')
                 layout.prop(ao, 'collet_size')
 
                 layout.prop(ao, 'output_block_numbers')
@@ -1,5 +1,6 @@
 import bpy
 from cam.ui_panels.buttons_panel import CAMButtonsPanel
+from cam import batch
 
 # Operations panel
 # This panel displays the list of operations created by the user
@@ -23,6 +24,7 @@ class CAM_OPERATIONS_Panel(CAMButtonsPanel, bpy.types.Panel):
     def draw(self, context):
         self.context = context
         self.draw_operations_list()
+        self.draw_batch()
 
         # FIXME: is this ever used ?
         use_experimental = bpy.context.preferences.addons[
@@ -74,6 +76,25 @@ class CAM_OPERATIONS_Panel(CAMButtonsPanel, bpy.types.Panel):
             "scene.cam_operation_move", icon="TRIA_DOWN", text=""
         ).direction = "DOWN"
 
+    # Draw progress of the background calculation of operations, or the button starting it
+    def draw_batch(self):
+        if not self.has_operations():
+            return
+        row = self.layout.row(align=True)
+        if batch.current is not None and batch.current.isRunning():
+            finished, failed, total, percent = batch.current.getProgress()
+            text = "Calculated %i of %i operations, %i%%" % (finished, total, percent)
+            if failed > 0:
+                text += ", %i failed" % failed
+            row.label(text=text)
+            row.operator(
+                "object.kill_calculate_cam_paths_background", text="", icon="CANCEL"
+            ).whole_batch = True
+        else:
+            row.operator(
+                "object.calculate_cam_paths_all", text="Calculate all paths in background"
+            ).source = "ALL"
+
     # Draw the list of preset operations, and preset add and remove buttons
     def draw_presets(self):
         row = self.layout.row(align=True)
@@ -90,8 +111,7 @@ class CAM_OPERATIONS_Panel(CAMButtonsPanel, bpy.types.Panel):
         layout = self.layout
         ao = self.active_operation()
 
-        # FIXME This does not seem to work - there is never a "Computing" label displayed
-        # while an operation is being calculated
+        # operations calculated in background show the label
         if ao.computing:
             row = layout.row(align=True)
             row.label(text="computing")
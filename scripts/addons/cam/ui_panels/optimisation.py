@@ -36,9 +36,14 @@ class CAM_OPTIMISATION_Panel(CAMButtonsPanel, bpy.types.Panel):
                             layout.label(text=f"Opencamlib v{opencamlib_version} installed")
                             layout.prop(ao, 'use_opencamlib')
 
+                    layout.prop(ao, 'silhouete_method')
                     if exclude_exact or not ao.use_exact:
                         layout.prop(ao, 'pixsize')
+                        layout.prop(ao, 'zbuffer_method')
                         layout.prop(ao, 'imgres_limit')
+                        layout.prop(ao, 'use_tiled_images')
+                        if ao.use_tiled_images:
+                            layout.prop(ao, 'image_tile_size')
 
                         sx = ao.max.x - ao.min.x
                         sy = ao.max.y - ao.min.y
@@ -30,9 +30,8 @@ from mathutils import *
 from bpy.props import *
 from bpy_extras import object_utils
 
-import sys
+import os
 import numpy
-import pickle
 
 from cam.chunk import *
 from cam.collision import *
@@ -42,6 +41,10 @@ from cam.polygon_utils_cam import *
 from cam.image_utils import *
 
 from cam.opencamlib.opencamlib import oclSample, oclSamplePoints, oclResampleChunks, oclGetWaterline
+from cam import sample_worker
+from cam import image_cache
+from cam import zbuffer
+from cam import profiling
 
 from shapely.geometry import polygon as spolygon
 from shapely.geometry import MultiPolygon
@@ -194,6 +197,7 @@ def getSplineBounds(ob, curve):
     return minx, miny, minz, maxx, maxy, maxz
 
 
+@profiling.timed('sources')
 def getOperationSources(o):
     if o.geometry_source == 'OBJECT':
         # bpy.ops.object.select_all(action='DESELECT')
@@ -234,6 +238,7 @@ def getOperationSources(o):
         o.onlycurves = False
 
 
+@profiling.timed('bounds')
 def getBounds(o):
     # print('kolikrat sem rpijde')
     if o.geometry_source == 'OBJECT' or o.geometry_source == 'COLLECTION' or o.geometry_source == 'CURVE':
@@ -313,26 +318,28 @@ def getBoundsMultiple(operations):
 
 
 def samplePathLow(o, ch1, ch2, dosample):
-    v1 = Vector(ch1.points[-1])
-    v2 = Vector(ch2.points[0])
+    v1 = Vector(ch1.getPoint(-1))
+    v2 = Vector(ch2.getPoint(0))
 
     v = v2 - v1
     d = v.length
     v.normalize()
 
-    vref = Vector((0, 0, 0))
+    # points every dist_along_paths between the chunks, without the ends
     bpath = camPathChunk([])
-    i = 0
-    while vref.length < d:
-        i += 1
-        vref = v * o.dist_along_paths * i
-        if vref.length < d:
-            p = v1 + vref
-            bpath.points.append([p.x, p.y, p.z])
+    steps = numpy.arange(1, int(d / o.dist_along_paths) + 2) * o.dist_along_paths
+    steps = steps[steps < d]
+    if len(steps) > 0:
+        pts = numpy.array(v1)[numpy.newaxis, :] + numpy.array(v)[numpy.newaxis, :] * steps[:, numpy.newaxis]
+        bpath.points = pts.tolist()
     # print('between path')
     # print(len(bpath))
     pixsize = o.pixsize
     if dosample:
+        # connection leaving the ambient would cut outside of the limits, chunks can't be connected low.
+        # chunk ends lie on the ambient border, so the few points are tested exactly, not in the mask image
+        if len(bpath.points) > 0 and not containsPoints(o.ambient, pts[:, 0], pts[:, 1]).all():
+            return None
         if not (o.use_opencamlib and o.use_exact):
             if o.use_exact:
                 if o.update_bullet_collision_tag:
@@ -344,18 +351,20 @@ def samplePathLow(o, ch1, ch2, dosample):
                     z = getSampleBullet(o.cutter_shape, p[0], p[1], cutterdepth, 1, o.minz)
                     if z > p[2]:
                         p[2] = z
-            else:
-                for p in bpath.points:
-                    xs = (p[0] - o.min.x) / pixsize + o.borderwidth + pixsize / 2  # -m
-                    ys = (p[1] - o.min.y) / pixsize + o.borderwidth + pixsize / 2  # -m
-                    z = getSampleImage((xs, ys), o.offset_image, o.minz) + o.skin
+            elif len(bpath.points) > 0:
+                pts = numpy.array(bpath.points, dtype=numpy.float64)
+                xs = (pts[:, 0] - o.min.x) / pixsize + o.borderwidth + pixsize / 2  # -m
+                ys = (pts[:, 1] - o.min.y) / pixsize + o.borderwidth + pixsize / 2  # -m
+                zs = (getSampleImageArray(xs, ys, o.offset_image, o.minz) + o.skin).tolist()
+                for p, z in zip(bpath.points, zs):
                     if z > p[2]:
                         p[2] = z
     return bpath
 
 
-# def threadedSampling():#not really possible at all without running more blenders for same operation :( python!
+# large paths are sampled by worker processes of sample_worker, which need no bpy.
 # samples in both modes now - image and bullet collision too.
+@profiling.timed('sample')
 def sampleChunks(o, pathSamples, layers):
     #
     minx, miny, minz, maxx, maxy, maxz = o.min.x, o.min.y, o.min.z, o.max.x, o.max.y, o.max.z
@@ -389,12 +398,28 @@ def sampleChunks(o, pathSamples, layers):
 
     totlen = 0  # total length of all chunks, to estimate sampling time.
     for ch in pathSamples:
-        totlen += len(ch.points)
+        totlen += ch.count()
+    profiling.count('points sampled', totlen)
     layerchunks = []
     minz = o.minz - 0.000001  # correction for image method problems
     layeractivechunks = []
     lastrunchunks = []
 
+    # memory mapped offset images of large areas are sampled by worker processes, which read the file in parallel.
+    # in memory images are sampled faster than the processes start.
+    parallelzs = None
+    if not o.use_exact and isinstance(o.offset_image, numpy.memmap) and \
+            sample_worker.useParallel(getSamplingProcesses(), totlen):
+        pts = numpy.concatenate([ch.getPointsArray()[:, :2] for ch in pathSamples])
+        xs = (pts[:, 0] - minx) / pixsize + coordoffset
+        ys = (pts[:, 1] - miny) / pixsize + coordoffset
+        parallelzs = sample_worker.sampleImageParallel(xs, ys, o.offset_image, minz, getSamplingProcesses())
+        if parallelzs is not None:
+            parallelzs += o.skin
+        else:
+            o.warnings += sample_worker.error + '\n'
+    sampled = 0
+
     for l in layers:
         layerchunks.append([])
         layeractivechunks.append(camPathChunk([]))
@@ -407,11 +432,6 @@ def sampleChunks(o, pathSamples, layers):
 
     n = 0
     last_percent = -1
-    # timing for optimisation
-    samplingtime = timinginit()
-    sortingtime = timinginit()
-    totaltime = timinginit()
-    timingstart(totaltime)
     lastz = minz
     for patternchunk in pathSamples:
         thisrunchunks = []
@@ -420,27 +440,34 @@ def sampleChunks(o, pathSamples, layers):
         lastlayer = None
         currentlayer = None
         lastsample = None
-        # threads_count=4
 
-        # for t in range(0,threads):
-
-        for s in patternchunk.points:
+        # batch sampling - ambient test and image/ocl heights are computed for the whole chunk at once,
+        # bullet collision still samples point by point because it uses the last sample.
+        if len(patternchunk.points) > 0:
+            with profiling.accumulate('sampling heights'):
+                pts = numpy.array(patternchunk.points, dtype=numpy.float64)
+                inambient = getAmbientMask(o).contains(pts[:, 0], pts[:, 1]).tolist()
+                if o.use_exact and o.use_opencamlib:
+                    zs = pts[:, 2].tolist()
+                elif parallelzs is not None:
+                    zs = parallelzs[sampled: sampled + len(pts)].tolist()
+                elif not o.use_exact:
+                    xs = (pts[:, 0] - minx) / pixsize + coordoffset
+                    ys = (pts[:, 1] - miny) / pixsize + coordoffset
+                    zs = (getSampleImageArray(xs, ys, o.offset_image, minz) + o.skin).tolist()
+                sampled += len(pts)
+
+        for si, s in enumerate(patternchunk.points):
             if o.strategy != 'WATERLINE' and int(100 * n / totlen) != last_percent:
                 last_percent = int(100 * n / totlen)
                 progress('sampling paths ', last_percent)
             n += 1
             x = s[0]
             y = s[1]
-            if not o.ambient.contains(sgeometry.Point(x, y)):
+            if not inambient[si]:
                 newsample = (x, y, 1)
             else:
-                if o.use_opencamlib and o.use_exact:
-                    z = s[2]
-                    if minz > z:
-                        z = minz
-                    newsample = (x, y, z)
-                # ampling
-                elif o.use_exact and not o.use_opencamlib:
+                if o.use_exact and not o.use_opencamlib:
 
                     if lastsample is not None:  # this is an optimalization,
                         # search only for near depths to the last sample. Saves about 30% of sampling time.
@@ -450,14 +477,8 @@ def sampleChunks(o, pathSamples, layers):
                             z = getSampleBullet(cutter, x, y, cutterdepth, lastsample[2] - o.dist_along_paths, minz)
                     else:
                         z = getSampleBullet(cutter, x, y, cutterdepth, 1, minz)
-
-                # print(z)
                 else:
-                    timingstart(samplingtime)
-                    xs = (x - minx) / pixsize + coordoffset
-                    ys = (y - miny) / pixsize + coordoffset
-                    timingadd(samplingtime)
-                    z = getSampleImage((xs, ys), o.offset_image, minz) + o.skin
+                    z = zs[si]
 
                 ################################
                 # handling samples
@@ -548,15 +569,13 @@ def sampleChunks(o, pathSamples, layers):
 
             # PARENTING
             if o.strategy == 'PARALLEL' or o.strategy == 'CROSS' or o.strategy == 'OUTLINEFILL':
-                timingstart(sortingtime)
-                parentChildDist(thisrunchunks[i], lastrunchunks[i], o)
-                timingadd(sortingtime)
+                with profiling.accumulate('parenting'):
+                    parentChildDist(thisrunchunks[i], lastrunchunks[i], o)
 
         lastrunchunks = thisrunchunks
 
     # print(len(layerchunks[i]))
     progress('checking relations between paths')
-    timingstart(sortingtime)
 
     if o.strategy == 'PARALLEL' or o.strategy == 'CROSS' or o.strategy == 'OUTLINEFILL':
         if len(layers) > 1:  # sorting help so that upper layers go first always
@@ -572,7 +591,6 @@ def sampleChunks(o, pathSamples, layers):
                         children.append(ch1)
 
                 parentChild(parents, children, o)  # parent only last and first chunk, before it did this for all.
-    timingadd(sortingtime)
     chunks = []
 
     for i, l in enumerate(layers):
@@ -581,13 +599,12 @@ def sampleChunks(o, pathSamples, layers):
                 ch.zstart = layers[i][0]
                 ch.zend = layers[i][1]
         chunks.extend(layerchunks[i])
-    timingadd(totaltime)
-    print(samplingtime)
-    print(sortingtime)
-    print(totaltime)
+    for ch in chunks:  # sampled paths can have millions of points, store them compactly
+        ch.pack()
     return chunks
 
 
+@profiling.timed('sample')
 def sampleChunksNAxis(o, pathSamples, layers):
     #
     minx, miny, minz, maxx, maxy, maxz = o.min.x, o.min.y, o.min.z, o.max.x, o.max.y, o.max.z
@@ -946,6 +963,7 @@ def overlaps(bb1, bb2):  # true if bb1 is child of bb2
         return True
 
 
+@profiling.timed('connect')
 def connectChunksLow(chunks, o):
     """ connects chunks that are close to each other without lifting, sampling them 'low' """
     if not o.stay_low or (o.strategy == 'CARVE' and o.carve_depth > 0):
@@ -970,9 +988,12 @@ def connectChunksLow(chunks, o):
     lastch = None
     i = len(chunks)
     pos = (0, 0, 0)
+    # points of the connected chunks are joined in one go at the end, so packed chunks stay arrays
+    parts = []
+    counts = []
 
     for ch in chunks:
-        if len(ch.points) > 0:
+        if ch.count() > 0:
             if lastch is not None and (ch.distStart(pos, o) < mergedist):
                 # CARVE should lift allways, when it goes below surface...
                 # print(mergedist,ch.dist(pos,o))
@@ -983,17 +1004,26 @@ def connectChunksLow(chunks, o):
                     # print('addbetwee')
                     between = samplePathLow(o, lastch, ch,
                                             False)  # other paths either dont use sampling or are sorted before it.
+            else:
+                between = None
+            if between is not None:
                 if o.use_opencamlib and o.use_exact and (
                         o.strategy == 'PARALLEL' or o.strategy == 'CROSS' or o.strategy == 'PENCIL'):
-                    chunks_to_resample.append(
-                        (connectedchunks[-1], len(connectedchunks[-1].points), len(between.points)))
+                    chunks_to_resample.append((connectedchunks[-1], counts[-1], between.count()))
 
-                connectedchunks[-1].points.extend(between.points)
-                connectedchunks[-1].points.extend(ch.points)
+                parts[-1].append(between.getPointsArray())
+                parts[-1].append(ch.getPointsArray())
+                counts[-1] += between.count() + ch.count()
             else:
                 connectedchunks.append(ch)
+                parts.append([ch.getPointsArray()])
+                counts.append(ch.count())
             lastch = ch
-            pos = lastch.points[-1]
+            pos = lastch.getPoint(-1)
+
+    for ch, chparts in zip(connectedchunks, parts):
+        if len(chparts) > 1:
+            ch.points = numpy.concatenate(chparts)
 
     if o.use_opencamlib and o.use_exact and o.strategy != 'CUTOUT' and o.strategy != 'POCKET':
         oclResampleChunks(o, chunks_to_resample)
@@ -1020,60 +1050,190 @@ def getClosest(o, pos, chunks):
     return ch
 
 
+class chunkGridIndex:
+    """uniform grid over the points which define distance to chunks - start points, both ends for meander
+    and all points of closed chunks. Chunks are added only when they can be milled (their children are sorted)
+    and removed when they get sorted."""
+
+    def __init__(self, chunks, o):
+        self.chunks = chunks
+        self.active = [False] * len(chunks)
+        self.activeset = set()
+        self.chunkpoints = []
+        allpoints = []
+        for ch in chunks:
+            if ch.count() == 0:
+                pts = []
+            elif ch.closed:
+                pts = [(p[0], p[1]) for p in ch.getPointsArray().tolist()]
+            elif o.movement_type == 'MEANDER':
+                p1 = ch.getPoint(0)
+                p2 = ch.getPoint(-1)
+                pts = [(p1[0], p1[1]), (p2[0], p2[1])]
+            else:
+                p1 = ch.getPoint(0)
+                pts = [(p1[0], p1[1])]
+            self.chunkpoints.append(pts)
+            allpoints.extend(pts)
+        if len(allpoints) > 0:
+            a = numpy.array(allpoints)
+            self.minx, self.miny = a.min(axis=0)
+            maxx, maxy = a.max(axis=0)
+            area = max((maxx - self.minx) * (maxy - self.miny), 1e-12)
+            # about 4 points in a cell
+            self.cellsize = max(math.sqrt(area * 4 / len(allpoints)), 1e-6)
+        else:
+            self.minx = self.miny = 0
+            self.cellsize = 1
+        self.cells = {}
+        self.maxcell = 0
+
+    def getCell(self, x, y):
+        return int(math.floor((x - self.minx) / self.cellsize)), int(math.floor((y - self.miny) / self.cellsize))
+
+    def add(self, chi):
+        if self.active[chi]:
+            return
+        self.active[chi] = True
+        self.activeset.add(chi)
+        for p in self.chunkpoints[chi]:
+            c = self.getCell(p[0], p[1])
+            self.cells.setdefault(c, []).append((p[0], p[1], chi))
+            self.maxcell = max(self.maxcell, abs(c[0]), abs(c[1]))
+
+    def remove(self, chi):
+        """chunk points stay in cells, they are dropped during queries"""
+        if self.active[chi]:
+            self.active[chi] = False
+            self.activeset.discard(chi)
+
+    def closest(self, pos):
+        """index of closest active chunk or None"""
+        if len(self.activeset) == 0:
+            return None
+        if len(self.activeset) <= 16:  # few chunks left, they can be far from each other
+            best = None
+            bestd = None
+            for chi in self.activeset:
+                for p in self.chunkpoints[chi]:
+                    d = math.hypot(pos[0] - p[0], pos[1] - p[1])
+                    if best is None or d < bestd or (d == bestd and chi < best):
+                        best = chi
+                        bestd = d
+            return best
+        cx, cy = self.getCell(pos[0], pos[1])
+        best = None
+        bestd = None
+        r = 0
+        # rings of cells around the position, until no closer point can be found
+        while r <= self.maxcell + max(abs(cx), abs(cy)) + 1:
+            for c in self.getRing(cx, cy, r):
+                cell = self.cells.get(c)
+                if cell is None:
+                    continue
+                alive = []
+                for p in cell:
+                    chi = p[2]
+                    if self.active[chi]:
+                        alive.append(p)
+                        d = math.hypot(pos[0] - p[0], pos[1] - p[1])
+                        if best is None or d < bestd or (d == bestd and chi < best):
+                            best = chi
+                            bestd = d
+                if len(alive) < len(cell):
+                    if len(alive) > 0:
+                        self.cells[c] = alive
+                    else:
+                        del self.cells[c]
+            if best is not None and bestd <= r * self.cellsize:
+                break
+            r += 1
+        return best
+
+    def getRing(self, cx, cy, r):
+        if r == 0:
+            return [(cx, cy)]
+        ring = []
+        for x in range(cx - r, cx + r + 1):
+            ring.append((x, cy - r))
+            ring.append((x, cy + r))
+        for y in range(cy - r + 1, cy + r):
+            ring.append((cx - r, y))
+            ring.append((cx + r, y))
+        return ring
+
+
+@profiling.timed('sort')
 def sortChunks(chunks, o):
     if o.strategy != 'WATERLINE':
         progress('sorting paths')
-    sys.setrecursionlimit(100000)  # the getNext() function of CamPathChunk was running out of recursion limits.
+    profiling.count('chunks sorted', len(chunks))
     sortedchunks = []
     chunks_to_resample = []
 
+    # chunks which can be milled - all their children are sorted - are kept in a spatial index.
+    index = chunkGridIndex(chunks, o)
+    chunkids = {}
+    for chi, ch in enumerate(chunks):
+        chunkids[id(ch)] = chi
+    unsorted = [True] * len(chunks)
+
+    def canGo(ch):
+        for child in ch.children:
+            if not child.sorted:
+                return False
+        return True
+
+    for chi, ch in enumerate(chunks):
+        if canGo(ch):
+            index.add(chi)
+
     lastch = None
-    i = len(chunks)
+    remaining = len(chunks)
     pos = (0, 0, 0)
-    # for ch in chunks:
-    # ch.getNext()#this stores the unsortedchildren properties
-    # print('numofchunks')
-    # print(len(chunks))
-    while len(chunks) > 0:
+    while remaining > 0:
         ch = None
         if len(sortedchunks) == 0 or len(
                 lastch.parents) == 0:  # first chunk or when there are no parents -> parents come after children here...
-            ch = getClosest(o, pos, chunks)
-        elif len(lastch.parents) > 0:  # looks in parents for next candidate, recursively
+            chi = index.closest(pos)
+            if chi is not None:
+                ch = chunks[chi]
+        elif len(lastch.parents) > 0:  # looks in parents for next candidate
             for parent in lastch.parents:
                 ch = parent.getNextClosest(o, pos)
                 if ch is not None:
                     break
             if ch is None:
-                ch = getClosest(o, pos, chunks)
-
-        if ch is not None:  # found next chunk, append it to list
-            # only adaptdist the chunk if it has not been sorted before
-            if not ch.sorted:
-                ch.adaptdist(pos, o)
-                ch.sorted = True
-            # print(len(ch.parents),'children')
-            chunks.remove(ch)
-            sortedchunks.append(ch)
-            lastch = ch
-            pos = lastch.points[-1]
-        # print(i, len(chunks))
-        # experimental fix for infinite loop problem
-        # else:
-        # THIS PROBLEM WASN'T HERE AT ALL. but keeping it here, it might fix the problems somwhere else:)
-        # can't find chunks close enough and still some chunks left
-        # to be sorted. For now just move the remaining chunks over to
-        # the sorted list.
-        # This fixes an infinite loop condition that occurs sometimes.
-        # This is a bandaid fix: need to find the root cause of this problem
-        # suspect it has to do with the sorted flag?
-        # print("no chunks found closest. Chunks not sorted: ", len(chunks))
-        # sortedchunks.extend(chunks)
-        # chunks[:] = []
-
-        i -= 1
-
-    sys.setrecursionlimit(1000)
+                chi = index.closest(pos)
+                if chi is not None:
+                    ch = chunks[chi]
+
+        if ch is None:
+            # no chunk can be milled, the hierarchy has a chunk whose children are missing.
+            print('chunks without sortable children: ', remaining)
+            for chi, ch in enumerate(chunks):
+                if unsorted[chi]:
+                    sortedchunks.append(ch)
+            break
+
+        # found next chunk, append it to list
+        # only adaptdist the chunk if it has not been sorted before
+        if not ch.sorted:
+            ch.adaptdist(pos, o)
+            ch.sorted = True
+        chi = chunkids[id(ch)]
+        unsorted[chi] = False
+        remaining -= 1
+        index.remove(chi)
+        for parent in ch.parents:
+            pi = chunkids.get(id(parent))
+            if pi is not None and unsorted[pi] and canGo(parent):
+                index.add(pi)
+        sortedchunks.append(ch)
+        lastch = ch
+        pos = lastch.getPoint(-1)
+
+    del chunks[:]
     if o.strategy != 'DRILL' and o.strategy != 'OUTLINEFILL':
         # THIS SHOULD AVOID ACTUALLY MOST STRATEGIES, THIS SHOULD BE DONE MANUALLY,
         # BECAUSE SOME STRATEGIES GET SORTED TWICE.
@@ -1148,6 +1308,7 @@ def cutloops(csource, parentloop, loops):
         cutloops(csource, l, loops)
 
 
+@profiling.timed('silhouette')
 def getOperationSilhouete(operation):
     """gets silhouete for the operation
         uses image thresholding for everything except curves.
@@ -1169,7 +1330,11 @@ def getOperationSilhouete(operation):
                 if ob.type == 'MESH':
                     totfaces += len(ob.data.polygons)
 
-        if (stype == 'OBJECTS' and totfaces > 200000) or stype == 'IMAGE':
+        if stype == 'OBJECTS' and operation.silhouete_method != 'AUTO':
+            use_image = operation.silhouete_method == 'IMAGE'
+        else:
+            use_image = totfaces > 200000
+        if (stype == 'OBJECTS' and use_image) or stype == 'IMAGE':
             print('image method')
             samples = renderSampleImage(operation)
             if stype == 'OBJECTS':
@@ -1187,13 +1352,15 @@ def getOperationSilhouete(operation):
         else:
             print('object method for retrieving silhouette')  #
             operation.silhouete = getObjectSilhouete(stype, objects=operation.objects,
-                                                     use_modifiers=operation.use_modifiers)
+                                                     use_modifiers=operation.use_modifiers,
+                                                     objectshash=image_cache.getOperationObjectsHash(operation),
+                                                     operation=operation)
 
         operation.update_silhouete_tag = False
     return operation.silhouete
 
 
-def getObjectSilhouete(stype, objects=None, use_modifiers=False):
+def getObjectSilhouete(stype, objects=None, use_modifiers=False, objectshash=None, operation=None):
     # o=operation
     if stype == 'CURVES':  # curve conversion to polygon format
         allchunks = []
@@ -1202,7 +1369,10 @@ def getObjectSilhouete(stype, objects=None, use_modifiers=False):
             allchunks.extend(chunks)
         silhouete = chunksToShapely(allchunks)
 
-    elif stype == 'OBJECTS':
+    elif stype == 'OBJECTS' and sample_worker.shapelyPolygons is not None:
+        silhouete = [getTrianglesSilhouete(objects, use_modifiers, objectshash, operation)]
+
+    elif stype == 'OBJECTS':  # shapely 1, polygon for every triangle
         totfaces = 0
         for ob in objects:
             totfaces += len(ob.data.polygons)
@@ -1245,6 +1415,7 @@ def getObjectSilhouete(stype, objects=None, use_modifiers=False):
                                 polys.append(p.buffer(e, resolution=0))
                         id += 1
 
+            profiling.count('shapely ops', len(polys))
             if totfaces < 20000:
                 p = sops.unary_union(polys)
             else:
@@ -1271,6 +1442,45 @@ def getObjectSilhouete(stype, objects=None, use_modifiers=False):
     return silhouete
 
 
+def getTrianglesSilhouete(objects, use_modifiers=False, objectshash=None, operation=None):
+    """union of triangles of the objects seen from the top, joined in worker processes for big meshes.
+    Cached by the hash of the geometry, objectshash when it is known already.
+    Failure of the workers is reported in the warnings of operation."""
+    if objectshash is None:
+        objectshash = image_cache.getObjectsHash(objects)
+    key = image_cache.getSilhoueteKey(objectshash, use_modifiers)
+    silhouete = image_cache.loadGeometry(key)
+    if silhouete is not None:
+        return silhouete
+    t = time.time()
+    print('shapely getting silhouette')
+    parts = []
+    for ob in objects:
+        triangles = zbuffer.getObjectTriangles(ob, use_modifiers)
+        if triangles is not None and len(triangles) > 0:
+            parts.append(sample_worker.getTopTriangles(triangles))
+    if len(parts) > 0:
+        xy = numpy.concatenate(parts)
+    else:
+        xy = numpy.zeros((0, 3, 2))
+    # sorted triangles make shards of the workers strips of the model, which have short borders to join
+    xy = xy[numpy.argsort(xy[:, :, 0].sum(axis=1), kind='stable')]
+    profiling.count('shapely ops', len(xy))
+
+    silhouete = None
+    processes = getSamplingProcesses()
+    if sample_worker.useParallel(processes, len(xy), sample_worker.PARALLEL_MIN_TRIANGLES):
+        silhouete = sample_worker.unionTrianglesParallel(xy, processes)
+        if silhouete is None and operation is not None:
+            operation.warnings += sample_worker.error + '\n'
+    if silhouete is None:
+        silhouete = sample_worker.unionTriangles(xy)
+    print(time.time() - t)
+    image_cache.saveGeometry(key, silhouete)
+    return silhouete
+
+
+@profiling.timed('ambient')
 def getAmbient(o):
     if o.update_ambient_tag:
         if o.ambient_cutter_restrict:  # cutter stays in ambient & limit curve
@@ -1640,44 +1850,67 @@ def rotTo2axes(e, axescombination):
     return (angle1, angle2)
 
 
-def reload_pathss(o):
-    oname = "cam_path_" + o.name
+def getPathResultFile(o):
+    """file with the path of operation o calculated in a background process"""
+    return getCachePath(o) + '.npz'
+
+
+def savePathResult(o):
+    """stores path of operation o with its shape keys, time estimate, warnings and profile in a npz file,
+    coordinates stay float32 like in the mesh"""
+    fname = getPathResultFile(o)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    arrays = {
+        'duration': numpy.array(o.duration),
+        'warnings': numpy.array(o.warnings),
+        'profile_data': numpy.array(o.profile_data),
+    }
+    ob = bpy.data.objects.get("cam_path_{}".format(o.name))
+    if ob is not None:
+        mesh = ob.data
+        co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get('co', co)
+        arrays['co'] = co.reshape(-1, 3)
+        if mesh.shape_keys is not None:
+            for key in mesh.shape_keys.key_blocks[1:]:  # rotations of 4 and 5 axis paths
+                kco = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+                key.data.foreach_get('co', kco)
+                arrays['key_' + key.name] = kco.reshape(-1, 3)
+    tmpname = fname[:-4] + '.tmp.npz'
+    with open(tmpname, 'wb') as f:
+        numpy.savez(f, **arrays)
+    os.replace(tmpname, fname)
+
+
+def reload_paths(o):
+    """loads path of operation o calculated in a background process, returns False when there is none"""
+    fname = getPathResultFile(o)
+    if not os.path.isfile(fname):
+        return False
+    with numpy.load(fname) as d:
+        o.duration = float(d['duration'])
+        o.warnings = str(d['warnings'])
+        o.profile_data = str(d['profile_data'])
+        if 'co' not in d:  # nothing to mill
+            return True
+        co = d['co']
+        keys = [(name[4:], d[name]) for name in d.files if name.startswith('key_')]
+
     s = bpy.context.scene
-    # for o in s.objects:
-    ob = None
+    oname = "cam_path_" + o.name
     old_pathmesh = None
     if oname in s.objects:
         old_pathmesh = s.objects[oname].data
-        ob = s.objects[oname]
-
-    picklepath = getCachePath(o) + '.pickle'
-    f = open(picklepath, 'rb')
-    d = pickle.load(f)
-    f.close()
-
-    # passed=False
-    # while not passed:
-    #     try:
-    #         f=open(picklepath,'rb')
-    #         d=pickle.load(f)
-    #         f.close()
-    #         passed=True
-    #     except:
-    #         print('sleep')
-    #         time.sleep(1)
-
-    o.warnings = d['warnings']
-    o.duration = d['duration']
-    verts = d['path']
-
-    edges = []
-    for a in range(0, len(verts) - 1):
-        edges.append((a, a + 1))
 
-    oname = "cam_path_" + o.name
+    edges = numpy.arange(max(len(co) - 1, 0), dtype=numpy.int32).repeat(2)
+    edges[1::2] += 1
     mesh = bpy.data.meshes.new(oname)
     mesh.name = oname
-    mesh.from_pydata(verts, edges, [])
+    mesh.vertices.add(len(co))
+    mesh.vertices.foreach_set('co', co.ravel())
+    mesh.edges.add(len(edges) // 2)
+    mesh.edges.foreach_set('vertices', edges)
+    mesh.update()
 
     if oname in s.objects:
         s.objects[oname].data = mesh
@@ -1686,9 +1919,14 @@ def reload_pathss(o):
         ob = bpy.context.active_object
         ob.name = oname
     ob = s.objects[oname]
+    if len(keys) > 0:
+        ob.shape_key_add()
+        for name, kco in keys:
+            ob.shape_key_add(name=name).data.foreach_set('co', kco.ravel())
     ob.location = (0, 0, 0)
     o.path_object_name = oname
     o.changed = False
 
     if old_pathmesh is not None:
         bpy.data.meshes.remove(old_pathmesh)
+    return True
@@ -0,0 +1,141 @@
+# blender CAM zbuffer.py (c) 2012 Vilem Novak
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+
+# software z-buffer - rasterizes triangles of the objects from the top into a height image with numpy.
+# gives the same image as rendering the depth, but doesn't need a render engine, so it works also in
+# background mode without GPU.
+
+import numpy
+
+import bpy
+
+from cam import simple
+
+BACKGROUND = 1.0 - 1e10  # height of empty pixels, like depth of background in render
+BATCH_SIZE = 4000000  # pixels of triangle bounding boxes tested at once
+
+
+def getObjectTriangles(ob, use_modifiers=True, world=True):
+    """triangles of object in world space as Nx9 array, like faces_from_mesh of the stl exporter.
+    With world False they stay in object space."""
+    if ob.mode == 'EDIT':
+        ob.update_from_editmode()
+    if use_modifiers:
+        mesh_owner = ob.evaluated_get(bpy.context.evaluated_depsgraph_get())
+    else:
+        mesh_owner = ob
+    try:
+        mesh = mesh_owner.to_mesh()
+    except RuntimeError:
+        return None
+    if mesh is None:
+        return None
+    if world:
+        mat = ob.matrix_world
+        mesh.transform(mat)
+        if mat.is_negative:
+            mesh.flip_normals()
+    mesh.calc_loop_triangles()
+    co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+    mesh.vertices.foreach_get('co', co)
+    indices = numpy.empty(len(mesh.loop_triangles) * 3, dtype=numpy.int32)
+    mesh.loop_triangles.foreach_get('vertices', indices)
+    mesh_owner.to_mesh_clear()
+    return co.reshape(-1, 3)[indices].reshape(-1, 9).astype(numpy.float64)
+
+
+def getObjectsTriangles(objects):
+    """triangles of all objects with evaluated modifiers, as they would be rendered"""
+    triangles = [getObjectTriangles(ob) for ob in objects]
+    triangles = [t for t in triangles if t is not None]
+    if len(triangles) == 0:
+        return numpy.zeros((0, 9))
+    return numpy.concatenate(triangles)
+
+
+def rasterizeTile(triangles, a, x0, y0, startx, starty, pixsize):
+    """rasterizes triangles into tile a, keeping the highest z in every pixel.
+    pixel i, j of the tile has its center at startx + (x0 + i + 0.5) * pixsize, starty + (y0 + j + 0.5) * pixsize"""
+    resx, resy = a.shape
+    t = triangles.reshape(-1, 3, 3)
+    # triangle corners in pixel coordinates of the tile, pixel centers are on whole numbers
+    px = (t[:, :, 0] - startx) / pixsize - 0.5 - x0
+    py = (t[:, :, 1] - starty) / pixsize - 0.5 - y0
+    ix0 = numpy.maximum(numpy.ceil(px.min(axis=1)), 0).astype(numpy.int64)
+    ix1 = numpy.minimum(numpy.floor(px.max(axis=1)), resx - 1).astype(numpy.int64) + 1
+    iy0 = numpy.maximum(numpy.ceil(py.min(axis=1)), 0).astype(numpy.int64)
+    iy1 = numpy.minimum(numpy.floor(py.max(axis=1)), resy - 1).astype(numpy.int64) + 1
+    # twice the area of triangles seen from the top, vertical triangles aren't visible
+    area = (px[:, 1] - px[:, 0]) * (py[:, 2] - py[:, 0]) - (px[:, 2] - px[:, 0]) * (py[:, 1] - py[:, 0])
+    visible = numpy.nonzero((ix1 > ix0) & (iy1 > iy0) & (area != 0))[0]
+    if len(visible) == 0:
+        return
+    width = ix1[visible] - ix0[visible]
+    counts = width * (iy1[visible] - iy0[visible])
+
+    flat = a.reshape(-1)
+    # batches of triangles, a triangle is never bigger than the tile
+    ends = numpy.cumsum(counts)
+    start = 0
+    while start < len(visible):
+        done = ends[start - 1] if start > 0 else 0
+        end = max(int(numpy.searchsorted(ends, done + BATCH_SIZE, side='right')), start + 1)
+        bt = visible[start:end]
+        bcounts = counts[start:end]
+        tri = numpy.repeat(numpy.arange(len(bt)), bcounts)
+        k = numpy.arange(len(tri)) - numpy.repeat(numpy.cumsum(bcounts) - bcounts, bcounts)
+        bwidth = width[start:end][tri]
+        x = ix0[bt][tri] + k % bwidth
+        y = iy0[bt][tri] + k // bwidth
+        tx = px[bt][tri]
+        ty = py[bt][tri]
+        # barycentric coordinates of pixel centers
+        w1 = ((x - tx[:, 0]) * (ty[:, 2] - ty[:, 0]) - (tx[:, 2] - tx[:, 0]) * (y - ty[:, 0])) / area[bt][tri]
+        w2 = ((tx[:, 1] - tx[:, 0]) * (y - ty[:, 0]) - (x - tx[:, 0]) * (ty[:, 1] - ty[:, 0])) / area[bt][tri]
+        w0 = 1 - w1 - w2
+        eps = -1e-9
+        inside = (w0 >= eps) & (w1 >= eps) & (w2 >= eps)
+        tz = t[bt, :, 2][tri[inside]]
+        z = w0[inside] * tz[:, 0] + w1[inside] * tz[:, 1] + w2[inside] * tz[:, 2]
+        numpy.maximum.at(flat, x[inside] * resy + y[inside], z)
+        start = end
+
+
+def rasterizeTriangles(triangles, a, startx, starty, pixsize, tilesize):
+    """height image of triangles from the top, in array a whose pixel 0, 0 has its lower left corner
+    at startx, starty. Works in tiles of tilesize, a can be memory mapped."""
+    resx, resy = a.shape
+    tiles = []
+    for x0 in range(0, resx, tilesize):
+        for y0 in range(0, resy, tilesize):
+            tiles.append((x0, min(resx, x0 + tilesize), y0, min(resy, y0 + tilesize)))
+    t = triangles.reshape(-1, 3, 3)
+    minx = (t[:, :, 0].min(axis=1) - startx) / pixsize - 0.5
+    maxx = (t[:, :, 0].max(axis=1) - startx) / pixsize - 0.5
+    miny = (t[:, :, 1].min(axis=1) - starty) / pixsize - 0.5
+    maxy = (t[:, :, 1].max(axis=1) - starty) / pixsize - 0.5
+    for ti, (x0, x1, y0, y1) in enumerate(tiles):
+        simple.progress('zbuffer tile ', int(ti * 100 / len(tiles)))
+        intile = (maxx >= x0 - 1) & (minx <= x1) & (maxy >= y0 - 1) & (miny <= y1)
+        tile = numpy.full((x1 - x0, y1 - y0), BACKGROUND)
+        rasterizeTile(triangles[intile], tile, x0, y0, startx, starty, pixsize)
+        a[x0:x1, y0:y1] = tile
+    return a